@@ -0,0 +1,183 @@
+import asyncio
+import time
+import aiohttp
+import crawl_metrics
+import robots_cache
+import http_session
+import request_policy
+
+
+async def download_robots(session, robot_url, limit, fetch_timeout=10):
+    """
+    Download a robots.txt file with aiohttp.
+
+    Args:
+        session - aiohttp.ClientSession
+        robot_url - URL of the robots.txt file
+        limit - asyncio.Semaphore capping the number of open connections
+        fetch_timeout - seconds to wait for the whole download; connect and read timeouts come from the shared request_policy
+
+    Returns:
+        dictionary in the same format as robots_cache.download_robots
+    """
+    entry = {'status_code': None, 'content': '', 'error': None}
+    policy = request_policy.get_policy()
+    timeout = aiohttp.ClientTimeout(total=fetch_timeout, sock_connect=policy.connect_timeout, sock_read=policy.read_timeout)
+    start = None
+    try:
+        async with limit:
+            start = time.perf_counter()
+            async with session.get(robot_url, max_redirects=10, timeout=timeout) as response:
+                entry['status_code'] = response.status
+                if response.status == 200:
+                    body = await response.content.read(robots_cache.MAX_ROBOTS_BYTES + 1)
+                    if len(body) > robots_cache.MAX_ROBOTS_BYTES:
+                        entry['error'] = 'content too long'
+                        body = body[:robots_cache.MAX_ROBOTS_BYTES]
+                    try:
+                        encoding = response.get_encoding()
+                    except (LookupError, RuntimeError):
+                        encoding = 'utf-8'
+                    entry['content'] = body.decode(encoding, errors='replace')
+    except aiohttp.ClientSSLError:
+        entry['error'] = 'SSL Error'
+    except asyncio.TimeoutError:
+        entry['error'] = 'timed out'
+    except aiohttp.TooManyRedirects:
+        entry['error'] = 'excessive redirects'
+    except (aiohttp.InvalidURL, ValueError):
+        entry['error'] = 'malformed URL'
+    except (aiohttp.ClientError, OSError):
+        entry['error'] = 'invalid URL'
+    #Time spent waiting for a free connection is left out
+    metrics = crawl_metrics.get_metrics()
+    if start is not None:
+        seconds = time.perf_counter() - start
+        metrics.observe('robots', seconds)
+        metrics.log('robots', url=robot_url, seconds=round(seconds, 4), status_code=entry['status_code'], error=entry['error'])
+    metrics.count('robots_download', entry['error'] or entry['status_code'])
+    return entry
+
+
+class AsyncRobotsChecker:
+    """
+    Checks robots.txt for many hosts at once from a single process, using asyncio and aiohttp, and parses it with the stdlib urllib.robotparser.
+
+    Results use the same values as get_scrapability.can_fetch (True, False, 'invalid URL', 'SSL Error', 'malformed URL', 'content too long', 'site skipped'),
+    and hosts that take longer than the timeout are 'timed out', so spreadsheets from either backend can be compared.
+    Downloads go through robots_cache, so files already cached by either script are not downloaded again.
+    """
+
+    def __init__(self, concurrency=1000, timeout=20, cache=None, skip_urls=()):
+        """
+        Args:
+            concurrency - maximum number of robots.txt downloads at once
+            timeout - seconds a host may take before its rows are marked 'timed out'
+            cache - robots_cache.RobotsCache to use; defaults to the shared cache
+            skip_urls - URLs to mark 'site skipped' without checking
+        """
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.cache = cache if cache is not None else robots_cache.get_cache()
+        self.skip_urls = set(skip_urls)
+        self.in_flight = {}
+
+    async def download_and_store(self, session, limit, robot_url):
+        #Runs once per download, however many rows are waiting on it; the SQLite write runs on a worker thread so it doesn't hold up other downloads
+        try:
+            entry = await download_robots(session, robot_url, limit)
+            return await asyncio.get_running_loop().run_in_executor(None, self.cache.store, robot_url, entry)
+        finally:
+            self.in_flight.pop(robot_url, None)
+
+    async def get_entry(self, session, limit, robot_url):
+        #Cached files are used as they are; a file already being downloaded for another row is waited on rather than downloaded twice
+        if robot_url not in self.in_flight:
+            #The cache may read SQLite, so the lookup runs on a worker thread too
+            entry = await asyncio.get_running_loop().run_in_executor(None, self.cache.lookup, robot_url)
+            if entry is not None:
+                return entry
+            if robot_url not in self.in_flight:
+                self.in_flight[robot_url] = asyncio.ensure_future(self.download_and_store(session, limit, robot_url))
+        return await asyncio.shield(self.in_flight[robot_url])
+
+    async def check_url(self, session, limit, url):
+        """
+        Check robots.txt to see if a page can be scraped.
+
+        Args:
+            session - aiohttp.ClientSession
+            limit - asyncio.Semaphore capping the number of open connections
+            url - URL of the page
+
+        Returns:
+            True, False, or an error string in the get_scrapability.can_fetch vocabulary
+        """
+        if url in self.skip_urls:
+            return 'site skipped'
+        try:
+            robot_url = robots_cache.robots_url(url)
+        except ValueError:
+            return 'malformed URL'
+        entry = await self.get_entry(session, limit, robot_url)
+        result = self.cache.evaluate(robot_url, entry, url)
+        if result == 'SSL Error' and "https://" in url:
+            return await self.check_url(session, limit, url.replace("https://", "http://"))
+        if result == 'timed out':
+            #reppy reports download timeouts as connection errors
+            return 'invalid URL'
+        return result
+
+    async def check_host(self, session, limit, urls):
+        results = []
+        for url in urls:
+            results.append(await self.check_url(session, limit, url))
+        return results
+
+    async def check_hosts(self, hosts, on_result):
+        """
+        Check every host concurrently.
+
+        Args:
+            hosts - list of (host, urls) pairs, where urls is a list of the host's URLs to check
+            on_result - called with (host, results) as each host finishes, where results is a list with one result per URL
+        """
+        limit = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency, ttl_dns_cache=300)
+        async with aiohttp.ClientSession(connector=connector, headers=http_session.DEFAULT_HEADERS) as session:
+            #Bound the number of waiting hosts so very long lists don't create every task up front
+            pending = asyncio.Semaphore(self.concurrency * 4)
+            tasks = set()
+
+            async def run(host, urls):
+                try:
+                    try:
+                        results = await asyncio.wait_for(self.check_host(session, limit, urls), self.timeout)
+                    except asyncio.TimeoutError:
+                        results = ['timed out'] * len(urls)
+                    on_result(host, results)
+                finally:
+                    pending.release()
+
+            for host, urls in hosts:
+                await pending.acquire()
+                task = asyncio.ensure_future(run(host, urls))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+
+
+def check_hosts(hosts, on_result, concurrency=1000, timeout=20, skip_urls=()):
+    """
+    Blocking entry point for AsyncRobotsChecker.check_hosts, for use from the command line scripts.
+
+    Args:
+        hosts - list of (host, urls) pairs, where urls is a list of the host's URLs to check
+        on_result - called with (host, results) as each host finishes
+        concurrency - maximum number of robots.txt downloads at once
+        timeout - seconds a host may take before its rows are marked 'timed out'
+        skip_urls - URLs to mark 'site skipped' without checking
+    """
+    checker = AsyncRobotsChecker(concurrency=concurrency, timeout=timeout, skip_urls=skip_urls)
+    asyncio.run(checker.check_hosts(hosts, on_result))
@@ -0,0 +1,84 @@
+"""
+Benchmark for combining crawl results into one email list per website (crawl_results.collapse_emails).
+
+Builds synthetic results_dict/website_mapping pairs (a homepage plus a few contact pages per website, a few emails per page)
+and times the aggregation from 1k to 1M crawled urls. The original nested-loop version is timed too, up to --legacy-max urls,
+since it is quadratic and takes hours past that.
+
+Usage:
+    py benchmarks/bench_aggregation.py [--sizes 1000 10000 100000 1000000] [--legacy-max 10000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from crawl_results import collapse_emails
+
+
+def legacy_collapse_emails(results_dict, website_mapping):
+    #The aggregation previously duplicated in email_crawler.py and process_data.py
+    email_list = []
+    counts = []
+    for idx, sites in website_mapping.items():
+        email_list.append([value for key, value in results_dict.items() if key in sites])
+        counts.append(len([key for key in results_dict.keys() if key in sites]))
+    email_list = [emails for subset in email_list for emails in subset]
+
+    collapsed_list = []
+    for i, count in enumerate(counts):
+        starting_point = sum(counts[0:i])
+        group = email_list[starting_point:(starting_point+counts[i])]
+        collapsed_list.append(list(set([emails for website in group for emails in website])))
+    return collapsed_list
+
+
+def make_results(n_urls, seed=0):
+    """
+    Build a synthetic crawl with about n_urls crawled urls.
+
+    Returns:
+        results_dict, website_mapping in the same format email_crawler.py writes
+    """
+    rng = random.Random(seed)
+    results_dict = {}
+    website_mapping = {}
+    i = 0
+    while len(results_dict) < n_urls:
+        base = f"https://site{i}.org/"
+        sites = [base] + [f"{base}contact-{j}" for j in range(rng.randint(0, 4))]
+        for site in sites:
+            results_dict[site] = [f"user{rng.randint(0, 20)}@site{i}.org" for _ in range(rng.randint(0, 3))]
+        website_mapping[i] = sites
+        i += 1
+    return results_dict, website_mapping
+
+
+def time_call(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark crawl result aggregation")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000], help="Numbers of crawled urls to benchmark")
+    parser.add_argument('--legacy-max', type=int, default=10000, help="Largest size to also time the original quadratic version on")
+    args = parser.parse_args()
+
+    print(f"{'urls':>10} {'websites':>10} {'collapse_emails (s)':>20} {'original (s)':>14}")
+    for size in args.sizes:
+        results_dict, website_mapping = make_results(size)
+        new_time, new_result = time_call(collapse_emails, results_dict, website_mapping)
+        legacy = '-'
+        if size <= args.legacy_max:
+            legacy_time, legacy_result = time_call(legacy_collapse_emails, results_dict, website_mapping)
+            assert [sorted(emails) for emails in new_result] == [sorted(emails) for emails in legacy_result]
+            legacy = f"{legacy_time:.3f}"
+        print(f"{size:>10} {len(website_mapping):>10} {new_time:>20.3f} {legacy:>14}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+"""
+End-to-end crawl benchmark against a local stand-in for the web (sim_server.py), so it runs offline and every run sees the same sites.
+
+A simulated server plays --sites websites (with soft-404s, TLS failures, slow-drip pages, hanging sites and assorted robots.txt files) on 127.0.0.1,
+and each benchmark gets a fresh working folder whose dns_cache.sqlite points the simulated hostnames at 127.0.0.1.
+Then it times:
+    - find_email_addresses, crawl_page and can_fetch, called from --workers threads, each in its own process
+    - the full scripts: get_scrapability.py, then email_crawler.py on its output, and pipeline.py, with their metrics logs
+and reports sites/sec, p50/p99 latency per page (per robots.txt for can_fetch and get_scrapability.py), peak memory and errors.
+
+Peak memory is the maximum resident set size of the process doing the work (not available on Windows).
+can_fetch is get_scrapability.can_fetch when reppy is installed, and robots_cache.can_fetch otherwise; get_scrapability.py uses its asyncio backend without reppy.
+
+Usage:
+    py benchmarks/bench_crawl.py [--sites 1000] [--latency 20] [--fanout 3] [--workers 50] [--only functions|scripts]
+"""
+import argparse
+import concurrent.futures
+import contextlib
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import dns_cache
+import sim_server
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def max_rss_mb(rusage):
+    #ru_maxrss is in KB on Linux and bytes on macOS
+    return rusage.ru_maxrss / (1024 * 1024) if sys.platform == 'darwin' else rusage.ru_maxrss / 1024
+
+
+def quantile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def make_workdir(urls):
+    #A fresh folder per benchmark, so no run reuses another's robots.txt, pages or crawl state
+    workdir = tempfile.mkdtemp(prefix='bench_crawl_')
+    cache = dns_cache.DNSCache(os.path.join(workdir, 'dns_cache.sqlite'))
+    for url in urls:
+        cache.store(dns_cache.get_hostname(url), [(socket.AF_INET, ('127.0.0.1', 0))])
+    cache.conn.close()
+    return workdir
+
+
+def serve(args):
+    sim_server.server_from_args(args).serve_forever()
+
+
+def crawl_args(args):
+    #Same options as the scripts get on the command line
+    return ['--rate', str(args.rate), '--burst', str(args.burst), '--read-timeout', str(args.read_timeout), '--tries', str(args.tries)]
+
+
+def run_function(name, urls, workdir, args, results):
+    os.chdir(workdir)
+    import email_crawler
+    import get_scrapability
+    import robots_cache
+    parser = argparse.ArgumentParser()
+    email_crawler.add_crawl_options(parser)
+    email_crawler.configure_crawl(parser.parse_args(crawl_args(args)))
+    if name == 'can_fetch':
+        function = get_scrapability.can_fetch if get_scrapability.reppy is not None else robots_cache.can_fetch
+    else:
+        function = getattr(email_crawler, name)
+
+    def timed(url):
+        start = time.perf_counter()
+        try:
+            function(url)
+            error = False
+        except:
+            error = True
+        return time.perf_counter() - start, error
+
+    start = time.perf_counter()
+    #get_scrapability.can_fetch prints every url
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.workers) as executor:
+            timings = list(executor.map(timed, urls))
+    elapsed = time.perf_counter() - start
+    peak = max_rss_mb(resource.getrusage(resource.RUSAGE_SELF)) if resource is not None else None
+    latencies = [seconds for seconds, error in timings]
+    results.put((name, len(urls), elapsed, quantile(latencies, 0.5), quantile(latencies, 0.99), peak, sum(error for seconds, error in timings)))
+
+
+def bench_function(name, urls, args):
+    workdir = make_workdir(urls)
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=run_function, args=(name, urls, workdir, args, results))
+    process.start()
+    row = results.get()
+    process.join()
+    shutil.rmtree(workdir, ignore_errors=True)
+    return row
+
+
+def run_script(command, workdir):
+    """
+    Run a script to completion.
+
+    Returns:
+        (seconds, peak MB of the script's process or None, return code)
+    """
+    start = time.perf_counter()
+    with open(os.path.join(workdir, 'output.log'), 'a') as log:
+        process = subprocess.Popen([sys.executable] + command, cwd=workdir, stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL)
+        if resource is not None:
+            #wait4 gives this child's own resource usage, so each script's peak is measured separately
+            pid, status, rusage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            peak = max_rss_mb(rusage)
+        else:
+            process.wait()
+            peak = None
+    return time.perf_counter() - start, peak, process.returncode
+
+
+def read_events(log_path, event):
+    #Latencies and errors of the page or robots.txt downloads in a metrics log
+    latencies = []
+    errors = 0
+    if not os.path.exists(log_path):
+        return latencies, errors
+    with open(log_path) as log_file:
+        for line in log_file:
+            record = json.loads(line)
+            if record['event'] != event:
+                continue
+            latencies.append(record['seconds'])
+            if event == 'robots':
+                errors += record.get('error') is not None
+            else:
+                errors += record.get('status_code') != 200
+    return latencies, errors
+
+
+def script_row(name, sites, workdir, command, event):
+    log_path = os.path.join(workdir, name + '.metrics.jsonl')
+    elapsed, peak, code = run_script(command + ['--metrics-log', log_path], workdir)
+    if code != 0:
+        print(f"{name} exited with code {code}; see {os.path.join(workdir, 'output.log')}")
+    latencies, errors = read_events(log_path, event)
+    return (name, sites, elapsed, quantile(latencies, 0.5), quantile(latencies, 0.99), peak, errors)
+
+
+def bench_scripts(urls, args):
+    import get_scrapability
+    import table_io
+    import pandas as pd
+    rows = []
+    timeouts = ['--read-timeout', str(args.read_timeout), '--tries', str(args.tries)]
+
+    workdir = make_workdir(urls)
+    pd.DataFrame({'website': urls}).to_csv(os.path.join(workdir, 'sites.csv'), index=False)
+    backend = 'reppy' if get_scrapability.reppy is not None else 'asyncio'
+    rows.append(script_row('get_scrapability.py', len(urls), workdir,
+                           [os.path.join(ROOT, 'get_scrapability.py'), 'sites.csv', 'scrapability.csv', '--backend', backend] + timeouts, 'robots'))
+    if os.path.exists(os.path.join(workdir, 'scrapability.csv')):
+        scrapable = int((table_io.read_table(os.path.join(workdir, 'scrapability.csv'))['scrapability'] == True).sum())
+        rows.append(script_row('email_crawler.py', scrapable, workdir,
+                               [os.path.join(ROOT, 'email_crawler.py'), 'scrapability.csv', '--async', '--max-concurrency', str(args.workers), '--output', 'emails.csv'] + crawl_args(args), 'page'))
+    if not args.keep:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    workdir = make_workdir(urls)
+    pd.DataFrame({'website': urls}).to_csv(os.path.join(workdir, 'sites.csv'), index=False)
+    rows.append(script_row('pipeline.py', len(urls), workdir,
+                           [os.path.join(ROOT, 'pipeline.py'), 'sites.csv', 'emails.csv', '--robots-workers', str(args.workers), '--crawl-workers', str(args.workers)] + crawl_args(args), 'page'))
+    if not args.keep:
+        shutil.rmtree(workdir, ignore_errors=True)
+    else:
+        print(f"Working folders kept in {tempfile.gettempdir()} (bench_crawl_*)")
+    return rows
+
+
+def format_ms(seconds):
+    return f"{seconds * 1000:.0f}" if seconds is not None else '-'
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the crawler end to end against a local simulated web")
+    sim_server.add_server_options(parser)
+    parser.add_argument('--workers', type=int, default=50, help="Threads calling each function, and --max-concurrency/--robots-workers/--crawl-workers for the scripts (default 50)")
+    parser.add_argument('--rate', type=float, default=100, help="--rate for the crawl, high so politeness delays don't hide the crawler's own speed (default 100)")
+    parser.add_argument('--burst', type=int, default=10, help="--burst for the crawl (default 10)")
+    parser.add_argument('--read-timeout', type=float, default=5, help="--read-timeout for every request (default 5)")
+    parser.add_argument('--tries', type=int, default=3, help="--tries for every request (default 3)")
+    parser.add_argument('--only', choices=['functions', 'scripts'], help="Only benchmark the functions, or only the full scripts")
+    parser.add_argument('--keep', action='store_true', help="Keep the scripts' working folders (outputs, logs and metrics) instead of deleting them")
+    args = parser.parse_args()
+    if args.hang_secs > args.read_timeout * args.tries * 4:
+        #A hanging site only needs to outlast the client's timeouts; holding it longer just delays shutting the server down
+        args.hang_secs = args.read_timeout * args.tries * 4
+
+    urls = [sim_server.site_url(n, args.port, {kind: getattr(args, kind) for kind in sim_server.DEFAULT_MIX}) for n in range(args.sites)]
+    server = multiprocessing.Process(target=serve, args=(args,), daemon=True)
+    server.start()
+    for _ in range(50):
+        try:
+            socket.create_connection(('127.0.0.1', args.port), timeout=1).close()
+            break
+        except OSError:
+            time.sleep(0.1)
+    print(f"Simulated web: {args.sites} sites on port {args.port}, {args.latency:.0f}+{args.jitter:.0f} ms latency, {args.fanout} contact/about links per homepage")
+
+    rows = []
+    try:
+        if args.only != 'scripts':
+            for name in ['find_email_addresses', 'crawl_page', 'can_fetch']:
+                rows.append(bench_function(name, urls, args))
+        if args.only != 'functions':
+            rows.extend(bench_scripts(urls, args))
+    finally:
+        server.terminate()
+        server.join()
+
+    memory = 'peak MB' if resource is not None else 'peak MB (n/a)'
+    print(f"{'':<22} {'sites':>7} {'seconds':>9} {'sites/sec':>10} {'p50 ms':>8} {'p99 ms':>8} {memory:>14} {'errors':>7}")
+    for name, sites, elapsed, p50, p99, peak, errors in rows:
+        peak = f"{peak:.1f}" if peak is not None else '-'
+        print(f"{name:<22} {sites:>7} {elapsed:>9.2f} {sites/elapsed:>10.1f} {format_ms(p50):>8} {format_ms(p99):>8} {peak:>14} {errors:>7}")
+
+
+if __name__ == '__main__':
+    main()
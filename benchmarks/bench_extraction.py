@@ -0,0 +1,95 @@
+"""
+Micro-benchmark for email extraction (email_extractor.EmailExtractor) against the original approach.
+
+The original approach ran re.findall with the soft-404 pattern and again with the email pattern on every page (recompiling
+through the re cache), then filtered fake emails with a per-email substring loop.
+
+Pages are read from a directory of saved .html files if one is given; otherwise a synthetic corpus is generated.
+
+Usage:
+    py benchmarks/bench_extraction.py [--corpus PATH/TO/SAVED/PAGES] [--pages 2000] [--repeat 3]
+"""
+import argparse
+import glob
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from email_extractor import EmailExtractor, EMAIL_REGEX, INVALID_REGEX, TO_REMOVE
+
+
+def legacy_extract(html_content):
+    invalid_search = re.findall(INVALID_REGEX, html_content)
+    if html_content == '' or len(invalid_search) > 0:
+        return [], True
+    emails = list(set(re.findall(EMAIL_REGEX, html_content)))
+    return [elem for elem in emails if not any(substr in elem for substr in TO_REMOVE)], False
+
+
+def load_corpus(path):
+    pages = []
+    for file_path in sorted(glob.glob(os.path.join(path, '**', '*.htm*'), recursive=True)):
+        with open(file_path, encoding='utf-8', errors='replace') as page:
+            pages.append(page.read())
+    return pages
+
+
+def make_corpus(n_pages, seed=0):
+    """
+    Generate homepage-like pages: ~60KB of markup and text with a handful of real and fake emails, and a few soft-404 pages.
+    """
+    rng = random.Random(seed)
+    words = ['parks', 'recreation', 'county', 'program', 'summer', 'camp', 'registration', 'youth', 'league', 'contact', 'about', 'events']
+    pages = []
+    for i in range(n_pages):
+        parts = ['<html><head><title>Site %d</title></head><body>' % i]
+        for j in range(300):
+            parts.append('<div class="c%d"><a href="/%s-%d">%s</a> %s</div>' % (j, rng.choice(words), j, rng.choice(words), ' '.join(rng.choice(words) for _ in range(20))))
+            if rng.random() < 0.02:
+                parts.append('<a href="mailto:info%d@site%d.org">info%d@site%d.org</a>' % (j, i, j, i))
+            if rng.random() < 0.01:
+                parts.append('<img src="logo@2x.png"> user@example.com')
+        if rng.random() < 0.05:
+            parts.append('<h1>404 not found</h1>')
+        parts.append('</body></html>')
+        pages.append('\n'.join(parts))
+    return pages
+
+
+def bench(func, pages, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = [func(page) for page in pages]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark email extraction over a corpus of HTML pages")
+    parser.add_argument('--corpus', help="Directory of saved .html pages (searched recursively)")
+    parser.add_argument('--pages', type=int, default=2000, help="Number of synthetic pages when no corpus is given")
+    parser.add_argument('--repeat', type=int, default=3, help="Number of timed runs; the fastest is reported")
+    args = parser.parse_args()
+
+    pages = load_corpus(args.corpus) if args.corpus else make_corpus(args.pages)
+    total_mb = sum(len(page) for page in pages) / 1e6
+    print(f"Corpus: {len(pages)} pages, {total_mb:.1f} MB")
+
+    extractor = EmailExtractor()
+    legacy_time, legacy_results = bench(legacy_extract, pages, args.repeat)
+    new_time, new_results = bench(extractor.extract, pages, args.repeat)
+    mismatches = sum(1 for old, new in zip(legacy_results, new_results) if old[1] != new[1] or (not old[1] and sorted(old[0]) != sorted(new[0])))
+
+    print(f"{'':<16} {'seconds':>10} {'pages/sec':>12} {'MB/sec':>10}")
+    for name, elapsed in [('original', legacy_time), ('EmailExtractor', new_time)]:
+        print(f"{name:<16} {elapsed:>10.3f} {len(pages)/elapsed:>12.0f} {total_mb/elapsed:>10.1f}")
+    print(f"Pages with different results: {mismatches}")
+
+
+if __name__ == '__main__':
+    main()
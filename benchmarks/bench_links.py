@@ -0,0 +1,86 @@
+"""
+Benchmark for link extraction (link_extractor.py): links/sec and peak memory for each installed HTML parser.
+
+Each parser runs in its own process so its peak memory isn't mixed up with the others'. Peak memory is the growth in the process's
+maximum resident set size while extracting; on Windows, where that isn't available, it is the peak of Python allocations (tracemalloc),
+which leaves out memory allocated inside lxml and selectolax.
+
+Pages are read from a directory of saved .html files if one is given (e.g. real homepages saved from a crawl); otherwise a synthetic corpus is generated.
+
+Usage:
+    py benchmarks/bench_links.py [--corpus PATH/TO/SAVED/PAGES] [--pages 500] [--repeat 3]
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import link_extractor
+from bench_extraction import load_corpus, make_corpus
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def max_rss_mb():
+    #ru_maxrss is in KB on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def run_parser(parser_name, pages, repeat, results):
+    extractor = link_extractor.LinkExtractor(parser_name)
+    if resource is None:
+        tracemalloc.start()
+    else:
+        baseline = max_rss_mb()
+    best = None
+    links = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        links = sum(len(extractor.links(page)) for page in pages)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    if resource is None:
+        peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    else:
+        peak = max_rss_mb() - baseline
+    results.put((parser_name, best, links, peak))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark link extraction over a corpus of HTML pages")
+    parser.add_argument('--corpus', help="Directory of saved .html pages (searched recursively)")
+    parser.add_argument('--pages', type=int, default=500, help="Number of synthetic pages when no corpus is given")
+    parser.add_argument('--repeat', type=int, default=3, help="Number of timed runs; the fastest is reported")
+    args = parser.parse_args()
+
+    pages = load_corpus(args.corpus) if args.corpus else make_corpus(args.pages)
+    total_mb = sum(len(page) for page in pages) / 1e6
+    print(f"Corpus: {len(pages)} pages, {total_mb:.1f} MB")
+    print(f"Parsers installed: {', '.join(link_extractor.PARSERS)}")
+
+    results = multiprocessing.Queue()
+    rows = []
+    for parser_name in reversed(list(link_extractor.PARSERS)):
+        process = multiprocessing.Process(target=run_parser, args=(parser_name, pages, args.repeat, results))
+        process.start()
+        rows.append(results.get())
+        process.join()
+
+    memory = 'peak MB' if resource is not None else 'peak MB (Python)'
+    print(f"{'':<12} {'seconds':>10} {'pages/sec':>10} {'links/sec':>12} {memory:>18}")
+    for parser_name, elapsed, links, peak in rows:
+        print(f"{parser_name:<12} {elapsed:>10.3f} {len(pages)/elapsed:>10.0f} {links/elapsed:>12.0f} {peak:>18.1f}")
+    counts = {parser_name: links for parser_name, elapsed, links, peak in rows}
+    if len(set(counts.values())) > 1:
+        print(f"Note: parsers found different numbers of links: {counts}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+"""
+Local stand-in for the web, for benchmarking the crawler without touching the internet.
+
+One HTTP server plays thousands of websites, told apart by the Host header: http://site0.bench.test:PORT/, http://site1.bench.test:PORT/, ...
+(the benchmark points these names at 127.0.0.1 through dns_cache.sqlite). Each site's behavior is picked from its number, so every run sees the same sites:
+    - normal: a homepage with emails and --fanout contact/about links, and contact pages with more emails
+    - soft404: a 200 page that says "page not found"
+    - ssl: listed as https://, which fails the TLS handshake against this plain-HTTP server (the scripts fall back to http://)
+    - drip: pages trickle out a chunk at a time, --drip-secs apart
+    - hang: the server accepts the connection and never answers (for --hang-secs)
+robots.txt allows everything, disallows everything, disallows the contact pages, or is missing (404), also by site number.
+Every response waits --latency ms (plus up to --jitter ms) first.
+
+Usage:
+    py benchmarks/sim_server.py [--port 8900] [--sites 1000] [--latency 20] [--fanout 3]
+"""
+import argparse
+import functools
+import http.server
+import random
+import socketserver
+import sys
+import time
+import zlib
+
+
+DOMAIN = 'bench.test'
+
+#Fraction of sites of each kind; the rest are normal
+DEFAULT_MIX = {'soft404': 0.03, 'ssl': 0.05, 'drip': 0.02, 'hang': 0.01}
+#Fraction of sites with each kind of robots.txt; the rest allow everything
+DEFAULT_ROBOTS = {'disallow_all': 0.05, 'disallow_contact': 0.05, 'missing': 0.2}
+
+FILLER = ['parks', 'recreation', 'county', 'program', 'summer', 'camp', 'registration', 'youth', 'league', 'events', 'schedule', 'fields']
+
+
+def site_host(n):
+    return f"site{n}.{DOMAIN}"
+
+
+def site_number(host):
+    #site123.bench.test:8900 -> 123, or None for anything else
+    name = host.split(':')[0].lower()
+    if not name.startswith('site') or not name.endswith('.' + DOMAIN):
+        return None
+    number = name[4:-len(DOMAIN) - 1]
+    return int(number) if number.isdigit() else None
+
+
+def pick(n, salt, fractions):
+    #Deterministic choice for site n: the same site always gets the same kind
+    roll = random.Random(n * 7919 + salt).random()
+    for kind, fraction in fractions.items():
+        if roll < fraction:
+            return kind
+        roll -= fraction
+    return None
+
+
+def site_kind(n, mix=DEFAULT_MIX):
+    return pick(n, 1, mix) or 'normal'
+
+
+def robots_kind(n, robots=DEFAULT_ROBOTS):
+    return pick(n, 2, robots) or 'allow_all'
+
+
+def site_url(n, port, mix=DEFAULT_MIX):
+    scheme = 'https' if site_kind(n, mix) == 'ssl' else 'http'
+    return f"{scheme}://{site_host(n)}:{port}/"
+
+
+@functools.lru_cache(maxsize=4096)
+def make_page(n, path, fanout, size):
+    """
+    Build a page of a normal site: the homepage links to fanout contact/about pages, and every page has a couple of emails in ~size bytes of filler.
+    Pages are cached, so building them doesn't slow the server down on repeat requests.
+    """
+    rng = random.Random(zlib.crc32(f"{n}{path}".encode('utf-8')))
+    parts = [f'<html><head><title>Site {n} {path}</title></head><body>']
+    if path == '/':
+        names = ['contact', 'about-us', 'staff', 'team', 'contact-us', 'about', 'directory', 'people']
+        for i in range(fanout):
+            parts.append(f'<a href="/{names[i % len(names)]}{i // len(names) or ""}.html">{names[i % len(names)]}</a>')
+        parts.append(f'<a href="mailto:info@site{n}.org">info@site{n}.org</a>')
+    else:
+        parts.append(f'<p>Reach {path.strip("/").split(".")[0]} at staff{rng.randint(0, 99)}@site{n}.org or office@site{n}.org</p>')
+    written = sum(len(part) for part in parts)
+    while written < size:
+        line = '<div><a href="/%s-%d">%s</a> %s</div>' % (rng.choice(FILLER), rng.randint(0, 999), rng.choice(FILLER), ' '.join(rng.choice(FILLER) for _ in range(15)))
+        parts.append(line)
+        written += len(line)
+    parts.append('</body></html>')
+    return '\n'.join(parts).encode('utf-8')
+
+
+def make_robots(kind):
+    if kind == 'disallow_all':
+        return b"User-agent: *\nDisallow: /\n"
+    if kind == 'disallow_contact':
+        return b"User-agent: *\nDisallow: /contact\n"
+    return b"User-agent: *\nDisallow: /private/\n"
+
+
+class SimHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    settings = None
+
+    def do_GET(self):
+        settings = self.settings
+        n = site_number(self.headers.get('Host', ''))
+        if settings['latency'] or settings['jitter']:
+            time.sleep((settings['latency'] + random.random() * settings['jitter']) / 1000)
+        if n is None or n >= settings['sites']:
+            return self.send_body(404, b'<html><body>No such site</body></html>')
+        kind = site_kind(n, settings['mix'])
+        path = self.path.split('?')[0]
+        if path == '/robots.txt':
+            robots = robots_kind(n, settings['robots'])
+            if robots == 'missing':
+                return self.send_body(404, b'<html><body>Not found</body></html>')
+            return self.send_body(200, make_robots(robots), 'text/plain')
+        if kind == 'hang':
+            time.sleep(settings['hang_secs'])
+            self.close_connection = True
+            return
+        if kind == 'soft404':
+            return self.send_body(200, b'<html><body><h1>Page not found</h1><p>Sorry, the page you requested could not be found.</p></body></html>')
+        if path != '/' and not path.endswith('.html'):
+            return self.send_body(404, b'<html><body>Not found</body></html>')
+        body = make_page(n, path, settings['fanout'], settings['page_size'])
+        if kind == 'drip':
+            return self.send_body(200, body, drip=True)
+        self.send_body(200, body)
+
+    def send_body(self, status, body, content_type='text/html; charset=utf-8', drip=False):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            if not drip:
+                self.wfile.write(body)
+                return
+            chunk = max(1, len(body) // self.settings['drip_chunks'])
+            for start in range(0, len(body), chunk):
+                self.wfile.write(body[start:start + chunk])
+                self.wfile.flush()
+                time.sleep(self.settings['drip_secs'])
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def log_error(self, format, *args):
+        #TLS handshakes against the plain-HTTP server ('ssl' sites) show up here
+        pass
+
+
+class SimServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+    allow_reuse_address = True
+
+
+def make_server(port, sites=1000, latency=20, jitter=20, fanout=3, page_size=20000, drip_secs=0.5, drip_chunks=10, hang_secs=120, mix=None, robots=None):
+    """
+    Create the simulated web server (call serve_forever to run it).
+
+    Args:
+        port - port to listen on (127.0.0.1)
+        sites - number of sites
+        latency - milliseconds every response waits before it starts
+        jitter - up to this many more milliseconds, at random
+        fanout - contact/about links on each homepage
+        page_size - approximate bytes per page
+        drip_secs - seconds between chunks for 'drip' sites
+        drip_chunks - chunks per page for 'drip' sites
+        hang_secs - seconds a 'hang' site holds a connection before closing it
+        mix - fraction of sites of each kind (see DEFAULT_MIX)
+        robots - fraction of sites with each kind of robots.txt (see DEFAULT_ROBOTS)
+
+    Returns:
+        SimServer
+    """
+    settings = {'sites': sites, 'latency': latency, 'jitter': jitter, 'fanout': fanout, 'page_size': page_size, 'drip_secs': drip_secs,
+                'drip_chunks': drip_chunks, 'hang_secs': hang_secs, 'mix': mix or DEFAULT_MIX, 'robots': robots or DEFAULT_ROBOTS}
+    handler = type('Handler', (SimHandler,), {'settings': settings})
+    return SimServer(('127.0.0.1', port), handler)
+
+
+def add_server_options(parser):
+    parser.add_argument('--port', type=int, default=8900, help="Port to listen on (default 8900)")
+    parser.add_argument('--sites', type=int, default=1000, help="Number of simulated sites (default 1000)")
+    parser.add_argument('--latency', type=float, default=20, help="Milliseconds every response waits (default 20)")
+    parser.add_argument('--jitter', type=float, default=20, help="Up to this many more milliseconds per response, at random (default 20)")
+    parser.add_argument('--fanout', type=int, default=3, help="Contact/about links on each homepage (default 3)")
+    parser.add_argument('--page-size', type=int, default=20000, help="Approximate bytes per page (default 20000)")
+    parser.add_argument('--drip-secs', type=float, default=0.5, help="Seconds between chunks for slow-drip sites (default 0.5)")
+    parser.add_argument('--hang-secs', type=float, default=120, help="Seconds a hanging site holds the connection (default 120)")
+    for kind, fraction in DEFAULT_MIX.items():
+        parser.add_argument(f'--{kind}', type=float, default=fraction, help=f"Fraction of {kind} sites (default {fraction})")
+    for kind, fraction in DEFAULT_ROBOTS.items():
+        parser.add_argument(f'--robots-{kind.replace("_", "-")}', type=float, default=fraction, help=f"Fraction of sites whose robots.txt is {kind.replace('_', ' ')} (default {fraction})")
+
+
+def server_from_args(args):
+    mix = {kind: getattr(args, kind) for kind in DEFAULT_MIX}
+    robots = {kind: getattr(args, 'robots_' + kind) for kind in DEFAULT_ROBOTS}
+    return make_server(args.port, sites=args.sites, latency=args.latency, jitter=args.jitter, fanout=args.fanout, page_size=args.page_size,
+                       drip_secs=args.drip_secs, hang_secs=args.hang_secs, mix=mix, robots=robots)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve thousands of simulated websites from one local port")
+    add_server_options(parser)
+    args = parser.parse_args()
+    server = server_from_args(args)
+    print(f"Serving {args.sites} sites at http://siteN.{DOMAIN}:{args.port}/ (N from 0 to {args.sites - 1}); point the names at 127.0.0.1 to use them")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+import asyncio
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+
+#Group urls by host for the per-host concurrency cap
+def get_host(url):
+    """
+    Get the host of a URL, used to group websites on the same server.
+
+    Parameters:
+    - url (str): The URL of the website.
+
+    Returns:
+    - String: The lowercased hostname of the URL, or the URL itself if it has no hostname.
+    """
+    try:
+        host = urllib.parse.urlparse(url).hostname
+    except ValueError:
+        host = None
+    return host or url
+
+
+def interleave_by_host(items):
+    """
+    Reorder URLs so consecutive URLs are on different hosts, taking one URL from each host in turn.
+    Sites on the same host then spread out over the crawl instead of queueing behind that host's rate limit.
+
+    Parameters:
+    - items (list): List of (key, url) pairs.
+
+    Returns:
+    - List: The same (key, url) pairs, round-robin by host, keeping each host's URLs in their original order.
+    """
+    by_host = {}
+    for key, url in items:
+        by_host.setdefault(get_host(url), []).append((key, url))
+    queues = list(by_host.values())
+    interleaved = []
+    depth = 0
+    while queues:
+        interleaved.extend(queue[depth] for queue in queues)
+        depth += 1
+        queues = [queue for queue in queues if len(queue) > depth]
+    return interleaved
+
+
+async def crawl_all(items, crawl_func, on_result, max_concurrency=50, per_host_concurrency=2):
+    """
+    Run a blocking crawl function over many URLs concurrently.
+
+    Each call runs on a worker thread, so the existing requests-based functions (find_email_addresses, crawl_page) can be reused unchanged.
+    At most max_concurrency calls run at once, and at most per_host_concurrency of them are for the same host.
+
+    Parameters:
+    - items (list): List of (key, url) pairs, where the key identifies the row the URL came from.
+    - crawl_func (function): Blocking function called with each URL.
+    - on_result (function): Called with (key, result) as each URL completes. It runs on the event loop thread, so it does not need to be thread-safe.
+    - max_concurrency (int): Maximum number of URLs crawled at once.
+    - per_host_concurrency (int): Maximum number of URLs on the same host crawled at once.
+    """
+    loop = asyncio.get_running_loop()
+    global_limit = asyncio.Semaphore(max_concurrency)
+    #Bound the number of waiting tasks so 50k-site lists don't create 50k coroutines up front
+    pending_limit = asyncio.Semaphore(max_concurrency * 10)
+    #Each host's semaphore, and how many tasks are using it; a host's entry is removed once none are, so the dict only holds hosts in flight
+    host_limits = {}
+    host_tasks = {}
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        async def crawl_one(key, url):
+            host = get_host(url)
+            if host not in host_limits:
+                host_limits[host] = asyncio.Semaphore(per_host_concurrency)
+                host_tasks[host] = 0
+            host_tasks[host] += 1
+            try:
+                async with host_limits[host]:
+                    async with global_limit:
+                        result = await loop.run_in_executor(executor, crawl_func, url)
+                on_result(key, result)
+            finally:
+                host_tasks[host] -= 1
+                if host_tasks[host] == 0:
+                    del host_tasks[host]
+                    del host_limits[host]
+                pending_limit.release()
+
+        tasks = []
+        for key, url in items:
+            await pending_limit.acquire()
+            tasks.append(asyncio.ensure_future(crawl_one(key, url)))
+            #Drop finished tasks so the list doesn't grow with the input
+            if len(tasks) >= max_concurrency * 20:
+                for task in [task for task in tasks if task.done()]:
+                    task.result()
+                tasks = [task for task in tasks if not task.done()]
+        for task in tasks:
+            await task
+
+
+def run_crawl(items, crawl_func, on_result, max_concurrency=50, per_host_concurrency=2):
+    """
+    Blocking entry point for crawl_all, for use from the command line scripts.
+
+    Parameters:
+    - items (list): List of (key, url) pairs, where the key identifies the row the URL came from.
+    - crawl_func (function): Blocking function called with each URL.
+    - on_result (function): Called with (key, result) as each URL completes.
+    - max_concurrency (int): Maximum number of URLs crawled at once.
+    - per_host_concurrency (int): Maximum number of URLs on the same host crawled at once.
+    """
+    asyncio.run(crawl_all(items, crawl_func, on_result, max_concurrency=max_concurrency, per_host_concurrency=per_host_concurrency))
@@ -0,0 +1,155 @@
+import json
+import os
+
+
+JOURNAL_PATH = 'crawl_journal.jsonl'
+
+
+class CrawlJournal:
+    """
+    Append-only log of crawl results, written as JSON Lines.
+
+    Every crawled URL is written as a 'page' record as soon as it is scraped, and a 'site' record marks a row of the input file as finished.
+    A 'robots' record keeps the robots.txt verdict of a row (pipeline.py), so a resumed run doesn't check it again.
+    Records are flushed to disk after every site, so a crash loses at most the site that was being written.
+
+    Record formats:
+        {"type": "page", "index": 3, "url": "https://...", "emails": ["..."], "status": "ok"}
+        {"type": "site", "index": 3, "invalid": false}
+        {"type": "robots", "index": 4, "verdict": "invalid URL"}
+    """
+
+    def __init__(self, path=JOURNAL_PATH, resume=False):
+        """
+        Args:
+            path - file path of the journal
+            resume - if True, append to an existing journal; otherwise start a new one
+        """
+        self.path = path
+        #Drop pages from unfinished sites, so a site crawled again starts from a clean slate
+        if resume and os.path.exists(path):
+            compact_journal(path)
+        self.file = open(path, 'a' if resume else 'w', encoding='utf-8')
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + '\n')
+
+    def append_page(self, index, url, emails, status=None):
+        self.write({'type': 'page', 'index': index, 'url': url, 'emails': emails, 'status': status})
+
+    def finish_site(self, index, invalid=False, sync=True):
+        self.write({'type': 'site', 'index': index, 'invalid': invalid})
+        if sync:
+            self.sync()
+
+    def record_robots(self, index, verdict, sync=False):
+        self.write({'type': 'robots', 'index': index, 'verdict': verdict})
+        if sync:
+            self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+def read_journal(path=JOURNAL_PATH):
+    """
+    Read the finished sites from a journal. Pages of a site without a 'site' record (e.g. the run was killed partway through it) are ignored, as is a truncated final line.
+
+    Args:
+        path - file path of the journal
+
+    Returns:
+        pages - dictionary with row indexes as keys and lists of (url, emails, status) tuples as values, in crawl order; status is None for journals written before it was recorded
+        invalid - dictionary with row indexes as keys and whether the website was an invalid URL as values
+    """
+    pages = {}
+    invalid = {}
+    unfinished = {}
+    if not os.path.exists(path):
+        return {}, {}
+    with open(path, encoding='utf-8') as journal:
+        for line in journal:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            index = record['index']
+            if record['type'] == 'page':
+                unfinished.setdefault(index, []).append((record['url'], record['emails'], record.get('status')))
+            elif record['type'] == 'site':
+                pages[index] = unfinished.pop(index, [])
+                invalid[index] = record['invalid']
+    return pages, invalid
+
+
+def read_verdicts(path=JOURNAL_PATH):
+    """
+    Read the robots.txt verdicts recorded in a journal.
+
+    Args:
+        path - file path of the journal
+
+    Returns:
+        dictionary with row indexes as keys and robots.txt verdicts (see get_scrapability.can_fetch) as values
+    """
+    verdicts = {}
+    if not os.path.exists(path):
+        return verdicts
+    with open(path, encoding='utf-8') as journal:
+        for line in journal:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record['type'] == 'robots':
+                verdicts[record['index']] = record['verdict']
+    return verdicts
+
+
+def load_journal(path=JOURNAL_PATH):
+    """
+    Rebuild the results_dict and website_mapping from a journal.
+
+    Args:
+        path - file path of the journal
+
+    Returns:
+        results_dict - dictionary with urls as keys and scraped emails as values
+        website_mapping - dictionary with row indexes as keys and lists of crawled urls as values, in row order
+    """
+    pages, invalid = read_journal(path)
+    results_dict = {}
+    website_mapping = {}
+    for index in sorted(invalid):
+        for url, emails, status in pages.get(index, []):
+            results_dict[url] = emails
+            website_mapping.setdefault(index, []).append(url)
+    return results_dict, website_mapping
+
+
+def compact_journal(path=JOURNAL_PATH):
+    """
+    Rewrite a journal in row order, keeping only finished sites and robots.txt verdicts, and dropping pages from unfinished attempts.
+
+    Args:
+        path - file path of the journal
+    """
+    pages, invalid = read_journal(path)
+    verdicts = read_verdicts(path)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as journal:
+        for index in sorted(verdicts):
+            if index in invalid:
+                #The site record says all there is to know about the row
+                continue
+            journal.write(json.dumps({'type': 'robots', 'index': index, 'verdict': verdicts[index]}) + '\n')
+        for index in sorted(invalid):
+            for url, emails, status in pages.get(index, []):
+                journal.write(json.dumps({'type': 'page', 'index': index, 'url': url, 'emails': emails, 'status': status}) + '\n')
+            journal.write(json.dumps({'type': 'site', 'index': index, 'invalid': invalid[index]}) + '\n')
+    os.replace(temp_path, path)
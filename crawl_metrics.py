@@ -0,0 +1,467 @@
+import bisect
+import http.server
+import json
+import threading
+import time
+import urllib.parse
+
+
+#Upper bounds, in seconds, of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+#Phases of a page download, in the order they happen
+#dns - looking up a host that isn't in dns_cache.sqlite
+#connect - opening the TCP connection (new connections only; reused keep-alive connections skip it)
+#tls - the TLS handshake (new https connections only)
+#ttfb - from sending the request to receiving the response headers (includes connect and tls when a new connection is opened)
+#download - reading the body, not counting the time spent scanning it for emails
+#extract - scanning the page for email addresses
+#parse - finding contact and about links in the page
+#robots - downloading a robots.txt file
+PHASES = ('dns', 'connect', 'tls', 'ttfb', 'download', 'extract', 'parse', 'robots')
+
+
+class Histogram:
+    """
+    Latency histogram with fixed buckets, in the same form as a Prometheus histogram.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """
+        Estimate a quantile from the buckets.
+
+        Args:
+            q - quantile from 0 to 1, e.g. 0.99
+
+        Returns:
+            upper bound of the bucket holding the quantile, in seconds (capped at the largest value seen), or None if nothing has been observed
+        """
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class PageTimer:
+    """
+    Collects the phase timings and outcome of one page download, for CrawlMetrics.page.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.host = host_of(url)
+        self.start = time.perf_counter()
+        self.phases = {}
+        self.fields = {}
+
+    def set(self, **fields):
+        #Record the outcome, e.g. status_code=200, reason='too large'
+        self.fields.update(fields)
+
+
+def host_of(url):
+    try:
+        return urllib.parse.urlsplit(url).hostname or url
+    except ValueError:
+        return url
+
+
+class CrawlMetrics:
+    """
+    Counters and latency histograms for a crawl or a robots.txt check, shared by every thread in the process.
+
+    Records:
+        - a latency histogram per phase of a page download (see PHASES)
+        - counters by label: 'http_status' (response status codes), 'exception' (exception types), 'page_status' and 'site_status' (see email_crawler.page_status),
+          'robots_download' (robots.txt status codes and errors) and 'robots_result' (scrapability results)
+        - sites done out of the total, for throughput and ETA
+        - total and slowest download time per host
+
+    If a log file is given, every page download is written to it as a JSON line with its phase timings and outcome, along with summaries as the run goes on.
+
+    Work done in another process (e.g. a DeadlinePool worker) can be recorded there between start_recording and stop_recording,
+    sent back with its result, and added to the main process's metrics with replay.
+    """
+
+    def __init__(self, log_path=None):
+        """
+        Args:
+            log_path - file path of the JSON Lines log, or None for no log
+        """
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.start_time = time.time()
+        self.histograms = {phase: Histogram() for phase in PHASES}
+        self.counters = {}
+        self.hosts = {}
+        self.sites_total = 0
+        self.sites_done = 0
+        self.log_path = log_path
+        self.log_file = open(log_path, 'a', encoding='utf-8') if log_path is not None else None
+        self.recorded = None
+
+    def observe(self, phase, seconds):
+        """
+        Record how long a phase took. Inside a page (see page), the time is also added to that page's log entry.
+
+        Args:
+            phase - one of PHASES
+            seconds - time taken
+        """
+        with self.lock:
+            self.histograms.setdefault(phase, Histogram()).observe(seconds)
+            if self.recorded is not None:
+                self.recorded.append(('observe', (phase, seconds), {}))
+        page = getattr(self.local, 'page', None)
+        if page is not None:
+            page.phases[phase] = page.phases.get(phase, 0.0) + seconds
+
+    def count(self, counter, label, n=1):
+        """
+        Add to a counter.
+
+        Args:
+            counter - counter name, e.g. 'http_status'
+            label - value being counted, e.g. 404
+            n - amount to add
+        """
+        label = str(label)
+        with self.lock:
+            labels = self.counters.setdefault(counter, {})
+            labels[label] = labels.get(label, 0) + n
+            if self.recorded is not None:
+                self.recorded.append(('count', (counter, label, n), {}))
+
+    def page(self, url):
+        """
+        Time a page download. Used as a context manager around everything done for the page on the current thread:
+
+            with metrics.page(url) as page:
+                ...
+                page.set(status_code=response.status_code)
+
+        On exit the status code and any exception are counted, the time is added to the host's total, and the page is written to the log.
+
+        Args:
+            url - URL of the page
+
+        Returns:
+            context manager giving a PageTimer
+        """
+        return _PageContext(self, url)
+
+    def note(self, **fields):
+        #Add to the outcome of the page being downloaded on this thread, if there is one
+        page = getattr(self.local, 'page', None)
+        if page is not None:
+            page.set(**fields)
+
+    def finish_page(self, page, exception=None):
+        seconds = time.perf_counter() - page.start
+        if exception is not None:
+            page.fields['exception'] = type(exception).__name__
+            self.count('exception', type(exception).__name__)
+        if page.fields.get('status_code') is not None:
+            self.count('http_status', page.fields['status_code'])
+        with self.lock:
+            host = self.hosts.setdefault(page.host, [0, 0.0, 0.0])
+            host[0] += 1
+            host[1] += seconds
+            host[2] = max(host[2], seconds)
+        self.log('page', url=page.url, host=page.host, seconds=round(seconds, 4), phases={phase: round(value, 4) for phase, value in page.phases.items()}, **page.fields)
+
+    def set_total(self, sites):
+        #Number of sites the run has to do, for the ETA
+        with self.lock:
+            self.sites_total = sites
+
+    def add_total(self, sites):
+        #For runs that find out how many sites they have as they go (e.g. reading the input in chunks)
+        with self.lock:
+            self.sites_total += sites
+
+    def site_done(self, status=None, n=1, counter='site_status'):
+        """
+        Count finished sites, for throughput and ETA.
+
+        Args:
+            status - optional outcome, counted under counter
+            n - number of sites
+            counter - counter for the outcome
+        """
+        with self.lock:
+            self.sites_done += n
+        if status is not None:
+            self.count(counter, status, n)
+
+    def throughput(self):
+        #Sites per second since the run started
+        elapsed = time.time() - self.start_time
+        return self.sites_done / elapsed if elapsed > 0 else 0.0
+
+    def eta(self):
+        #Seconds until every site is done at the current throughput, or None if it can't be estimated yet
+        rate = self.throughput()
+        if rate == 0 or self.sites_total == 0:
+            return None
+        return max(self.sites_total - self.sites_done, 0) / rate
+
+    def slowest_hosts(self, n=5):
+        """
+        Get the hosts that took the most download time in total.
+
+        Args:
+            n - number of hosts
+
+        Returns:
+            list of (host, pages, total seconds, slowest page in seconds), slowest first
+        """
+        with self.lock:
+            hosts = sorted(self.hosts.items(), key=lambda item: item[1][1], reverse=True)[:n]
+        return [(host, pages, round(total, 2), round(slowest, 2)) for host, (pages, total, slowest) in hosts]
+
+    def snapshot(self):
+        """
+        Get every metric as a dictionary, e.g. for the log.
+
+        Returns:
+            dictionary with 'elapsed', 'sites_done', 'sites_total', 'throughput', 'eta', 'phases' (count, mean, p50, p99 and max per phase), 'counters' and 'slowest_hosts'
+        """
+        with self.lock:
+            phases = {}
+            for phase, histogram in self.histograms.items():
+                if histogram.count:
+                    phases[phase] = {'count': histogram.count, 'mean': round(histogram.total / histogram.count, 4), 'p50': round(histogram.quantile(0.5), 4),
+                                     'p99': round(histogram.quantile(0.99), 4), 'max': round(histogram.max, 4)}
+            counters = {counter: dict(labels) for counter, labels in self.counters.items()}
+        eta = self.eta()
+        return {'elapsed': round(time.time() - self.start_time, 1), 'sites_done': self.sites_done, 'sites_total': self.sites_total,
+                'throughput': round(self.throughput(), 3), 'eta': None if eta is None else round(eta), 'phases': phases, 'counters': counters,
+                'slowest_hosts': self.slowest_hosts()}
+
+    def format_summary(self):
+        """
+        Format the metrics for the progress output.
+
+        Returns:
+            multi-line summary string
+        """
+        snapshot = self.snapshot()
+        eta = snapshot['eta']
+        lines = [f"Throughput: {snapshot['throughput']} sites/sec         Sites: {snapshot['sites_done']} / {snapshot['sites_total']}         ETA: {format_duration(eta) if eta is not None else 'unknown'}"]
+        if snapshot['phases']:
+            lines.append("Latency (p50 / p99 / max secs): " + " | ".join(f"{phase} {stats['p50']} / {stats['p99']} / {stats['max']}" for phase, stats in snapshot['phases'].items()))
+        for counter, labels in snapshot['counters'].items():
+            lines.append(f"{counter}: " + ", ".join(f"{label} {count}" for label, count in sorted(labels.items(), key=lambda item: -item[1])))
+        if snapshot['slowest_hosts']:
+            lines.append("Slowest hosts: " + ", ".join(f"{host} ({pages} pages, {total} secs, slowest {slowest} secs)" for host, pages, total, slowest in snapshot['slowest_hosts']))
+        return "\n".join(lines)
+
+    def log(self, event, **fields):
+        """
+        Write an event to the log as a JSON line.
+
+        Args:
+            event - event name, e.g. 'page' or 'summary'
+            **fields - the event's data
+        """
+        if self.recorded is not None:
+            #Written to the log by the process that replays it
+            with self.lock:
+                self.recorded.append(('log', (event,), fields))
+            return
+        if self.log_file is None:
+            return
+        line = json.dumps({'time': round(time.time(), 3), 'event': event, **fields}, default=str)
+        with self.lock:
+            self.log_file.write(line + '\n')
+            self.log_file.flush()
+
+    def start_recording(self):
+        #Keep everything observed, counted and logged from now on, for stop_recording
+        with self.lock:
+            self.recorded = []
+
+    def stop_recording(self):
+        """
+        Stop recording.
+
+        Returns:
+            list of what was recorded since start_recording, to pass to replay (picklable, so it can be sent to another process)
+        """
+        with self.lock:
+            recorded, self.recorded = self.recorded or [], None
+        return recorded
+
+    def replay(self, recorded):
+        """
+        Add metrics recorded elsewhere (see stop_recording), as if they had been recorded here.
+
+        Args:
+            recorded - list returned by stop_recording
+        """
+        for method, args, fields in recorded:
+            getattr(self, method)(*args, **fields)
+
+    def log_summary(self):
+        self.log('summary', **self.snapshot())
+
+    def prometheus_text(self):
+        """
+        Format the metrics in the Prometheus text exposition format.
+
+        Returns:
+            string
+        """
+        lines = []
+        with self.lock:
+            lines.append('# TYPE crawl_phase_seconds histogram')
+            for phase, histogram in self.histograms.items():
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'crawl_phase_seconds_bucket{{phase="{phase}",le="{bound}"}} {cumulative}')
+                lines.append(f'crawl_phase_seconds_bucket{{phase="{phase}",le="+Inf"}} {histogram.count}')
+                lines.append(f'crawl_phase_seconds_sum{{phase="{phase}"}} {histogram.total}')
+                lines.append(f'crawl_phase_seconds_count{{phase="{phase}"}} {histogram.count}')
+            for counter, labels in self.counters.items():
+                lines.append(f'# TYPE crawl_{counter}_total counter')
+                for label, count in labels.items():
+                    lines.append(f'crawl_{counter}_total{{{counter}="{escape_label(label)}"}} {count}')
+            lines.append('# TYPE crawl_host_seconds_total counter')
+            for host, (pages, total, slowest) in self.hosts.items():
+                lines.append(f'crawl_host_seconds_total{{host="{escape_label(host)}"}} {total}')
+            lines.append(f'crawl_sites_done {self.sites_done}')
+            lines.append(f'crawl_sites_total {self.sites_total}')
+        lines.append(f'crawl_sites_per_second {self.throughput()}')
+        eta = self.eta()
+        if eta is not None:
+            lines.append(f'crawl_eta_seconds {eta}')
+        return '\n'.join(lines) + '\n'
+
+    def close(self):
+        if self.log_file is not None:
+            self.log_file.close()
+            self.log_file = None
+
+
+class _PageContext:
+    def __init__(self, metrics, url):
+        self.metrics = metrics
+        self.page = PageTimer(url)
+
+    def __enter__(self):
+        self.outer = getattr(self.metrics.local, 'page', None)
+        self.metrics.local.page = self.page
+        return self.page
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.metrics.local.page = self.outer
+        self.metrics.finish_page(self.page, exc)
+        return False
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_duration(seconds):
+    hours, rest = divmod(int(seconds), 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{hours}h {minutes:02d}m {seconds:02d}s" if hours else f"{minutes}m {seconds:02d}s"
+
+
+class MetricsServer:
+    """
+    Serves the shared metrics at http://127.0.0.1:port/metrics for Prometheus, from a background thread.
+    """
+
+    def __init__(self, port):
+        """
+        Args:
+            port - local port to listen on
+        """
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = get_metrics().prometheus_text().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+#Metrics shared by everything in a process; always collected, with the log and the Prometheus endpoint off unless configure_metrics turns them on
+metrics_settings = {'log_path': None, 'port': None}
+_default_metrics = None
+_server = None
+_default_lock = threading.Lock()
+
+
+def configure_metrics(log_path=None, port=None):
+    """
+    Start new shared metrics, with a log file and a Prometheus endpoint if given.
+
+    Args:
+        log_path - file path of the JSON Lines log
+        port - local port to serve /metrics on
+    """
+    global _default_metrics, _server
+    metrics_settings['log_path'] = log_path
+    metrics_settings['port'] = port
+    with _default_lock:
+        if _default_metrics is not None:
+            _default_metrics.close()
+        _default_metrics = CrawlMetrics(log_path)
+        if _server is not None:
+            _server.close()
+            _server = None
+        if port is not None:
+            _server = MetricsServer(port)
+
+
+def get_metrics():
+    """
+    Get the metrics shared by everything in this process.
+
+    Returns:
+        CrawlMetrics using metrics_settings
+    """
+    global _default_metrics
+    with _default_lock:
+        if _default_metrics is None:
+            _default_metrics = CrawlMetrics(metrics_settings['log_path'])
+        return _default_metrics
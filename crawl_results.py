@@ -0,0 +1,45 @@
+import email_extractor
+
+
+#Combine crawl results into one email list per website
+def collapse_emails(results_dict, website_mapping):
+    """
+    Combine the emails scraped from every url crawled for a website into one list per website.
+
+    Runs in a single pass over website_mapping with dictionary lookups, so it scales linearly with the number of crawled urls.
+
+    Args:
+        results_dict - dictionary with crawled urls as keys and lists of scraped emails as values
+        website_mapping - dictionary with row indexes as keys and lists of crawled urls as values
+
+    Returns:
+        collapsed_list - list with one list of unique emails per website_mapping entry, in the same order as website_mapping
+    """
+    collapsed_list = []
+    for idx, sites in website_mapping.items():
+        emails = set()
+        for site in set(sites):
+            emails.update(results_dict.get(site, ()))
+        collapsed_list.append(list(emails))
+    return collapsed_list
+
+
+#Remove fake emails and false-positives
+TO_REMOVE = email_extractor.TO_REMOVE
+
+def remove_fake_emails(emails, to_remove=TO_REMOVE):
+    """
+    Remove placeholder emails and false-positives (e.g. image file names) from a list of emails.
+
+    New crawls are already filtered by email_extractor as pages are scraped; this also covers results saved by older runs.
+
+    Args:
+        emails - list of emails
+        to_remove - list of substrings; any email containing one of them is removed
+
+    Returns:
+        list of the remaining emails
+    """
+    if to_remove is TO_REMOVE:
+        return email_extractor.default_extractor.filter(emails)
+    return [elem for elem in emails if not any(substr in elem for substr in to_remove)]
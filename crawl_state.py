@@ -0,0 +1,96 @@
+import json
+import sqlite3
+import time
+from url_normalization import normalize_url
+
+
+STATE_PATH = 'crawl_state.sqlite'
+
+#Statuses that count as a finished crawl; anything else (e.g. 'failed') is retried on the next run
+DONE_STATUSES = ('ok', 'http error', 'invalid URL', 'too large', 'not html')
+
+
+class CrawlState:
+    """
+    Persistent record of which input rows have been crawled, kept in SQLite so reruns on the same file only crawl what changed.
+
+    Rows are keyed by their row number in the input file plus the normalized website URL, so editing a row's website counts as a new row.
+    Each entry stores the crawl status, when it was crawled, whether the URL was invalid, and the (url, emails, status) of every page scraped for it.
+    """
+
+    def __init__(self, path=STATE_PATH):
+        """
+        Args:
+            path - file path of the SQLite database
+        """
+        self.path = path
+        #Shards of a sharded crawl can share the database, so wait for each other's writes
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS crawl_state (
+                input_row INTEGER NOT NULL,
+                url_key TEXT NOT NULL,
+                status TEXT NOT NULL,
+                crawled_at REAL NOT NULL,
+                invalid INTEGER NOT NULL,
+                pages TEXT NOT NULL,
+                PRIMARY KEY (input_row, url_key)
+            )""")
+        self.conn.commit()
+
+    def get(self, input_row, url):
+        """
+        Look up the saved crawl of a row.
+
+        Args:
+            input_row - row number of the website in the input file
+            url - website URL from the input file
+
+        Returns:
+            dictionary with 'status', 'crawled_at', 'invalid' and 'pages' keys, or None if the row has not been crawled
+        """
+        row = self.conn.execute('SELECT status, crawled_at, invalid, pages FROM crawl_state WHERE input_row = ? AND url_key = ?',
+                                (int(input_row), normalize_url(url))).fetchone()
+        if row is None:
+            return None
+        #Pages saved before per-page statuses were recorded have no status
+        pages = [(page[0], page[1], page[2] if len(page) > 2 else None) for page in json.loads(row[3])]
+        return {'status': row[0], 'crawled_at': row[1], 'invalid': bool(row[2]), 'pages': pages}
+
+    def is_current(self, input_row, url, max_age=None):
+        """
+        Check whether a row has a finished crawl that is newer than max_age.
+
+        Args:
+            input_row - row number of the website in the input file
+            url - website URL from the input file
+            max_age - maximum age of a crawl in seconds, or None to never expire crawls
+
+        Returns:
+            the saved entry (see get) if it can be reused, otherwise None
+        """
+        entry = self.get(input_row, url)
+        if entry is None or entry['status'] not in DONE_STATUSES:
+            return None
+        if max_age is not None and time.time() - entry['crawled_at'] > max_age:
+            return None
+        return entry
+
+    def save(self, input_row, url, status, pages, invalid=False):
+        """
+        Save the crawl of a row, replacing any earlier one.
+
+        Args:
+            input_row - row number of the website in the input file
+            url - website URL from the input file
+            status - crawl status of the homepage, e.g. 'ok', 'http error', 'invalid URL', 'too large', 'not html' or 'failed'
+            pages - list of (url, emails, status) tuples scraped for the row
+            invalid - whether the website was found to be an invalid URL
+        """
+        self.conn.execute('INSERT OR REPLACE INTO crawl_state VALUES (?, ?, ?, ?, ?, ?)',
+                          (int(input_row), normalize_url(url), status, time.time(), int(invalid), json.dumps(pages)))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
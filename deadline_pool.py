@@ -0,0 +1,129 @@
+import multiprocessing
+import time
+from collections import deque
+from multiprocessing.connection import wait
+
+
+def _worker_main(func, conn):
+    #Run tasks sent by the pool until told to stop
+    while True:
+        try:
+            item = conn.recv()
+        except EOFError:
+            break
+        if item is None:
+            break
+        task_id, args = item
+        try:
+            conn.send((task_id, 'done', func(*args)))
+        except Exception as e:
+            conn.send((task_id, 'error', repr(e)))
+    conn.close()
+
+
+class _Worker:
+    def __init__(self, func):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_worker_main, args=(func, child_conn), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.task_id = None
+        self.started = None
+
+    def run(self, task_id, args):
+        self.task_id = task_id
+        self.started = time.monotonic()
+        self.conn.send((task_id, args))
+
+    def stop(self, kill=False):
+        if kill:
+            self.process.terminate()
+        else:
+            try:
+                self.conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+
+
+class DeadlinePool:
+    """
+    Process pool that returns results in the order tasks finish and gives every task a real deadline.
+
+    Unlike multiprocessing.Pool, each task is handed to a specific worker, so its deadline counts from when it starts running rather than
+    from when it was submitted. A task that runs past its deadline is reported as 'timed out', and its worker is terminated and replaced,
+    so one hung host can't hold up the tasks behind it or tie up a worker for good.
+    """
+
+    def __init__(self, func, processes=None, timeout=20):
+        """
+        Args:
+            func - function to run for each task; must be picklable (defined at the top level of a module)
+            processes - number of worker processes; defaults to the number of CPUs
+            timeout - seconds a task may run before it is cancelled
+        """
+        self.func = func
+        self.processes = processes or multiprocessing.cpu_count()
+        self.timeout = timeout
+        self.pending = deque()
+
+    def submit(self, task_id, *args):
+        """
+        Queue a task.
+
+        Args:
+            task_id - identifier returned with the task's result
+            *args - arguments for func
+        """
+        self.pending.append((task_id, args))
+
+    def _replace(self, workers, worker):
+        #Kill a hung or dead worker, starting a fresh one if there are tasks left for it
+        worker.stop(kill=True)
+        if self.pending:
+            workers[workers.index(worker)] = _Worker(self.func)
+        else:
+            workers.remove(worker)
+
+    def results(self):
+        """
+        Run the queued tasks, yielding results as tasks finish.
+
+        Yields:
+            (task_id, status, result) tuples, where status is 'done' (result is func's return value), 'error' (result describes the exception)
+            or 'timed out' (result is None)
+        """
+        workers = [_Worker(self.func) for _ in range(min(self.processes, len(self.pending)))]
+        try:
+            while True:
+                for worker in workers:
+                    if worker.task_id is None and self.pending:
+                        worker.run(*self.pending.popleft())
+                busy = [worker for worker in workers if worker.task_id is not None]
+                if not busy:
+                    break
+                wait_time = max(0, min(worker.started + self.timeout for worker in busy) - time.monotonic())
+                ready = wait([worker.conn for worker in busy], timeout=wait_time)
+                for worker in busy:
+                    if worker.conn in ready:
+                        task_id = worker.task_id
+                        worker.task_id = None
+                        try:
+                            _, status, result = worker.conn.recv()
+                        except EOFError:
+                            #The worker died partway through the task
+                            self._replace(workers, worker)
+                            yield task_id, 'error', 'worker exited'
+                            continue
+                        yield task_id, status, result
+                    elif time.monotonic() - worker.started > self.timeout:
+                        task_id = worker.task_id
+                        worker.task_id = None
+                        self._replace(workers, worker)
+                        yield task_id, 'timed out', None
+        finally:
+            for worker in workers:
+                worker.stop(kill=worker.task_id is not None)
@@ -0,0 +1,299 @@
+import ipaddress
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+import crawl_metrics
+
+
+CACHE_PATH = 'dns_cache.sqlite'
+
+#The real resolver, used for lookups that miss the cache
+_original_getaddrinfo = socket.getaddrinfo
+
+#Errors that mean the name does not exist (cached as a negative answer); anything else is treated as a temporary failure
+NEGATIVE_ERRORS = {socket.EAI_NONAME} | ({socket.EAI_NODATA} if hasattr(socket, 'EAI_NODATA') else set())
+
+
+def get_hostname(url):
+    """
+    Get the hostname of a URL.
+
+    Args:
+        url - URL string
+
+    Returns:
+        lowercased hostname, or None if the URL has none
+    """
+    try:
+        return urllib.parse.urlsplit(url).hostname
+    except ValueError:
+        return None
+
+
+def is_ip_address(host):
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+
+
+class DNSCache:
+    """
+    Cache of DNS answers, one per hostname, so each host is resolved once per TTL instead of on every request.
+
+    Both positive answers (the host's addresses) and negative answers (the host does not exist) are cached, each with its own TTL.
+    Answers are kept in memory and saved to a SQLite database, so get_scrapability.py and email_crawler.py (and their worker processes) share them.
+    It is safe to use from several threads.
+    """
+
+    def __init__(self, path=CACHE_PATH, ttl=60*60, negative_ttl=10*60):
+        """
+        Args:
+            path - file path of the SQLite database, or None to only cache in memory
+            ttl - seconds to keep a host's addresses
+            negative_ttl - seconds to remember that a host does not exist
+        """
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.memory = {}
+        self.lock = threading.Lock()
+        self.conn = None
+        self.pid = None
+
+    def connect(self):
+        #Each process opens its own connection, since SQLite connections can't be shared across a fork
+        if self.path is None:
+            return None
+        if self.conn is None or self.pid != os.getpid():
+            self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self.pid = os.getpid()
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS dns (
+                    host TEXT PRIMARY KEY,
+                    addresses TEXT NOT NULL,
+                    resolved_at REAL NOT NULL
+                )""")
+            self.conn.commit()
+        return self.conn
+
+    def is_fresh(self, entry):
+        addresses, resolved_at = entry
+        ttl = self.ttl if addresses else self.negative_ttl
+        return time.time() - resolved_at <= ttl
+
+    def lookup(self, host):
+        """
+        Look up a cached answer without resolving the host.
+
+        Args:
+            host - hostname
+
+        Returns:
+            list of (family, sockaddr) addresses, an empty list if the host is known not to exist, or None if there is no fresh answer
+        """
+        with self.lock:
+            entry = self.memory.get(host)
+            if entry is None:
+                conn = self.connect()
+                if conn is not None:
+                    row = conn.execute('SELECT addresses, resolved_at FROM dns WHERE host = ?', (host,)).fetchone()
+                    if row is not None:
+                        entry = ([(family, tuple(sockaddr)) for family, sockaddr in json.loads(row[0])], row[1])
+                        self.memory[host] = entry
+        if entry is None or not self.is_fresh(entry):
+            return None
+        return entry[0]
+
+    def store(self, host, addresses):
+        entry = (addresses, time.time())
+        with self.lock:
+            self.memory[host] = entry
+            conn = self.connect()
+            if conn is not None:
+                conn.execute('INSERT OR REPLACE INTO dns VALUES (?, ?, ?)', (host, json.dumps(addresses), entry[1]))
+                conn.commit()
+
+    def resolve(self, host):
+        """
+        Resolve a hostname, using the cached answer if there is a fresh one.
+
+        Args:
+            host - hostname
+
+        Returns:
+            list of (family, sockaddr) addresses, or an empty list if the host does not exist
+
+        Raises:
+            socket.gaierror for temporary failures, which are not cached
+        """
+        host = host.lower()
+        addresses = self.lookup(host)
+        if addresses is not None:
+            return addresses
+        start = time.perf_counter()
+        try:
+            results = _original_getaddrinfo(host, None, 0, socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            if e.errno not in NEGATIVE_ERRORS:
+                raise
+            results = []
+        except UnicodeError:
+            results = []
+        finally:
+            crawl_metrics.get_metrics().observe('dns', time.perf_counter() - start)
+        addresses = []
+        for family, type, proto, canonname, sockaddr in results:
+            if (family, sockaddr) not in addresses and family in (socket.AF_INET, socket.AF_INET6):
+                addresses.append((int(family), sockaddr))
+        self.store(host, addresses)
+        return addresses
+
+    def known_unresolvable(self, hosts):
+        """
+        Find which hosts the cache has recorded as not existing, however long ago, without any lookups. Used when running offline.
+
+        Args:
+            hosts - iterable of hostnames
+
+        Returns:
+            set of the hosts with a stored negative answer
+        """
+        unresolved = set()
+        for host in {host.lower() for host in hosts if host}:
+            with self.lock:
+                entry = self.memory.get(host)
+                if entry is None and self.path is not None:
+                    row = self.connect().execute('SELECT addresses FROM dns WHERE host = ?', (host,)).fetchone()
+                    entry = None if row is None else (json.loads(row[0]), None)
+            if entry is not None and not entry[0]:
+                unresolved.add(host)
+        return unresolved
+
+    def pre_resolve(self, hosts, workers=100):
+        """
+        Resolve many hosts at once, filling the cache before any requests are made.
+
+        Args:
+            hosts - iterable of hostnames
+            workers - number of lookups to run at once
+
+        Returns:
+            set of the hosts that do not exist
+        """
+        hosts = list({host.lower() for host in hosts if host and not is_ip_address(host)})
+
+        def check(host):
+            try:
+                return host, len(self.resolve(host)) > 0
+            except (socket.gaierror, OSError):
+                #Temporary failure; leave it to the request itself
+                return host, True
+
+        if not hosts:
+            return set()
+        with ThreadPoolExecutor(max_workers=min(workers, len(hosts))) as executor:
+            return {host for host, resolved in executor.map(check, hosts) if not resolved}
+
+
+#Cache shared by everything in a process
+cache_settings = {'path': CACHE_PATH, 'ttl': 60*60, 'negative_ttl': 10*60}
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def get_cache():
+    """
+    Get the cache shared by everything in this process.
+
+    Returns:
+        DNSCache using cache_settings
+    """
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = DNSCache(cache_settings['path'], ttl=cache_settings['ttl'], negative_ttl=cache_settings['negative_ttl'])
+        return _default_cache
+
+
+def configure_cache(path=None, ttl=None, negative_ttl=None):
+    """
+    Change the settings of the shared cache. Takes effect the next time get_cache is called.
+
+    Args:
+        path - file path of the SQLite database
+        ttl - seconds to keep a host's addresses
+        negative_ttl - seconds to remember that a host does not exist
+    """
+    global _default_cache
+    if path is not None:
+        cache_settings['path'] = path
+    if ttl is not None:
+        cache_settings['ttl'] = ttl
+    if negative_ttl is not None:
+        cache_settings['negative_ttl'] = negative_ttl
+    with _default_lock:
+        _default_cache = None
+
+
+def cached_getaddrinfo(host, port, family=0, type=0, proto=0, flags=0):
+    """
+    Drop-in replacement for socket.getaddrinfo that answers TCP lookups from the shared cache.
+    Lookups for IP addresses, non-TCP sockets, or with special flags go to the real resolver.
+    """
+    passthrough_flags = socket.AI_NUMERICHOST | socket.AI_CANONNAME | socket.AI_PASSIVE
+    if not isinstance(host, str) or type != socket.SOCK_STREAM or flags & passthrough_flags or is_ip_address(host):
+        return _original_getaddrinfo(host, port, family, type, proto, flags)
+    addresses = get_cache().resolve(host)
+    if not addresses:
+        raise socket.gaierror(socket.EAI_NONAME, 'Name or service not known')
+    if port is None:
+        port_number = 0
+    elif isinstance(port, int) or str(port).isdigit():
+        port_number = int(port)
+    else:
+        port_number = socket.getservbyname(port, 'tcp')
+    results = []
+    for address_family, sockaddr in addresses:
+        if family not in (0, address_family):
+            continue
+        if address_family == socket.AF_INET:
+            address = (sockaddr[0], port_number)
+        else:
+            address = (sockaddr[0], port_number, sockaddr[2], sockaddr[3])
+        results.append((socket.AddressFamily(address_family), socket.SOCK_STREAM, proto or socket.IPPROTO_TCP, '', address))
+    if not results:
+        return _original_getaddrinfo(host, port, family, type, proto, flags)
+    return results
+
+
+def install():
+    """
+    Send every TCP hostname lookup in this process (requests, reppy, aiohttp) through the shared cache.
+    """
+    socket.getaddrinfo = cached_getaddrinfo
+
+
+def pre_resolve_urls(urls, workers=100, offline=False):
+    """
+    Resolve the hosts of many URLs at once with the shared cache.
+
+    Args:
+        urls - iterable of URLs
+        workers - number of lookups to run at once
+        offline - if True, don't look anything up; only report hosts already recorded as not existing
+
+    Returns:
+        set of the hostnames that do not exist
+    """
+    hosts = [get_hostname(url) for url in urls if isinstance(url, str)]
+    if offline:
+        return get_cache().known_unresolvable(hosts)
+    return get_cache().pre_resolve(hosts, workers=workers)
@@ -9,50 +9,201 @@ from googlesearch import search
 import ssl
 import socket
 from requests.exceptions import SSLError, InvalidURL, ConnectionError
-import retry
 import json
+import zlib
 import sys
 import time
+import argparse
+import crawl_engine
+import crawl_metrics
+import http_session
+import crawl_journal
+import crawl_state
+import crawl_results
+import email_extractor
+import robots_cache
+import dns_cache
+import rate_limiter
+import request_policy
+import link_extractor
+import link_ranker
+import response_cache
+import table_io
+from url_normalization import find_url
 
-socket.setdefaulttimeout(5) #How many seconds to wait before skipping a website
 ssl._create_default_https_context = ssl._create_unverified_context #fixed a bug involving certificates
+dns_cache.install() #Look up each host once and share the answer through dns_cache.sqlite
 
 
-#Scrape webpage for email addresses
-@retry.retry(ConnectionError, tries=3, delay=1)
-def find_email_addresses(url):
+#Pull email addresses out of a downloaded webpage
+def extract_emails(html_content):
     """
-    Scrape a webpage to find email addresses.
+    Find email addresses in the HTML of a webpage.
 
     Parameters:
-    - url (str): The URL of the webpage to scrape.
+    - html_content (str): The HTML content of the webpage.
 
     Returns:
-    - Tuple: A tuple containing a list of email addresses found on the webpage and the response status code.
+    - List: A list of the unique email addresses found in the HTML, without fake emails and false-positives.
+    """
+    email_addresses, invalid = email_extractor.default_extractor.extract(html_content)
+    if html_content == '' or invalid:
+        raise InvalidURL("Website does not exist")
+    return email_addresses
+
+
+#Pull contact and about links out of a downloaded webpage
+def extract_contact_links(html_content, url):
+    """
+    Find links to contact pages in the HTML of a webpage, using the fastest HTML parser installed (see link_extractor.py).
+
+    Parameters:
+    - html_content (str): The HTML content of the webpage.
+    - url (str): The URL the HTML came from, used to resolve relative links.
+
+    Returns:
+    - List: A list of URLs representing the contact pages found on the webpage.
+    """
+    url_base = urllib.parse.urlparse(url).scheme + "://" + urllib.parse.urlparse(url).netloc
+
+    start = time.perf_counter()
+    links = link_extractor.default_extractor.links(html_content)
+    crawl_metrics.get_metrics().observe('parse', time.perf_counter() - start)
+    new_links = []
+    for link in links:
+        if "contact" not in link and "about" not in link:
+            continue
+        if " " in link:
+            link = find_url(link) #Fixes cases where additional text is attached to the beginning of a found link
+            if link is None:
+                continue
+        new_links.append(urllib.parse.urljoin(url_base, link))
+    return new_links
+
+
+#Download a webpage, retrying connection errors and timeouts
+def download_page(url):
     """
-    # Send a GET request to the URL and retrieve the HTML content
-    response = requests.get(url, headers={'User-Agent': '*'})
+    Download a webpage with fetch_page, using the timeouts, retries and per-host circuit breaker of the shared request policy (see request_policy.py).
+    Hosts that keep failing are skipped straight away, raising request_policy.HostUnavailable.
+    The download's phase timings, status code and any exception are recorded in crawl_metrics.
+
+    Parameters:
+    - url (str): The URL of the webpage to download.
+
+    Returns:
+    - Tuple: See fetch_page.
+    """
+    with crawl_metrics.get_metrics().page(url) as page:
+        result = request_policy.get_policy().call(url, fetch_page, url)
+        page.set(status_code=result[2], reason=result[3])
+        return result
+
+
+#Download a webpage, scanning it for email addresses as it arrives
+def fetch_page(url):
+    """
+    Download a webpage in chunks, scanning each chunk for email addresses as it arrives.
+    The download is cut off at the size limit in http_session.stream_settings, stopped as soon as the page turns out to be an error page, and skipped if the content type is not HTML.
+    Requests wait their turn in the shared per-host rate limiter (see rate_limiter.py), and a Retry-After header on a 429 or 503 response holds off the host's later requests.
+    With the response cache on (see response_cache.py), pages already cached are revalidated with a conditional GET and, if unchanged, read from the cache;
+    in offline mode they are only ever read from the cache.
+
+    Parameters:
+    - url (str): The URL of the webpage to download.
+
+    Returns:
+    - Tuple: A tuple containing the HTML content read, a list of the unique email addresses found on the webpage, the response status code, and the reason the download was cut short ('too large' or 'not html'), or None if it was read in full.
+    """
+    cache = response_cache.get_cache()
+    cached = None
+    if cache is not None:
+        cached = cache.lookup(url)
+        if cache.offline:
+            if cached is None:
+                if url.startswith("https://") and cache.lookup(url.replace("https://", "http://", 1)) is not None:
+                    #The run that cached the page fell back to http after an SSL error
+                    raise SSLError(f"{url} was cached over http")
+                raise response_cache.NotCached(f"{url} is not in the response cache")
+            crawl_metrics.get_metrics().note(cache='offline')
+            return replay_page(cache, cached)
+
+    limiter = rate_limiter.get_limiter()
+    limiter.wait(url)
+    deadline = request_policy.get_policy().deadline()
+    headers = cache.conditional_headers(cached) if cache is not None else {}
+    response = http_session.fetch(url, stream=True, headers=headers)
+    if response.status_code == 304 and headers:
+        #Unchanged since it was cached
+        response.close()
+        cache.touch(url)
+        crawl_metrics.get_metrics().note(cache='revalidated')
+        return replay_page(cache, cached)
     if response.status_code != 200:
-        return [], response.status_code
-    
-    html_content = response.text
-    invalid_regex = r'dnserrorassist|page not found|404 not found|response code 403|error 404|404 error|does not exist|doesn\'t exist|no longer exists|not be found|cannot find the page|couldn\'t find the page|directory not found|HTTP Error|check the URL|not a web page'
-    invalid_search = re.findall(invalid_regex, html_content)
-    if html_content == '' or len(invalid_search) > 0:
+        if response.status_code in (429, 503):
+            retry_after = rate_limiter.parse_retry_after(response.headers.get('Retry-After'))
+            if retry_after is not None:
+                limiter.back_off(url, retry_after)
+        response.close()
+        if cache is not None:
+            cache.store(url, response)
+        return '', [], response.status_code, None
+    if not http_session.is_allowed_type(response):
+        response.close()
+        if cache is not None:
+            cache.store(url, response, reason='not html')
+        return '', [], response.status_code, 'not html'
+
+    scanner = email_extractor.StreamScanner()
+    html_content, reason = http_session.read_text(response, on_text=scanner.feed, deadline=deadline)
+    if cache is not None:
+        cache.store(url, response, html_content, reason)
+    email_addresses, invalid = scanner.result()
+    if invalid or (html_content == '' and reason is None):
+        raise InvalidURL("Website does not exist")
+    return html_content, email_addresses, response.status_code, reason
+
+
+#Rerun email extraction on a cached page
+def replay_page(cache, entry):
+    """
+    Scan a page from the response cache for email addresses with the current extraction rules, without any network traffic.
+
+    Parameters:
+    - cache (ResponseCache): The cache the page is in.
+    - entry (dict): The page's cache entry (see ResponseCache.lookup).
+
+    Returns:
+    - Tuple: The same as fetch_page.
+    """
+    if entry['status_code'] != 200:
+        return '', [], entry['status_code'], None
+    if entry['reason'] == 'not html':
+        return '', [], entry['status_code'], 'not html'
+    html_content = cache.read_body(entry)
+    reason = 'too large' if entry['reason'] == 'too large' else None
+    start = time.perf_counter()
+    email_addresses, invalid = email_extractor.default_extractor.extract(html_content)
+    crawl_metrics.get_metrics().observe('extract', time.perf_counter() - start)
+    if invalid or (html_content == '' and reason is None):
         raise InvalidURL("Website does not exist")
+    return html_content, email_addresses, entry['status_code'], reason
 
-    # Regular expression pattern to match email addresses
-    email_pattern = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b'
+#Scrape webpage for email addresses
+def find_email_addresses(url):
+    """
+    Scrape a webpage to find email addresses.
 
-    # Extract email addresses from the text nodes
-    email_addresses = []
-    matches = re.findall(email_pattern, html_content)
-    email_addresses.extend(matches)
+    Parameters:
+    - url (str): The URL of the webpage to scrape.
 
-    return email_addresses, response.status_code
+    Returns:
+    - Tuple: A tuple containing a list of email addresses found on the webpage and the response status code.
+    """
+    html_content, email_addresses, code, reason = download_page(url)
+    return email_addresses, code
 
 #Crawls a webpage looking for contact pages
-@retry.retry(ConnectionError, tries=3, delay=1)
 def crawl_page(url):
     """
     Crawl a webpage to find contact pages.
@@ -63,200 +214,517 @@ def crawl_page(url):
     Returns:
     - List: A list of URLs representing the contact pages found on the webpage.
     """
-    url_base = urllib.parse.urlparse(url).scheme + "://" + urllib.parse.urlparse(url).hostname
-
-    response = requests.get(url, headers={'User-Agent': '*'})
-    if response.status_code != 200:
+    html_content, email_addresses, code, reason = download_page(url)
+    if code != 200:
         return []
-    soup = BeautifulSoup(response.text, 'html.parser')
-    links = [a.get('href') for a in soup.find_all('a', href=True)]
-    keep = ["contact" in link or "about" in link for link in links]
-    contact_links = [links[i] for i in range(len(links)) if keep[i]]
-    new_links = []
-    for link in contact_links:
-        if " " in link:
-            link = re.search(r"http[^ ]+", link).group() #Fixes cases where additional text is attached to the beginning of a found link
-        new_links.append(urllib.parse.urljoin(url_base, link))
-    return new_links
+    return extract_contact_links(html_content, url)
+
+#Scrape a webpage for email addresses and contact pages with a single request
+def process_page(url):
+    """
+    Scrape a webpage for email addresses and links to contact pages, downloading it only once.
+
+    Parameters:
+    - url (str): The URL of the webpage to scrape.
 
+    Returns:
+    - Tuple: A tuple containing a list of email addresses found on the webpage, a list of URLs representing the contact pages found on the webpage, the response status code, and the reason the download was cut short ('too large' or 'not html'), or None.
+    """
+    html_content, email_addresses, code, reason = download_page(url)
+    if code != 200 or html_content == '':
+        return email_addresses, [], code, reason
 
+    try:
+        contact_links = extract_contact_links(html_content, url)
+    except:
+        contact_links = []
+    return email_addresses, contact_links, code, reason
 
-#Read in the data
-if len(sys.argv) < 2:
-    print("Please provide a filename or path. The file must contain a 'website' column and a 'scrapability' column for which sites can be scraped (T/F).")
-    sys.exit(1)
-file_path = sys.argv[1]
 
-try:
-    if file_path.lower().endswith('.csv'):
-        df = pd.read_csv(file_path)
-    elif file_path.lower().endswith('.xlsx'):
-        df = pd.read_excel(file_path)
-    else:
-        raise ValueError("Unsupported file format, please provide a .csv or .xlsx file: {}".format(file_path))
-except FileNotFoundError:
-    print("File not found: {}".format(file_path))
-    sys.exit(1)
-
-except pd.errors.ParserError:
-    print("Error parsing the file: {}".format(file_path))
-    sys.exit(1)
-
-except:
-    print("An error occurred while reading the file: {}".format(file_path))
-    sys.exit(1)
-
-#Check column names
-full_dataset = df
-renamed = [False, False, False]
-if 'Website' in df.columns:
-    df = df.rename(columns = {'Website' : 'website'})
-    renamed[0] = True
-if 'website' in df.columns:
-    df = df.dropna(subset=['website'])
-else:
-    print("Error: The file must contain a 'website' column.")
-    sys.exit(1)
-if 'Emails' in df.columns:
-    df = df.rename(columns = {'Emails' : 'emails'})
-    renamed[1] = True
-if 'emails' in df.columns:
-    user_input = input("Warning: 'emails' column will be overwritten. Press enter to continue, or 'q' to quit: ")
-    if (user_input == 'q'):
-        sys.exit(1)
-    df = df.drop('emails', axis=1)
-    if renamed[1]:
-        full_dataset = full_dataset.drop('Emails', axis=1)
-    else:
-        full_dataset = full_dataset.drop('emails', axis=1)
-if 'Scrapability' in df.columns:
-    df = df.rename(columns = {'Scrapability' : 'scrapability'})
-    renamed[2] = True
-if 'scrapability' in df.columns:
-    df = df.loc[df['scrapability']==True]
-else:
-    print("Error: The file must contain a 'scrapability' column.")
-    sys.exit(1)
-
-df = df.reset_index(drop=True)
-
-df['scrapability_new'] = df['scrapability']
-#Looking at valid (scrapable) urls
-urls = df['website'].tolist()
-results_dict = {}
-#code_dict = {}
-website_mapping = {}
-print(f"Number of websites to scrape: {len(urls)}")
-start_time = time.time()
-print(f"Current progress: 0 / {len(urls)}         Elapsed time: 0 secs")
-#for each website
-for i in range(len(urls)):
-    url = urls[i]
+def page_status(code, invalid=False, reason=None):
+    """
+    Summarize how crawling a page went.
+
+    Parameters:
+    - code (int): The response status code, or -1 if the request errored or timed out.
+    - invalid (bool): Whether the page was found to be an invalid URL.
+    - reason (str): The reason the download was cut short, if it was.
+
+    Returns:
+    - String: 'ok', 'invalid URL', 'too large', 'not html', 'http error', or 'failed' for errors, timeouts and responses worth retrying (429 and 5xx).
+    """
+    if invalid:
+        return 'invalid URL'
+    if reason is not None:
+        return reason
+    if code == 200:
+        return 'ok'
+    if code == -1 or code == 429 or code >= 500:
+        return 'failed'
+    return 'http error'
+
+
+#Scrape a website and its contact pages
+def crawl_site(url):
+    """
+    Scrape a website for email addresses, then crawl one layer deep to the best 'contact' or 'about' pages that robots.txt allows (see link_ranker.rank_links).
+
+    Parameters:
+    - url (str): The URL of the website to scrape.
+
+    Returns:
+    - Tuple: A tuple containing a list of (url, emails, status) tuples for every page crawled, in crawl order, a boolean for if the website was found to be an invalid URL, and the status of the homepage (see page_status).
+    """
+    pages = []
+    invalid = False
     emails = []
+    contact_urls = []
     code = None
-    #try to get the emails
+    reason = None
+    #try to get the emails and the "contact" and "about" links
     try:
-        emails, code = find_email_addresses(url)
+        emails, contact_urls, code, reason = process_page(url)
     except SSLError as e:
         try:
             url = url.replace("https://", "http://")
-            emails, code = find_email_addresses(url)
+            emails, contact_urls, code, reason = process_page(url)
         except InvalidURL as e:
             emails = []
             code = -1
-            df.loc[i,'scrapability_new'] = 'invalid URL'
+            invalid = True
         except:
             emails = []
             code = -1
     except InvalidURL as e:
         emails = []
         code = -1
-        df.loc[i,'scrapability_new'] = 'invalid URL'
+        invalid = True
     except:
         emails = []
         code = -1
-    #remove duplicates
-    emails = list(set(emails))
-    results_dict[url] = emails
-    #code_dict[url] = code
-    website_mapping.setdefault(i, []).append(url)
+    status = page_status(code, invalid, reason)
+    pages.append((url, emails, status))
 
-    #next, crawl the webpage for "contact" and "about" links
+    #next, crawl the best "contact" and "about" links, skipping duplicates and links to other sites
     if code==200:
-        try:
-            contact_urls = crawl_page(url)
-        except:
-            contact_urls = []
-
+        contact_urls = link_ranker.rank_links(contact_urls, url, crawled=[url])
         for contact_url in contact_urls:
+            #The homepage was checked against robots.txt by get_scrapability.py; check each contact page too
             try:
-                emails, code = find_email_addresses(contact_url)
+                if not response_cache.is_offline() and robots_cache.can_fetch(contact_url) is False:
+                    continue
+            except:
+                pass
+            contact_invalid = False
+            reason = None
+            try:
+                html_content, emails, code, reason = download_page(contact_url)
             except SSLError as e:
                 try:
-                    url = url.replace("https://", "http://")
-                    emails, code = find_email_addresses(contact_url)
+                    contact_url = contact_url.replace("https://", "http://")
+                    html_content, emails, code, reason = download_page(contact_url)
+                except InvalidURL as e:
+                    emails = []
+                    code = -1
+                    contact_invalid = True
                 except:
                     emails = []
                     code = -1
+            except InvalidURL as e:
+                emails = []
+                code = -1
+                contact_invalid = True
             except:
                 emails = []
                 code = -1
-            #remove duplicates
-            emails = list(set(emails))
-            results_dict[contact_url] = emails
-            #code_dict[contact_url] = code
-            website_mapping.setdefault(i, []).append(contact_url)
-    if (i <= 25):
-        print(f"Current progress: {i} / {len(urls)}         Elapsed time: {round(time.time() - start_time, 1)} secs | ({round((time.time() - start_time)/(60*60), 2)} hrs) | {time.asctime(time.localtime(time.time()))}")
-    elif i % 10 == 0 and i != 0:
-        print(f"Current progress: {i} / {len(urls)}         Elapsed time: {round(time.time() - start_time, 1)} secs | ({round((time.time() - start_time)/(60*60), 2)} hrs) | {time.asctime(time.localtime(time.time()))}")
-    #Save periodically to be safe
-    if i % 50 == 0 and i != 0:
-        json.dump(results_dict, open("results_dict.json", 'w' ))
-        #json.dump(code_dict, open("code_dict.json", 'w' ))
-        json.dump(website_mapping, open("website_mapping.json", 'w' ))
-
-json.dump(results_dict, open("results_dict.json", 'w' ))
-#json.dump(code_dict, open("code_dict.json", 'w' ))
-json.dump(website_mapping, open("website_mapping.json", 'w' ))
-
-print(f"Scraping complete.         Elapsed time: {round(time.time() - start_time, 1)} secs\n\n")
-
-
-#Clean up the results and put them into the dataframe
-email_list = []
-counts = []
-for idx, sites in website_mapping.items():
-    email_list.append([value for key, value in results_dict.items() if key in sites])
-    counts.append(len([key for key in results_dict.keys() if key in sites])) #counts of all the urls scraped for a given base url for combining later
-email_list = [emails for subset in email_list for emails in subset] #all emails are in a list of list, where the inner lists correspond to each url scraped
-
-collapsed_list = []
-for i, count in enumerate(counts):
-    starting_point = sum(counts[0:i])
-    group = email_list[starting_point:(starting_point+counts[i])]
-    collapsed_list.append(list(set([emails for website in group for emails in website])))
-df['emails'] = collapsed_list
-
-#Remove fake emails and false-positives
-to_remove = ["example","test","domain","email","@sentry","wixpress","automattic",".png",".jpg"]
-df['emails'] = df['emails'].apply(lambda lst: [elem for elem in lst if not any(substr in elem for substr in to_remove)])
-
-#to get details on the response codes and the specific website urls that emails came from, look at the code_dict and results_dict, respectively (the keys are the urls)
-
-if renamed[0]:
-    df = df.rename(columns = {'website' : 'Website'})
-if renamed[1]:
-    df = df.rename(columns = {'emails' : 'Emails'})
-if renamed[2]:
-    df = df.rename(columns = {'scrapability' : 'Scrapability'})
-
-
-full_dataset = full_dataset.merge(df, how='outer')
-
-full_dataset['scrapability_new'] = full_dataset['scrapability_new'].fillna(full_dataset['scrapability'])
-full_dataset.drop('scrapability', axis=1, inplace=True)
-
-full_dataset.to_excel('crawled_emails.xlsx', index=False)
-
-print("Output file 'crawled_emails.xlsx' created. \n\nFor information on the specific website urls that emails came from, the response codes from those websites, and the mapping from crawled websites to the provided urls, please see results_dict.json, code_dict.json, and website_mappings.json")
\ No newline at end of file
+            pages.append((contact_url, emails, page_status(code, contact_invalid, reason)))
+    return pages, invalid, status
+
+
+def read_file(file_path):
+    try:
+        return table_io.read_table(file_path)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    except ImportError as e:
+        print(e)
+        sys.exit(1)
+    except FileNotFoundError:
+        print("File not found: {}".format(file_path))
+        sys.exit(1)
+    except pd.errors.ParserError:
+        print("Error parsing the file: {}".format(file_path))
+        sys.exit(1)
+    except:
+        print("An error occurred while reading the file: {}".format(file_path))
+        sys.exit(1)
+
+
+def fix_df(df):
+    #Check column names
+    full_dataset = df
+    renamed = [False, False, False]
+    if 'Website' in df.columns:
+        df = df.rename(columns = {'Website' : 'website'})
+        renamed[0] = True
+    if 'website' in df.columns:
+        df = df.dropna(subset=['website'])
+    else:
+        print("Error: The file must contain a 'website' column.")
+        sys.exit(1)
+    if 'Emails' in df.columns:
+        df = df.rename(columns = {'Emails' : 'emails'})
+        renamed[1] = True
+    if 'emails' in df.columns:
+        user_input = input("Warning: 'emails' column will be overwritten. Press enter to continue, or 'q' to quit: ")
+        if (user_input == 'q'):
+            sys.exit(1)
+        df = df.drop('emails', axis=1)
+        if renamed[1]:
+            full_dataset = full_dataset.drop('Emails', axis=1)
+        else:
+            full_dataset = full_dataset.drop('emails', axis=1)
+    if 'Scrapability' in df.columns:
+        df = df.rename(columns = {'Scrapability' : 'scrapability'})
+        renamed[2] = True
+    if 'scrapability' in df.columns:
+        df = df.loc[df['scrapability']==True]
+    else:
+        print("Error: The file must contain a 'scrapability' column.")
+        sys.exit(1)
+
+    #Remember each website's row in the input file, to match it up on later runs
+    df['input_row'] = df.index
+    df = df.reset_index(drop=True)
+    #Object column, since it can also hold 'invalid URL'
+    df['scrapability_new'] = df['scrapability'].astype(object)
+    return df, full_dataset, renamed
+
+
+def save_results(results_dict, website_mapping):
+    #Keep the mapping in row order so the outputs line up with the input file
+    website_mapping = {i: website_mapping[i] for i in sorted(website_mapping)}
+    json.dump(results_dict, open("results_dict.json", 'w' ))
+    #json.dump(code_dict, open("code_dict.json", 'w' ))
+    json.dump(website_mapping, open("website_mapping.json", 'w' ))
+
+
+def print_progress(i, total, start_time):
+    elapsed = time.time() - start_time
+    rate = i / elapsed if elapsed > 0 else 0
+    eta = crawl_metrics.format_duration((total - i) / rate) if rate > 0 else 'unknown'
+    print(f"Current progress: {i} / {total}         Elapsed time: {round(elapsed, 1)} secs | ({round(elapsed/(60*60), 2)} hrs) | {round(rate, 2)} sites/sec, ETA {eta} | {time.asctime(time.localtime(time.time()))}")
+
+
+def shard_of(url, shard_count):
+    """
+    Work out which shard a website belongs to. Websites are split by a hash of their host, so every website on a host is crawled by the same shard
+    and the split is the same in every process and on every machine.
+
+    Parameters:
+    - url (str): The URL of the website.
+    - shard_count (int): The number of shards.
+
+    Returns:
+    - Int: The shard number, from 0 to shard_count - 1.
+    """
+    return zlib.crc32(crawl_engine.get_host(url).encode('utf-8')) % shard_count
+
+
+def parse_shard(value):
+    #argparse type for --shard K/N
+    try:
+        shard, shard_count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError("Shards are given as K/N, e.g. 0/4 for the first of four shards")
+    if shard_count < 1 or not 0 <= shard < shard_count:
+        raise argparse.ArgumentTypeError("K must be between 0 and N-1")
+    return shard, shard_count
+
+
+def shard_journal_path(shard, shard_count):
+    return f"crawl_journal.shard-{shard}-of-{shard_count}.jsonl"
+
+
+def crawl_websites(df, use_async=False, max_concurrency=50, per_host_concurrency=2, resume=False, incremental=False, max_age=None, dns_workers=100, shard=None):
+    """
+    Crawl every website in the dataframe, appending results to crawl_journal.jsonl as it goes, then save results_dict.json and website_mapping.json.
+    Every crawl is also saved to crawl_state.sqlite, so a later incremental run can reuse it.
+    Before crawling, every host is looked up in DNS at once; websites whose host doesn't exist are recorded as 'invalid URL' without being requested.
+
+    Parameters:
+    - df (DataFrame): Dataframe of scrapable websites, with a 'website', 'input_row' and 'scrapability_new' column.
+    - use_async (bool): Whether to crawl websites concurrently with the asyncio crawl engine.
+    - max_concurrency (int): Maximum number of websites crawled at once when use_async is True.
+    - per_host_concurrency (int): Maximum number of websites on the same host crawled at once when use_async is True.
+    - resume (bool): Whether to continue from the existing journal, skipping the websites it already contains.
+    - incremental (bool): Whether to skip websites with a finished crawl in crawl_state.sqlite. Failed or timed-out crawls are retried.
+    - max_age (float): With incremental, crawls older than this many seconds are redone. None reuses crawls of any age.
+    - dns_workers (int): Number of DNS lookups to run at once.
+    - shard (Tuple): (K, N) to only crawl the websites in shard K of N (see shard_of). The shard's results go to its own journal (see shard_journal_path) instead of crawl_journal.jsonl and the .json files, to be combined by merge_shards.
+
+    Returns:
+    - Tuple: A tuple containing the results_dict (urls to emails) and the website_mapping (row indexes to crawled urls).
+    """
+    #Looking at valid (scrapable) urls
+    urls = df['website'].tolist()
+    input_rows = df['input_row'].tolist()
+    results_dict = {}
+    #code_dict = {}
+    website_mapping = {}
+    done = set()
+    journal_path = crawl_journal.JOURNAL_PATH
+    rows = range(len(urls))
+    if shard is not None:
+        journal_path = shard_journal_path(*shard)
+        rows = [i for i in rows if shard_of(urls[i], shard[1]) == shard[0]]
+        print(f"Shard {shard[0]}/{shard[1]}: {len(rows)} of {len(urls)} websites")
+    row_set = set(rows)
+
+    def add_result(i, pages, invalid):
+        if invalid:
+            df.loc[i,'scrapability_new'] = 'invalid URL'
+        for page_url, emails, url_status in pages:
+            results_dict[page_url] = emails
+            #code_dict[page_url] = code
+            website_mapping.setdefault(i, []).append(page_url)
+
+    if resume:
+        pages_by_row, invalid_rows = crawl_journal.read_journal(journal_path)
+        for i in sorted(invalid_rows):
+            if i in row_set:
+                add_result(i, pages_by_row[i], invalid_rows[i])
+                done.add(i)
+        print(f"Resuming: {len(done)} websites already scraped")
+    state = crawl_state.CrawlState()
+    reused = {}
+    if incremental:
+        for i in rows:
+            if i in done:
+                continue
+            entry = state.is_current(input_rows[i], urls[i], max_age)
+            if entry is not None:
+                add_result(i, entry['pages'], entry['invalid'])
+                reused[i] = entry
+        done.update(reused)
+        print(f"Incremental: reusing {len(reused)} websites from {crawl_state.STATE_PATH}")
+    journal = crawl_journal.CrawlJournal(journal_path, resume=resume)
+    #Rows reused from the state store go in the journal too, so it covers the whole run
+    for i, entry in reused.items():
+        for page_url, emails, status in entry['pages']:
+            journal.append_page(i, page_url, emails, status)
+        journal.finish_site(i, entry['invalid'], sync=False)
+    journal.sync()
+    print(f"Number of websites to scrape: {len(rows) - len(done)}")
+    start_time = time.time()
+    print(f"Current progress: 0 / {len(rows) - len(done)}         Elapsed time: 0 secs")
+    metrics = crawl_metrics.get_metrics()
+    metrics.set_total(len(rows) - len(done))
+
+    completed = 0
+    def record(i, result):
+        nonlocal completed
+        pages, invalid, status = result
+        add_result(i, pages, invalid)
+        for page_url, emails, url_status in pages:
+            journal.append_page(i, page_url, emails, url_status)
+        journal.finish_site(i, invalid)
+        state.save(input_rows[i], urls[i], status, pages, invalid)
+        for page_url, emails, url_status in pages:
+            metrics.count('page_status', url_status)
+        metrics.site_done(status)
+        completed += 1
+        if (completed <= 25) or completed % 10 == 0:
+            print_progress(completed, len(rows) - len(done), start_time)
+        if completed % 100 == 0:
+            print(rate_limiter.format_metrics(rate_limiter.get_limiter().metrics()))
+            print(metrics.format_summary())
+            metrics.log_summary()
+
+    to_crawl = [(i, urls[i]) for i in rows if i not in done]
+    try:
+        #Resolve every host up front; the crawl then reuses the cached answers, and hosts that don't exist are never requested
+        unresolved = dns_cache.pre_resolve_urls([url for i, url in to_crawl], workers=dns_workers, offline=response_cache.is_offline())
+        if unresolved:
+            print(f"Hosts not found in DNS: {len(unresolved)}")
+            for i, url in to_crawl:
+                if dns_cache.get_hostname(url) in unresolved:
+                    record(i, ([(url, [], 'invalid URL')], True, 'invalid URL'))
+            to_crawl = [(i, url) for i, url in to_crawl if dns_cache.get_hostname(url) not in unresolved]
+        #Take sites from each host in turn, so no host's rate limit holds up the rest of the crawl
+        to_crawl = crawl_engine.interleave_by_host(to_crawl)
+        if use_async:
+            crawl_engine.run_crawl(to_crawl, crawl_site, record, max_concurrency=max_concurrency, per_host_concurrency=per_host_concurrency)
+        else:
+            #for each website
+            for i, url in to_crawl:
+                record(i, crawl_site(url))
+    finally:
+        journal.close()
+        state.close()
+
+    crawl_journal.compact_journal(journal_path)
+    if shard is None:
+        save_results(results_dict, website_mapping)
+
+    print(rate_limiter.format_metrics(rate_limiter.get_limiter().metrics()))
+    print(metrics.format_summary())
+    metrics.log_summary()
+    skipped_hosts = request_policy.get_policy().breaker.open_hosts()
+    if skipped_hosts:
+        print(f"Hosts skipped after repeated failures: {len(skipped_hosts)}")
+    print(f"Scraping complete.         Elapsed time: {round(time.time() - start_time, 1)} secs\n\n")
+    return results_dict, {i: website_mapping[i] for i in sorted(website_mapping)}
+
+
+def merge_shards(df, shard_count):
+    """
+    Combine the journals written by every shard of a sharded crawl, then save results_dict.json and website_mapping.json as a single crawl would.
+
+    Parameters:
+    - df (DataFrame): Dataframe from fix_df, for the same input file the shards crawled.
+    - shard_count (int): The number of shards (N in --shard K/N).
+
+    Returns:
+    - Tuple: A tuple containing the results_dict (urls to emails) and the website_mapping (row indexes to crawled urls). Rows that no shard finished get an empty list of urls.
+    """
+    results_dict = {}
+    website_mapping = {}
+    for shard in range(shard_count):
+        path = shard_journal_path(shard, shard_count)
+        if not os.path.exists(path):
+            print(f"Warning: {path} not found; shard {shard}/{shard_count} has not been run")
+            continue
+        pages_by_row, invalid_rows = crawl_journal.read_journal(path)
+        for i in sorted(invalid_rows):
+            if invalid_rows[i]:
+                df.loc[i,'scrapability_new'] = 'invalid URL'
+            for page_url, emails, status in pages_by_row[i]:
+                results_dict[page_url] = emails
+                website_mapping.setdefault(i, []).append(page_url)
+    missing = [i for i in range(len(df)) if i not in website_mapping]
+    if missing:
+        print(f"Warning: {len(missing)} websites were not scraped by any shard")
+    for i in missing:
+        website_mapping[i] = []
+    save_results(results_dict, website_mapping)
+    return results_dict, {i: website_mapping[i] for i in sorted(website_mapping)}
+
+
+def add_emails(df, full_dataset, renamed, results_dict, website_mapping):
+    #Clean up the results and put them into the dataframe
+    df['emails'] = crawl_results.collapse_emails(results_dict, website_mapping)
+
+    df = df.drop('input_row', axis=1)
+
+    #Remove fake emails and false-positives
+    df['emails'] = df['emails'].apply(crawl_results.remove_fake_emails)
+
+    #to get details on the response codes and the specific website urls that emails came from, look at the code_dict and results_dict, respectively (the keys are the urls)
+
+    if renamed[0]:
+        df = df.rename(columns = {'website' : 'Website'})
+    if renamed[1]:
+        df = df.rename(columns = {'emails' : 'Emails'})
+    if renamed[2]:
+        df = df.rename(columns = {'scrapability' : 'Scrapability'})
+
+
+    full_dataset = full_dataset.merge(df, how='outer')
+
+    full_dataset['scrapability_new'] = full_dataset['scrapability_new'].fillna(full_dataset['scrapability'])
+    full_dataset.drop('scrapability', axis=1, inplace=True)
+    return full_dataset
+
+
+def add_crawl_options(parser):
+    """
+    Add the command line options for downloading and scraping pages (timeouts, rate limits, caches, ...) to an argument parser, for configure_crawl.
+
+    Parameters:
+    - parser (ArgumentParser): The parser to add the options to.
+    """
+    parser.add_argument('--max-page-size', type=float, default=10, help="Stop downloading pages larger than this many MB (default 10)")
+    parser.add_argument('--robots-ttl', type=float, default=24, help="Hours to reuse a website's robots.txt from robots_cache.sqlite before downloading it again (default 24)")
+    parser.add_argument('--pool-connections', type=int, default=100, help="Number of hosts to keep open connections for, per thread (default 100)")
+    parser.add_argument('--pool-maxsize', type=int, default=10, help="Number of open connections to keep per host, per thread (default 10)")
+    parser.add_argument('--dns-workers', type=int, default=100, help="Number of DNS lookups to run at once (default 100)")
+    parser.add_argument('--dns-ttl', type=float, default=60, help="Minutes to reuse a host's DNS answer from dns_cache.sqlite (default 60)")
+    parser.add_argument('--rate', type=float, default=1, help="Requests per second allowed to each host with --async or pipeline.py (default 1)")
+    parser.add_argument('--burst', type=int, default=2, help="Requests a host may receive back to back before --rate applies (default 2)")
+    parser.add_argument('--max-delay', type=float, default=60, help="Longest robots.txt Crawl-delay or Retry-After header to honor, in seconds (default 60)")
+    parser.add_argument('--link-parser', choices=['auto'] + list(link_extractor.PARSERS), default='auto', help="HTML parser used to find contact and about links. auto picks the fastest installed: selectolax, then lxml, then BeautifulSoup (default auto)")
+    parser.add_argument('--max-contact-pages', type=int, default=5, help="Maximum number of contact and about pages scraped per website (default 5)")
+    parser.add_argument('--cache', action='store_true', help="Save downloaded pages in the response_cache folder, and revalidate already cached pages with conditional requests")
+    parser.add_argument('--offline', action='store_true', help="Rerun email extraction on the pages in the response_cache folder without downloading anything (e.g. after changing the email filters)")
+    parser.add_argument('--connect-timeout', type=float, default=5, help="Seconds to wait for a connection to a website (default 5)")
+    parser.add_argument('--read-timeout', type=float, default=5, help="Seconds to wait for each read from a website (default 5)")
+    parser.add_argument('--page-timeout', type=float, default=30, help="Seconds a page download may take in total (default 30)")
+    parser.add_argument('--tries', type=int, default=3, help="Attempts per page for connection errors and timeouts, with exponential backoff between them (default 3)")
+    parser.add_argument('--host-failures', type=int, default=3, help="Failed requests in a row after which the rest of a host's pages are skipped (default 3)")
+    parser.add_argument('--metrics-log', help="Write every page download (phase timings, status code, exception) and regular summaries to this file as JSON lines")
+    parser.add_argument('--metrics-port', type=int, help="Serve live metrics for Prometheus at http://127.0.0.1:PORT/metrics")
+
+
+def configure_crawl(args, concurrent=True):
+    """
+    Apply the options added by add_crawl_options to the shared sessions, caches, rate limiter and request policy.
+
+    Parameters:
+    - args (Namespace): Parsed command line arguments.
+    - concurrent (bool): Whether websites will be crawled concurrently. The per-host rate limiter is only turned on for concurrent crawls.
+    """
+    link_extractor.configure_parser(args.link_parser)
+    response_cache.configure_cache(enabled=args.cache, offline=args.offline)
+    link_ranker.configure_ranking(limit=args.max_contact_pages)
+    http_session.configure_sessions(pool_connections=args.pool_connections, pool_maxsize=args.pool_maxsize)
+    http_session.configure_streaming(max_bytes=int(args.max_page_size*1024*1024))
+    robots_cache.configure_cache(ttl=args.robots_ttl*60*60)
+    dns_cache.configure_cache(ttl=args.dns_ttl*60)
+    request_policy.configure_policy(connect_timeout=args.connect_timeout, read_timeout=args.read_timeout, total_timeout=args.page_timeout, tries=args.tries, failure_threshold=args.host_failures)
+    rate_limiter.configure_limiter(rate=args.rate, burst=args.burst, max_delay=args.max_delay, enabled=concurrent)
+    crawl_metrics.configure_metrics(log_path=args.metrics_log, port=args.metrics_port)
+
+
+def main():
+    #Read in the data
+    parser = argparse.ArgumentParser(description="Scrape the provided websites for emails, crawling one layer deep to any 'contact' or 'about' pages.")
+    parser.add_argument('file_path', help="The file must contain a 'website' column and a 'scrapability' column for which sites can be scraped (T/F).")
+    parser.add_argument('--async', dest='use_async', action='store_true', help="Crawl websites concurrently with the asyncio crawl engine")
+    parser.add_argument('--max-concurrency', type=int, default=50, help="Maximum number of websites crawled at once with --async (default 50)")
+    parser.add_argument('--per-host', type=int, default=2, help="Maximum number of websites on the same host crawled at once with --async (default 2)")
+    parser.add_argument('--resume', action='store_true', help="Continue an interrupted run, skipping websites already saved in crawl_journal.jsonl")
+    parser.add_argument('--incremental', action='store_true', help="Skip websites already crawled on an earlier run (saved in crawl_state.sqlite); failed or timed-out websites are retried")
+    parser.add_argument('--max-age', type=float, default=7, help="With --incremental, recrawl websites last crawled more than this many days ago (default 7)")
+    parser.add_argument('--shard', type=parse_shard, metavar='K/N', help="Only scrape shard K of N (K from 0 to N-1), split by host. Each shard writes its own journal; combine them with --merge N")
+    parser.add_argument('--merge', type=int, metavar='N', help="Combine the journals of an N-shard run into the output file instead of scraping")
+    parser.add_argument('--output', default='crawled_emails.xlsx', help="Output file (.xlsx, .csv or .parquet); CSV and Parquet are much faster to write for long website lists (default crawled_emails.xlsx)")
+    add_crawl_options(parser)
+    args = parser.parse_args()
+    try:
+        table_io.table_format(args.output)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+
+    configure_crawl(args, concurrent=args.use_async)
+
+    df = read_file(args.file_path)
+    df, full_dataset, renamed = fix_df(df)
+    if args.merge is not None:
+        results_dict, website_mapping = merge_shards(df, args.merge)
+    else:
+        results_dict, website_mapping = crawl_websites(df, use_async=args.use_async, max_concurrency=args.max_concurrency, per_host_concurrency=args.per_host, resume=args.resume, incremental=args.incremental, max_age=args.max_age*24*60*60, dns_workers=args.dns_workers, shard=args.shard)
+        if args.shard is not None:
+            print(f"Shard {args.shard[0]}/{args.shard[1]} saved to {shard_journal_path(*args.shard)}. Once every shard has finished, run with --merge {args.shard[1]} to create {args.output}")
+            return
+    full_dataset = add_emails(df, full_dataset, renamed, results_dict, website_mapping)
+
+    table_io.write_table(full_dataset, args.output)
+
+    print(f"Output file '{args.output}' created. \n\nFor information on the specific website urls that emails came from, the response codes from those websites, and the mapping from crawled websites to the provided urls, please see results_dict.json, code_dict.json, and website_mappings.json")
+
+
+if __name__ == '__main__':
+    main()
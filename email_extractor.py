@@ -0,0 +1,206 @@
+import re
+
+
+#Phrases that show a page is an error page served with a 200 status code ("soft 404")
+INVALID_PHRASES = ['dnserrorassist', 'page not found', '404 not found', 'response code 403', 'error 404', '404 error', 'does not exist', "doesn't exist", 'no longer exists', 'not be found', 'cannot find the page', "couldn't find the page", 'directory not found', 'HTTP Error', 'check the URL', 'not a web page']
+INVALID_REGEX = '|'.join(re.escape(phrase) for phrase in INVALID_PHRASES)
+
+# Regular expression pattern to match email addresses
+EMAIL_REGEX = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b'
+#Characters an email can be made of; every email match lies inside a run of these that contains an '@'
+EMAIL_CHARS = frozenset('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789._%+-')
+
+#Substrings of fake emails and false-positives (e.g. image file names like logo@2x.png)
+TO_REMOVE = ["example","test","domain","email","@sentry","wixpress","automattic",".png",".jpg"]
+
+
+class EmailExtractor:
+    """
+    Finds email addresses and soft-404 phrases in a page, with every pattern compiled once.
+
+    Python's re module scans every position of a page for a pattern like the email regex, and a combined alternation of the
+    soft-404 phrases and the email regex is slower still, since it loses the literal-prefix fast path. Instead, the page is
+    scanned once for '@' characters with str.find, and the email regex only runs on the run of email characters around each one,
+    which gives the same matches as running it on the whole page. The soft-404 phrases are plain substrings, checked with
+    str's C substring search.
+    Emails are deduplicated, then any containing a to_remove substring are dropped using one combined regex.
+    """
+
+    def __init__(self, email_regex=EMAIL_REGEX, invalid_phrases=INVALID_PHRASES, to_remove=TO_REMOVE):
+        """
+        Args:
+            email_regex - regex pattern to match email addresses; every match must contain an '@' and only characters in EMAIL_CHARS
+            invalid_phrases - list of phrases that mark an error page
+            to_remove - list of substrings; emails containing any of them are dropped
+        """
+        self.email = re.compile(email_regex)
+        self.email_run = re.compile('[' + re.escape(''.join(sorted(EMAIL_CHARS))) + '@]*')
+        self.invalid_phrases = list(invalid_phrases)
+        self.to_remove = list(to_remove)
+        self.exclude = re.compile('|'.join(re.escape(substr) for substr in self.to_remove)) if self.to_remove else None
+
+    def is_invalid(self, html_content):
+        """
+        Check a page for soft-404 phrases.
+
+        Args:
+            html_content - HTML content of the webpage
+
+        Returns:
+            True if the page contains a soft-404 phrase
+        """
+        return any(phrase in html_content for phrase in self.invalid_phrases)
+
+    def find_emails(self, html_content, start=0, end=None):
+        """
+        Find emails in a page, or in html_content[start:end].
+
+        Args:
+            html_content - HTML content of the webpage
+            start - index to start searching from
+            end - index to stop searching at; '@' characters at or after it are ignored
+
+        Returns:
+            list of emails found, in order, with duplicates
+        """
+        if end is None:
+            end = len(html_content)
+        emails = []
+        at = html_content.find('@', start, end)
+        while at != -1:
+            #Walk back to the start of the local part, then forward past the domain
+            run_start = at
+            while run_start > start and html_content[run_start - 1] in EMAIL_CHARS:
+                run_start -= 1
+            run_end = self.email_run.match(html_content, at).end()
+            #Include the next character so a trailing \b sees what follows the run
+            emails.extend(match.group() for match in self.email.finditer(html_content, run_start, min(run_end + 1, len(html_content))))
+            at = html_content.find('@', run_end, end)
+        return emails
+
+    def scan(self, html_content):
+        """
+        Scan a page for emails and soft-404 phrases.
+
+        Args:
+            html_content - HTML content of the webpage
+
+        Returns:
+            emails - list of unique emails found on the page, in order of first appearance, before the to_remove filter
+            invalid - True if the page contains a soft-404 phrase
+        """
+        if self.is_invalid(html_content):
+            return [], True
+        return list(dict.fromkeys(self.find_emails(html_content))), False
+
+    def filter(self, emails):
+        """
+        Drop fake emails and false-positives.
+
+        Args:
+            emails - list of emails
+
+        Returns:
+            list of the emails that contain none of the to_remove substrings
+        """
+        if self.exclude is None:
+            return list(emails)
+        return [email for email in emails if self.exclude.search(email) is None]
+
+    def extract(self, html_content):
+        """
+        Scan a page and filter the emails found.
+
+        Args:
+            html_content - HTML content of the webpage
+
+        Returns:
+            emails - list of unique, filtered emails found on the page
+            invalid - True if the page contains a soft-404 phrase
+        """
+        emails, invalid = self.scan(html_content)
+        return self.filter(emails), invalid
+
+
+#Shared extractor with the default patterns, so they are compiled once per process
+default_extractor = EmailExtractor()
+
+
+class StreamScanner:
+    """
+    Scans a page for emails and soft-404 phrases as it downloads, one chunk of text at a time.
+
+    Text that could be the start of an email or phrase cut off by a chunk boundary (the trailing run of email characters,
+    plus enough characters to hold the longest phrase) is carried over to the next chunk, so the results match scanning the whole page.
+    """
+
+    #Longest trailing run of email characters to carry over; longer runs are scanned as they are
+    MAX_CARRY = 4096
+
+    def __init__(self, extractor=None):
+        """
+        Args:
+            extractor - EmailExtractor whose patterns to use; defaults to the shared default_extractor
+        """
+        self.extractor = extractor if extractor is not None else default_extractor
+        self.keep = max([len(phrase) for phrase in self.extractor.invalid_phrases] + [1]) - 1
+        self.buffer = ''
+        self.email_start = 0
+        self.emails = {}
+        self.invalid = False
+
+    def feed(self, text):
+        """
+        Scan the next chunk of the page.
+
+        Args:
+            text - next chunk of the page's text
+
+        Returns:
+            True if a soft-404 phrase has been found and the rest of the page can be skipped
+        """
+        if self.invalid:
+            return True
+        buffer = self.buffer + text
+        if self.extractor.is_invalid(buffer):
+            self.invalid = True
+            return True
+        #Hold back the trailing run of email characters, which may continue in the next chunk
+        cut = len(buffer)
+        while cut > self.email_start and len(buffer) - cut < self.MAX_CARRY and (buffer[cut - 1] in EMAIL_CHARS or buffer[cut - 1] == '@'):
+            cut -= 1
+        if len(buffer) - cut >= self.MAX_CARRY:
+            cut = len(buffer)
+        for email in self.extractor.find_emails(buffer, self.email_start, cut):
+            self.emails[email] = None
+        #Keep one character before the held-back run, so \b at its start still sees what came before it
+        carry_from = max(0, min(cut - 1, len(buffer) - self.keep))
+        self.buffer = buffer[carry_from:]
+        self.email_start = cut - carry_from
+        return False
+
+    def close(self):
+        """
+        Scan whatever text is left after the last chunk.
+
+        Returns:
+            emails - list of unique emails found on the page, in order of first appearance, before the to_remove filter
+            invalid - True if the page contains a soft-404 phrase
+        """
+        if self.invalid:
+            return [], True
+        for email in self.extractor.find_emails(self.buffer, self.email_start):
+            self.emails[email] = None
+        self.buffer = ''
+        return list(self.emails), False
+
+    def result(self):
+        """
+        Finish the scan and filter the emails found.
+
+        Returns:
+            emails - list of unique, filtered emails found on the page
+            invalid - True if the page contains a soft-404 phrase
+        """
+        emails, invalid = self.close()
+        return self.extractor.filter(emails), invalid
@@ -1,4 +1,5 @@
 import os
+import shutil
 import re
 import pandas as pd
 import urllib.parse
@@ -7,20 +8,36 @@ import math
 from googlesearch import search
 import ssl
 import socket
-from requests.exceptions import SSLError, InvalidURL, ConnectionError
-import retry
 import json
 import sys
 import time
-import reppy
-from reppy.robots import Robots
+#reppy is only needed for the default backend; the asyncio backend works without it
+try:
+    import reppy
+    from reppy.robots import Robots
+except ImportError:
+    reppy = None
 import multiprocessing
 import time
 import warnings
+import argparse
+import robots_cache
+import dns_cache
+import request_policy
+import crawl_metrics
+import table_io
+from url_normalization import normalize_urls
+from deadline_pool import DeadlinePool
 warnings.filterwarnings("ignore")
 
-socket.setdefaulttimeout(5) #How many seconds to wait before skipping a website
 ssl._create_default_https_context = ssl._create_unverified_context #fixed a bug involving certificates
+dns_cache.install() #Look up each host once and share the answer through dns_cache.sqlite
+
+
+#Websites that are never checked
+SKIPPED_URLS = ['https://www.sandiegocounty.gov/parks/picnic/snapdragon.html', 
+                'https://www.sdparks.org/content/sdparks/en/park-pages/SantaYsabel.html', 
+                'https://www.teamusa.org/usa-softball/about/hall-of-fame/illinois-hall-of-fame']
 
 
 def parallel_can_fetch(url):
@@ -30,12 +47,27 @@ def parallel_can_fetch(url):
 def can_fetch(url):
     try:
         print(url)
-        if url in ['https://www.sandiegocounty.gov/parks/picnic/snapdragon.html', 
-                   'https://www.sdparks.org/content/sdparks/en/park-pages/SantaYsabel.html', 
-                   'https://www.teamusa.org/usa-softball/about/hall-of-fame/illinois-hall-of-fame']:
+        if url in SKIPPED_URLS:
             return 'site skipped'
         robot_url = Robots.robots_url(url)
-        robots = Robots.fetch(robot_url)
+        #robots.txt is fetched once per host and shared through robots_cache, instead of with Robots.fetch for every row
+        entry = robots_cache.get_cache().get(robot_url)
+        if entry['error'] == 'SSL Error':
+            raise reppy.exceptions.SSLException(entry['error'])
+        if entry['error'] in ('invalid URL', 'timed out'):
+            raise reppy.exceptions.ConnectionException(entry['error'])
+        if entry['error'] == 'malformed URL':
+            raise reppy.exceptions.MalformedUrl(entry['error'])
+        if entry['error'] == 'content too long':
+            raise reppy.exceptions.ContentTooLong(entry['error'])
+        if entry['error'] == 'excessive redirects':
+            raise reppy.exceptions.ExcessiveRedirects(entry['error'])
+        #Same status code handling as Robots.fetch
+        if entry['status_code'] in (401, 403):
+            return False
+        if entry['status_code'] != 200:
+            raise reppy.exceptions.BadStatusCode(entry['status_code'])
+        robots = Robots.parse(robot_url, entry['content'])
         return robots.allowed(url, '*')
     except reppy.exceptions.ConnectionException:
         return 'invalid URL'
@@ -53,46 +85,21 @@ def can_fetch(url):
         return 'content too long'
 
 
-@retry.retry(ConnectionError, tries=3, delay=1)
-def check_scrapability(url):
-    """
-    Check robots.txt to see if a site can be scraped
-
-    Parameters:
-    - url (str): The URL of the webpage to scrape.
-
-    Returns:
-    - Tuple: A tuple containing a boolean for if the website can be scraped, and an int for if the site was skipped (0 for not skipped, 1 for skipped, 2 for invalid url)
-    """
-    try:
-        rp = urllib.robotparser.RobotFileParser()
-        rp.set_url(url+'robots.txt')
-        rp.read()
-        return rp.can_fetch("*", url), 0
-    except SSLError as e:
-        try:
-            url = url.replace("https://", "http://")
-            rp.set_url(url+'robots.txt')
-            rp.read()
-            return rp.can_fetch("*", url), 0
-        except InvalidURL as e:
-            return False, 2
-        except:
-            return False, 1
-    except InvalidURL as e:
-        return False, 2
-    except:
-        return False, 1
-    
-
-def read_file(file_path):
+def read_file(file_path, chunk_size=None):
+    #With a chunk_size, returns an iterator of chunks instead of the whole table (see table_io.iter_table)
     try:
-        if file_path.lower().endswith('.csv'):
-            return pd.read_csv(file_path)
-        elif file_path.lower().endswith('.xlsx'):
-            return pd.read_excel(file_path)
-        else:
-            raise ValueError("Unsupported file format, please provide a .csv or .xlsx file: {}".format(file_path))
+        if chunk_size is None:
+            return table_io.read_table(file_path)
+        table_io.table_format(file_path)
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(file_path)
+        return table_io.iter_table(file_path, chunk_size)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    except ImportError as e:
+        print(e)
+        sys.exit(1)
     except FileNotFoundError:
         print("File not found: {}".format(file_path))
         sys.exit(1)
@@ -117,65 +124,222 @@ def fix_df(df):
         renamed[1] = True
     if 'scrapability' not in df.columns:
         df['scrapability'] = None
-    cleaned_urls = []
-    for url in df['website']:
-        if not pd.isna(url):
-            url = url.strip().split(' ')[0]
-            if not url.startswith('https://') and not url.startswith('http://'):
-                url = 'https://' + url
-        cleaned_urls.append(url)
-    df['website'] = cleaned_urls
+    #An empty column is read in as numbers; results are True, False or text
+    df['scrapability'] = df['scrapability'].astype(object)
+    #Clean every URL at once (see url_normalization.normalize_urls); blank websites become missing, and are skipped
+    normalized = normalize_urls(df['website'])
+    df['website'] = normalized['url']
+    #Websites that can't be requested (no valid host, a scheme other than http(s), a bad port) are marked without downloading anything
+    unchecked = df['scrapability'].isna() | (df['scrapability'] == 'Malformed URL')
+    df.loc[normalized['malformed'] & unchecked, 'scrapability'] = 'malformed URL'
     return df
 
 
-def get_scrapability(df, output_fp, overwrite=False, use_reppy=True):
+def parallel_can_fetch_host(urls):
+    #All of a host's urls are checked in one task, so its robots.txt is downloaded once.
+    #The worker's robots.txt timings and counts are sent back with the results, since its metrics aren't the main process's
+    metrics = crawl_metrics.get_metrics()
+    metrics.start_recording()
+    try:
+        results = [can_fetch(url) for url in urls]
+    finally:
+        recorded = metrics.stop_recording()
+    return results, recorded
+
+
+def plan_scrapability(df, overwrite=False):
+    """
+    Work out which rows need checking, and group them so each unique URL is checked once.
+
+    Parameters:
+    - df (DataFrame): Dataframe with 'website' and 'scrapability' columns.
+    - overwrite (bool): Whether to recheck rows that already have a scrapability result.
+
+    Returns:
+    - Dictionary: Hosts (robots.txt URLs) as keys, and as values dictionaries of normalized URL to (URL to check, list of the row indexes with that URL).
+    """
+    if overwrite:
+        todo = pd.Series(True, index=df.index)
+    else:
+        todo = df['scrapability'].isna() | (df['scrapability'] == 'Malformed URL')
+    missing = todo & df['website'].isna()
+    df.loc[missing, 'scrapability'] = 'site skipped'
+    urls = df.loc[todo & ~missing, 'website']
+    #Keys and hosts for every row at once; the loop below only groups them
+    normalized = normalize_urls(urls)
+    hosts = (normalized['origin'] + '/robots.txt').fillna(normalized['key'])
+    plan = {}
+    for i, url, key, host in zip(urls.index, urls, normalized['key'], hosts):
+        group = plan.setdefault(host, {})
+        if key in group:
+            group[key][1].append(i)
+        else:
+            group[key] = (url, [i])
+    rows = sum(len(row_indexes) for group in plan.values() for url, row_indexes in group.values())
+    unique = sum(len(group) for group in plan.values())
+    if rows > 0:
+        print(f"Rows to check: {rows}         Unique URLs: {unique}         Hosts: {len(plan)}         Dedup ratio: {round(rows / unique, 2)} rows per URL ({round(100 * (1 - unique / rows), 1)}% of checks avoided)")
+    return plan
+
+
+def drop_unresolvable(df, plan, workers=100):
+    """
+    Look up every host in the plan at once, marking the rows of hosts that don't exist as 'invalid URL' so no connection is attempted for them.
+
+    Parameters:
+    - df (DataFrame): Dataframe with a 'scrapability' column.
+    - plan (Dictionary): Plan from plan_scrapability; hosts that don't exist are removed from it.
+    - workers (int): Number of DNS lookups to run at once.
+    """
+    unresolved = dns_cache.get_cache().pre_resolve([dns_cache.get_hostname(host) for host in plan], workers=workers)
+    dropped = 0
+    for host in list(plan):
+        if dns_cache.get_hostname(host) in unresolved:
+            for url, row_indexes in plan.pop(host).values():
+                df.loc[row_indexes, 'scrapability'] = 'invalid URL'
+                dropped += len(row_indexes)
+    if dropped > 0:
+        crawl_metrics.get_metrics().count('robots_result', 'invalid URL', dropped)
+    if dropped > 0:
+        print(f"Hosts not found in DNS: {len(unresolved)}         Rows marked 'invalid URL': {dropped}")
+
+
+def get_scrapability(df, output_fp, overwrite=False, use_reppy=True, timeout=20, checkpoint_rows=500, checkpoint_secs=60, use_async=False, concurrency=1000, dns_workers=100, on_checkpoint=None):
+    """
+    Check robots.txt for every website in the dataframe, filling in the 'scrapability' column and saving it to output_fp.
+
+    With use_reppy, hosts are checked in parallel worker processes and results are collected in the order they finish.
+    Each host gets timeout seconds; hosts that take longer are marked 'timed out' and their worker is replaced.
+    With use_async, hosts are instead checked from this process with asyncio (see async_robots.py), with up to concurrency downloads at once.
+    Before any robots.txt is downloaded, every host is looked up in DNS, and rows whose host doesn't exist are marked 'invalid URL' straight away.
+    Progress is saved every checkpoint_rows rows or checkpoint_secs seconds, whichever comes first, to a Parquet (or CSV) checkpoint next to output_fp
+    (see table_io.ChunkWriter), so the slow Excel writer only runs once, when the results are written to output_fp at the end.
+
+    Parameters:
+    - df (DataFrame): Dataframe with 'website' and 'scrapability' columns.
+    - output_fp (str): File path to save the results to (.xlsx, .csv or .parquet), or None to leave saving to the caller.
+    - overwrite (bool): Whether to recheck rows that already have a scrapability result.
+    - use_reppy (bool): Whether to check hosts in parallel worker processes.
+    - timeout (float): Seconds a host may take before it is marked 'timed out'.
+    - checkpoint_rows (int): Number of rows between saves.
+    - checkpoint_secs (float): Seconds between saves.
+    - use_async (bool): Whether to use the asyncio backend instead of reppy.
+    - concurrency (int): Maximum number of robots.txt downloads at once with use_async.
+    - dns_workers (int): Number of DNS lookups to run at once.
+    - on_checkpoint (function): Called with df to save progress, instead of writing the checkpoint next to output_fp.
+    """
+    if on_checkpoint is None and output_fp is not None:
+        writer = table_io.ChunkWriter(table_io.checkpoint_path(output_fp))
+        on_checkpoint = lambda df: writer.write_part(0, df)
     start_time = time.time()
     checked = 0
-    pool = multiprocessing.Pool()
-    processes = {}
-    for i in df.index:
-        # if i % 50 == 0:
-        #     print(f"Current progress: {i} / {df.shape[0]}         Elapsed time: {round(time.time() - start_time, 1)} secs")
-        if not overwrite and not pd.isna(df.loc[i, 'scrapability']) and df.loc[i, 'scrapability'] != 'Malformed URL':
-            continue
-        url = df.loc[i, 'website']
-        if pd.isna(url):
-            df.loc[i, 'scrapability'] = 'site skipped'
-            continue
-        if use_reppy:
-            p = pool.apply_async(parallel_can_fetch, args=(url, ))
-            processes[i] = p
-        else:
-            df.loc[i, 'scrapability'] = can_fetch(url)
-            checked += 1
-            if checked % 10 == 0:
-                df.to_excel('scrapability.xlsx', index=False)
-
-    if use_reppy:
-        for i, p in processes.items():
-            try:
-                if i % 50 == 0:
-                    print(f"Current progress: {i} / {df.shape[0]}         Elapsed time: {round(time.time() - start_time, 1)} secs")
-                    df.to_excel(output_fp, index=False)
-                df.loc[i, 'scrapability'] = p.get(10)
-            except multiprocessing.TimeoutError:
-                df.loc[i, 'scrapability'] = 'timed out'
+    plan = plan_scrapability(df, overwrite)
+    drop_unresolvable(df, plan, workers=dns_workers)
+    total = sum(len(row_indexes) for group in plan.values() for url, row_indexes in group.values())
+    last_checkpoint = (0, time.time())
+    metrics = crawl_metrics.get_metrics()
+    metrics.add_total(total)
+
+    def checkpoint(force=False):
+        nonlocal last_checkpoint
+        rows, when = last_checkpoint
+        if force or checked - rows >= checkpoint_rows or time.time() - when >= checkpoint_secs:
+            print(f"Current progress: {checked} / {total}         Elapsed time: {round(time.time() - start_time, 1)} secs")
+            print(metrics.format_summary())
+            metrics.log_summary()
+            if on_checkpoint is not None:
+                on_checkpoint(df)
+            last_checkpoint = (checked, time.time())
+
+    def record(host, results):
+        nonlocal checked
+        #Fan each URL's result back out to every row with that URL
+        for (url, row_indexes), result in zip(plan[host].values(), results):
+            df.loc[row_indexes, 'scrapability'] = result
+            checked += len(row_indexes)
+            metrics.site_done(result, len(row_indexes), counter='robots_result')
+        checkpoint()
+
+    if use_async:
+        import async_robots
+        hosts = [(host, [url for url, row_indexes in group.values()]) for host, group in plan.items()]
+        async_robots.check_hosts(hosts, record, concurrency=concurrency, timeout=timeout, skip_urls=SKIPPED_URLS)
+    elif use_reppy:
+        pool = DeadlinePool(parallel_can_fetch_host, timeout=timeout)
+        for host, group in plan.items():
+            pool.submit(host, [url for url, row_indexes in group.values()])
+        #Results come back as each host finishes, so a slow host doesn't hold up the others
+        for host, status, results in pool.results():
+            group = plan[host]
+            if status == 'done':
+                results, recorded = results
+                metrics.replay(recorded)
+            elif status == 'timed out':
+                results = ['timed out'] * len(group)
+            elif status == 'error':
+                results = ['site skipped'] * len(group)
+            record(host, results)
+    else:
+        for host, group in plan.items():
+            for url, row_indexes in group.values():
+                result = can_fetch(url)
+                df.loc[row_indexes, 'scrapability'] = result
+                checked += len(row_indexes)
+                metrics.site_done(result, len(row_indexes), counter='robots_result')
+                checkpoint()
             
+    print(metrics.format_summary())
+    metrics.log_summary()
     print(f"Complete.         Elapsed time: {round(time.time() - start_time, 1)} secs\n\n")
-    df.to_excel(output_fp, index=False)
+    if output_fp is not None:
+        table_io.write_table(df, output_fp)
+        shutil.rmtree(table_io.checkpoint_path(output_fp), ignore_errors=True)
         
 
 def main():
     #Read in the data
-    if len(sys.argv) < 3:
-        print("Please provide an input and output filepath. The input file must contain a 'website' column and a 'scrapability' column for which sites can be scraped (T/F).")
+    parser = argparse.ArgumentParser(description="Check robots.txt for each website, recording whether or not the site can be scraped.")
+    parser.add_argument('file_path', help="Input file. The input file must contain a 'website' column and a 'scrapability' column for which sites can be scraped (T/F).")
+    parser.add_argument('output_fp', help="Output file (.xlsx, .csv or .parquet)")
+    parser.add_argument('--backend', choices=['reppy', 'asyncio'], default='reppy', help="reppy: check hosts in worker processes with reppy (default). asyncio: check hosts from one process with asyncio and the stdlib robots.txt parser")
+    parser.add_argument('--concurrency', type=int, default=1000, help="Maximum number of robots.txt downloads at once with the asyncio backend (default 1000)")
+    parser.add_argument('--timeout', type=float, default=20, help="Seconds a host may take before it is marked 'timed out' (default 20)")
+    parser.add_argument('--connect-timeout', type=float, default=5, help="Seconds to wait for a connection when downloading robots.txt (default 5)")
+    parser.add_argument('--read-timeout', type=float, default=5, help="Seconds to wait for each read when downloading robots.txt (default 5)")
+    parser.add_argument('--tries', type=int, default=3, help="Attempts per robots.txt for connection errors and timeouts, with exponential backoff between them (default 3)")
+    parser.add_argument('--dns-workers', type=int, default=100, help="Number of DNS lookups to run at once (default 100)")
+    parser.add_argument('--dns-ttl', type=float, default=60, help="Minutes to reuse a host's DNS answer from dns_cache.sqlite (default 60)")
+    parser.add_argument('--chunk-size', type=int, default=table_io.CHUNK_SIZE, help=f"Rows read and checked at a time, so memory use stays flat however long the input is (default {table_io.CHUNK_SIZE})")
+    parser.add_argument('--checkpoint-format', choices=['parquet', 'csv'], default=None, help="Format of the checkpoint saved while checking (default parquet if pyarrow is installed, otherwise csv)")
+    parser.add_argument('--metrics-log', help="Write every robots.txt download and regular summaries (latency by phase, results, throughput) to this file as JSON lines")
+    parser.add_argument('--metrics-port', type=int, help="Serve live metrics for Prometheus at http://127.0.0.1:PORT/metrics")
+    args = parser.parse_args()
+    crawl_metrics.configure_metrics(log_path=args.metrics_log, port=args.metrics_port)
+    dns_cache.configure_cache(ttl=args.dns_ttl*60)
+    request_policy.configure_policy(connect_timeout=args.connect_timeout, read_timeout=args.read_timeout, tries=args.tries)
+    if args.backend == 'reppy' and reppy is None:
+        print("reppy is not installed. Install it, or use --backend asyncio.")
         sys.exit(1)
-    file_path = sys.argv[1]
-    output_fp = sys.argv[2]
 
-    df = read_file(file_path)
-    df = fix_df(df)
-    get_scrapability(df, output_fp)
+    try:
+        table_io.table_format(args.output_fp)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    #Chunks are checkpointed to a folder next to the output; an interrupted run picks up from the rows it had already checked
+    checkpoint_fp = table_io.checkpoint_path(args.output_fp)
+    writer = table_io.ChunkWriter(checkpoint_fp, args.checkpoint_format)
+    for number, df in enumerate(read_file(args.file_path, args.chunk_size)):
+        saved = writer.read_part(number)
+        if saved is not None and len(saved) == len(df):
+            df = saved
+        df = fix_df(df)
+        get_scrapability(df, None, timeout=args.timeout, use_async=args.backend == 'asyncio', concurrency=args.concurrency, dns_workers=args.dns_workers,
+                         on_checkpoint=lambda df: writer.write_part(number, df))
+        writer.write_part(number, df)
+    #The output is written once, at the end
+    writer.export(args.output_fp)
+    shutil.rmtree(checkpoint_fp)
 
 
 if __name__ == '__main__':
@@ -1,9 +1,14 @@
 import pandas as pd
+import urllib.error
+import urllib.request
 import urllib.robotparser
+import concurrent.futures
+import time
 from bs4 import BeautifulSoup
 import requests
-import socket
 import re
+import http_session
+import link_extractor
 
 
 #clean URL
@@ -15,11 +20,13 @@ def clean_url(series):
         series - pandas series of one URL per row
         
     Returns:
-        websites - list of cleaned websites that can be appended to original dataframe
+        websites - list of cleaned websites that can be appended to original dataframe; missing or blank URLs are ''
     """
     websites = []
     for site in series:
-        if site[-1] == '.':
+        if not isinstance(site, str) or site == '':
+            websites.append('')
+        elif site[-1] == '.':
                 site = site[:-1]
                 #site = site+'/'
                 websites.append(site)
@@ -31,26 +38,97 @@ def clean_url(series):
     return websites
 
 
+#run a function on many items at once
+def run_concurrently(func, items, workers, timeout, fallback):
+    """
+    Calls func on every item from a pool of threads, giving each call timeout seconds from when it starts. A call still running after that is given up on (its thread finishes in the background, bounded by the call's own socket timeouts).
+    
+    Args:
+        func - function taking one item
+        items - list of items
+        workers - number of threads
+        timeout - seconds each call may take
+        fallback - function taking an item and returning its result when the call raises an error or times out
+        
+    Returns:
+        list - the results, in the same order as items
+    """
+    results = [None] * len(items)
+    started = {}
+
+    def call(i):
+        started[i] = time.monotonic()
+        return func(items[i])
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    futures = {executor.submit(call, i): i for i in range(len(items))}
+    pending = set(futures)
+    try:
+        while pending:
+            done, pending = concurrent.futures.wait(pending, timeout=min(timeout, 1), return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                i = futures[future]
+                try:
+                    results[i] = future.result()
+                except:
+                    results[i] = fallback(items[i])
+            now = time.monotonic()
+            for future in [future for future in pending if futures[future] in started and now - started[futures[future]] > timeout]:
+                pending.discard(future)
+                results[futures[future]] = fallback(items[futures[future]])
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return results
+
+
+#check one website's robots.txt
+def can_fetch_site(site, timeout=None):
+    """
+    Reads a website's robots.txt to determine if the URL is scrapable.
+    
+    Args:
+        site - URL ending in '/' (see clean_url)
+        timeout - seconds to wait to connect or for each read, or None to use the process-wide socket timeout
+        
+    Returns:
+        True or False
+    """
+    rp = urllib.robotparser.RobotFileParser()
+    rp.set_url(site+'robots.txt')
+    if timeout is None:
+        rp.read()
+        return rp.can_fetch("*", site)
+    #Same as rp.read(), but with a timeout for this request only, since socket.setdefaulttimeout would change it for every thread
+    try:
+        response = urllib.request.urlopen(rp.url, timeout=timeout)
+    except urllib.error.HTTPError as err:
+        if err.code in (401, 403):
+            rp.disallow_all = True
+        elif err.code >= 400 and err.code < 500:
+            rp.allow_all = True
+    else:
+        with response:
+            rp.parse(response.read().decode("utf-8").splitlines())
+    return rp.can_fetch("*", site)
+
+
 #determine if website is scrapable
-def get_scrapability(series):
+def get_scrapability(series, timeout=10):
     """
-    Iterates through a pandas series of URLs to determine if the URL is scrapable. Print statements can be uncommented in order to track progress. Timeout is set to ten seconds to not spend more than that amount of time trying to fetch or read a URL.
+    Iterates through a pandas series of URLs to determine if the URL is scrapable. Print statements can be uncommented in order to track progress. Timeout is set to ten seconds to not spend more than that amount of time trying to connect to or read from a URL.
     
     Args:
         series - a pandas series containing one URL per row
+        timeout - seconds to wait to connect or for each read of a URL's robots.txt
         
     Returns:
         list - A list of the results, which can be True, False, or 'site skipped' if there was a fetching or reading error; list can be appended to the original dataframe
     """
-    socket.setdefaulttimeout(10) 
     scrapability = []
     for i, site in enumerate(series):
         try:
-            rp = urllib.robotparser.RobotFileParser()
-            rp.set_url(site+'robots.txt')
-            rp.read()
-            #print(site, rp.can_fetch("*", site))
-            scrapability.append(rp.can_fetch("*", site))
+            #print(site, can_fetch_site(site, timeout))
+            scrapability.append(can_fetch_site(site, timeout))
             #print(i, site)
         except:
             #print(site, 'site skipped')
@@ -58,10 +136,50 @@ def get_scrapability(series):
     return scrapability
 
 
+#determine if websites are scrapable, many at a time
+def get_scrapability_concurrent(series, workers=20, timeout=10):
+    """
+    Same as get_scrapability, but checks workers URLs at a time from a pool of threads, so a few thousand rows take minutes instead of hours.
+    
+    Args:
+        series - a pandas series containing one URL per row
+        workers - number of URLs checked at once
+        timeout - seconds a URL may take in total; it is also the connect and read timeout of its request
+        
+    Returns:
+        list - A list of the results in the same order as series, which can be True, False, or 'site skipped' if there was a fetching or reading error or it timed out; list can be appended to the original dataframe
+    """
+    return run_concurrently(lambda site: can_fetch_site(site, timeout), list(series), workers, timeout, lambda site: 'site skipped')
+
+
+#get regex patterns from one website's homepage
+def find_homepage_addresses(site, regex, timeout=None):
+    """
+    Scrapes the link text of one URL for a regex pattern.
+    
+    Args:
+        site - URL
+        regex - regex search pattern
+        timeout - seconds to wait to connect or for each read, or None to use the shared request policy (see request_policy.py)
+        
+    Returns:
+        list - the found patterns of each link whose text has the pattern
+    """
+    kwargs = {} if timeout is None else {'timeout': timeout}
+    response = http_session.fetch(site, **kwargs)
+    links = link_extractor.default_extractor.anchors(response.text)
+    found = []
+    for href, text in links:
+        addresses = re.findall(regex, text)
+        if addresses != []:
+            found.append(addresses)
+    return found
+
+
 #get regex patterns from scrapable websites
 def get_homepage_addresses(series, regex):
     """
-    Iterates through a series of URLs and scrapes link text for a regex pattern on that URL. Print statements can be uncommented to track progress. Timeout is set to ten seconds to not spend more than that amount of time trying to read a URL.
+    Iterates through a series of URLs and scrapes link text for a regex pattern on that URL. Print statements can be uncommented to track progress. Timeouts come from the shared request policy (see request_policy.py), so a URL that can't be connected to or read from is skipped.
     
     Args:
         series - a pandas series containing one URL per row
@@ -71,20 +189,14 @@ def get_homepage_addresses(series, regex):
         sites - list of URLs; may be duplicates if a website has more than one of the regex pattern
         address - list of found regex patterns; originally used for email address patterns
     """
-    socket.setdefaulttimeout(10)
     sites = []
     address = []
     for i, site in enumerate(series):
         try:
-            response = requests.get(site, headers={'User-Agent': '*'})
-            soup = BeautifulSoup(response.text, 'html.parser')
-            links = soup.findAll('a')
-            for link in links:
-                addresses = re.findall(regex, link.text)
-                if addresses != []:
-                    #print(i, addresses)
-                    sites.append(site)
-                    address.append(addresses)
+            for addresses in find_homepage_addresses(site, regex):
+                #print(i, addresses)
+                sites.append(site)
+                address.append(addresses)
         except:
             #print(i, 'website error')
             sites.append(site)
@@ -92,6 +204,36 @@ def get_homepage_addresses(series, regex):
     return address, sites
 
 
+#get regex patterns from scrapable websites, many at a time
+def get_homepage_addresses_concurrent(series, regex, workers=20, timeout=10):
+    """
+    Same as get_homepage_addresses, but scrapes workers URLs at a time from a pool of threads, so a few thousand rows take minutes instead of hours.
+    
+    Args:
+        series - a pandas series containing one URL per row
+        regex - regex search pattern
+        workers - number of URLs scraped at once
+        timeout - seconds a URL may take in total; it is also the connect and read timeout of its request
+        
+    Returns:
+        sites - list of URLs in the same order as series; may be duplicates if a website has more than one of the regex pattern
+        address - list of found regex patterns, with 'website error' for URLs that errored or timed out
+    """
+    series = list(series)
+    results = run_concurrently(lambda site: find_homepage_addresses(site, regex, timeout), series, workers, timeout, lambda site: None)
+    sites = []
+    address = []
+    for site, found in zip(series, results):
+        if found is None:
+            sites.append(site)
+            address.append('website error')
+            continue
+        for addresses in found:
+            sites.append(site)
+            address.append(addresses)
+    return address, sites
+
+
 def merge_regex_patterns(sites, address, original_df):
     """
     Merges sites and addresses with original dataframe after dropping duplicates
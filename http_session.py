@@ -0,0 +1,297 @@
+import codecs
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ChunkedEncodingError, ContentDecodingError, ReadTimeout, SSLError
+from urllib3.exceptions import DecodeError, ProtocolError, ReadTimeoutError
+from urllib3.exceptions import SSLError as URLLib3SSLError
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+import crawl_metrics
+import request_policy
+
+
+DEFAULT_HEADERS = {'User-Agent': '*'}
+
+#Connection pool settings shared by every session
+#pool_connections - number of hosts to keep a connection pool for
+#pool_maxsize - number of connections to keep open per host
+#pool_block - whether to wait for a free connection instead of opening an extra one when a host's pool is full
+pool_settings = {'pool_connections': 100, 'pool_maxsize': 10, 'pool_block': False}
+
+#Limits for streamed page downloads
+#max_bytes - pages larger than this are cut off
+#content_types - content types that are downloaded; anything else (e.g. PDFs) is skipped. Responses without a content type are downloaded.
+stream_settings = {'max_bytes': 10 * 1024 * 1024, 'content_types': ('text/html', 'application/xhtml+xml', 'text/plain'), 'chunk_size': 64 * 1024}
+
+_local = threading.local()
+_generation = 0
+
+
+def configure_sessions(pool_connections=None, pool_maxsize=None, pool_block=None):
+    """
+    Change the connection pool settings. Sessions created before this call are replaced the next time they are used.
+
+    Args:
+        pool_connections - number of hosts to keep a connection pool for
+        pool_maxsize - number of connections to keep open per host
+        pool_block - whether to wait for a free connection when a host's pool is full
+    """
+    global _generation
+    if pool_connections is not None:
+        pool_settings['pool_connections'] = pool_connections
+    if pool_maxsize is not None:
+        pool_settings['pool_maxsize'] = pool_maxsize
+    if pool_block is not None:
+        pool_settings['pool_block'] = pool_block
+    _generation += 1
+
+
+#Connections that time their TCP connect and TLS handshake for crawl_metrics
+class TimedHTTPConnection(HTTPConnection):
+    def _new_conn(self):
+        start = time.perf_counter()
+        sock = super()._new_conn()
+        crawl_metrics.get_metrics().observe('connect', time.perf_counter() - start)
+        return sock
+
+
+class TimedHTTPSConnection(HTTPSConnection):
+    def _new_conn(self):
+        start = time.perf_counter()
+        sock = super()._new_conn()
+        self.connected_at = time.perf_counter()
+        crawl_metrics.get_metrics().observe('connect', self.connected_at - start)
+        return sock
+
+    def connect(self):
+        self.connected_at = None
+        super().connect()
+        #Everything after the TCP connection is the TLS handshake
+        if self.connected_at is not None:
+            crawl_metrics.get_metrics().observe('tls', time.perf_counter() - self.connected_at)
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedAdapter(HTTPAdapter):
+    """
+    HTTPAdapter whose connection pools time each new connection's TCP connect and TLS handshake.
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': TimedHTTPConnectionPool, 'https': TimedHTTPSConnectionPool}
+
+
+def new_session():
+    """
+    Create a requests session with keep-alive connection pools for http and https.
+
+    Returns:
+        session - requests.Session using the current pool settings
+    """
+    session = requests.Session()
+    session.headers.update(DEFAULT_HEADERS)
+    adapter = TimedAdapter(pool_connections=pool_settings['pool_connections'], pool_maxsize=pool_settings['pool_maxsize'], pool_block=pool_settings['pool_block'])
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_session():
+    """
+    Get the session for the current thread. Each thread keeps its own session, so repeated requests to the same host (e.g. a homepage and then its contact pages) reuse the open connection.
+
+    Returns:
+        session - requests.Session for the current thread
+    """
+    session = getattr(_local, 'session', None)
+    if session is None or _local.generation != _generation:
+        if session is not None:
+            session.close()
+        session = new_session()
+        _local.session = session
+        _local.generation = _generation
+    return session
+
+
+def close_session():
+    """
+    Close the current thread's session and its open connections.
+    """
+    session = getattr(_local, 'session', None)
+    if session is not None:
+        session.close()
+        _local.session = None
+
+
+def fetch(url, **kwargs):
+    """
+    Send a GET request through the current thread's pooled session, with the connect and read timeouts of the shared request_policy.
+    The time to the response headers is recorded as the 'ttfb' phase in crawl_metrics.
+
+    Args:
+        url - URL to request
+        **kwargs - passed through to requests.Session.get
+
+    Returns:
+        response - requests.Response
+    """
+    kwargs.setdefault('timeout', request_policy.get_policy().timeout)
+    response = get_session().get(url, **kwargs)
+    crawl_metrics.get_metrics().observe('ttfb', response.elapsed.total_seconds())
+    return response
+
+
+def configure_streaming(max_bytes=None, content_types=None):
+    """
+    Change the limits for streamed page downloads.
+
+    Args:
+        max_bytes - pages larger than this many bytes are cut off
+        content_types - list of content types that are downloaded
+    """
+    if max_bytes is not None:
+        stream_settings['max_bytes'] = max_bytes
+    if content_types is not None:
+        stream_settings['content_types'] = tuple(content_types)
+
+
+def is_allowed_type(response):
+    """
+    Check whether a response's content type is one that should be downloaded.
+
+    Args:
+        response - requests.Response
+
+    Returns:
+        True if the response has no content type, or one of stream_settings['content_types']
+    """
+    content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+    return content_type == '' or content_type in stream_settings['content_types']
+
+
+def iter_chunks(response, chunk_size, deadline=None):
+    """
+    Iterate over a streamed response's body like response.iter_content, but stop at a deadline even if the server keeps trickling data.
+    Each read returns whatever has arrived (up to chunk_size) instead of waiting for a full chunk, and may only wait on the socket until the deadline.
+
+    Args:
+        response - requests.Response from fetch(url, stream=True)
+        chunk_size - most bytes returned at a time
+        deadline - optional time.monotonic() value by which the body must be read
+
+    Raises:
+        request_policy.DeadlineExceeded if the deadline passes before the body is read
+    """
+    if deadline is None:
+        yield from response.iter_content(chunk_size)
+        return
+    raw = response.raw
+    sock = getattr(getattr(raw, 'connection', None), 'sock', None)
+    read_timeout = sock.gettimeout() if sock is not None else None
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise request_policy.DeadlineExceeded(f"Download of {response.url} took longer than its deadline")
+            if sock is not None:
+                #The socket waits for the next bytes only until the deadline
+                sock.settimeout(remaining if read_timeout is None else min(read_timeout, remaining))
+            try:
+                chunk = raw.read1(chunk_size, decode_content=True)
+            except ReadTimeoutError as e:
+                if time.monotonic() >= deadline:
+                    raise request_policy.DeadlineExceeded(f"Download of {response.url} took longer than its deadline")
+                raise ReadTimeout(e)
+            #The same translations iter_content makes
+            except ProtocolError as e:
+                raise ChunkedEncodingError(e)
+            except DecodeError as e:
+                raise ContentDecodingError(e)
+            except URLLib3SSLError as e:
+                raise SSLError(e)
+            if not chunk:
+                return
+            yield chunk
+    finally:
+        if sock is not None:
+            try:
+                sock.settimeout(read_timeout)
+            except OSError:
+                pass
+
+
+def read_text(response, on_text=None, max_bytes=None, deadline=None):
+    """
+    Read a streamed response's body as text, one chunk at a time, stopping early if it gets too large.
+    The time spent in on_text is recorded as the 'extract' phase in crawl_metrics, and the rest as 'download'.
+
+    Args:
+        response - requests.Response from fetch(url, stream=True)
+        on_text - optional function called with each chunk of text; returning True stops the download
+        max_bytes - byte limit for the body; defaults to stream_settings['max_bytes']
+        deadline - optional time.monotonic() value by which the download must finish (see request_policy.RequestPolicy.deadline)
+
+    Returns:
+        text - the text read, up to the byte limit
+        reason - None if the whole body was read, 'too large' if it was cut off at the byte limit, or 'stopped' if on_text stopped it
+
+    Raises:
+        request_policy.DeadlineExceeded if the deadline passes before the body is read
+    """
+    if max_bytes is None:
+        max_bytes = stream_settings['max_bytes']
+    start = time.perf_counter()
+    scanning = 0.0
+    if on_text is not None:
+        scan = on_text
+        def on_text(text):
+            nonlocal scanning
+            scan_start = time.perf_counter()
+            try:
+                return scan(text)
+            finally:
+                scanning += time.perf_counter() - scan_start
+    try:
+        declared = response.headers.get('Content-Length', '')
+        if declared.isdigit() and int(declared) > max_bytes:
+            return '', 'too large'
+        try:
+            decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+        except LookupError:
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        parts = []
+        size = 0
+        reason = None
+        for chunk in iter_chunks(response, stream_settings['chunk_size'], deadline):
+            if size + len(chunk) > max_bytes:
+                chunk = chunk[:max_bytes - size]
+                reason = 'too large'
+            size += len(chunk)
+            text = decoder.decode(chunk, final=reason is not None)
+            parts.append(text)
+            if on_text is not None and on_text(text):
+                return ''.join(parts), 'stopped'
+            if reason is not None:
+                return ''.join(parts), reason
+        text = decoder.decode(b'', final=True)
+        parts.append(text)
+        if on_text is not None and text and on_text(text):
+            return ''.join(parts), 'stopped'
+        return ''.join(parts), None
+    finally:
+        response.close()
+        metrics = crawl_metrics.get_metrics()
+        metrics.observe('download', time.perf_counter() - start - scanning)
+        if scanning:
+            metrics.observe('extract', scanning)
+
@@ -0,0 +1,139 @@
+from bs4 import BeautifulSoup
+#Faster parsers are used when installed; BeautifulSoup is always available as the fallback
+try:
+    from selectolax.parser import HTMLParser as SelectolaxParser
+except ImportError:
+    SelectolaxParser = None
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+
+class BeautifulSoupLinks:
+    """
+    Link extraction with BeautifulSoup and the pure-Python 'html.parser'. Slowest, but handles anything and needs nothing extra installed.
+    """
+    name = 'bs4'
+
+    def links(self, html):
+        soup = BeautifulSoup(html, 'html.parser')
+        return [a.get('href') for a in soup.find_all('a', href=True)]
+
+    def anchors(self, html):
+        soup = BeautifulSoup(html, 'html.parser')
+        return [(a.get('href'), a.text) for a in soup.find_all('a')]
+
+
+class LxmlLinks:
+    """
+    Link extraction with lxml's C HTML parser.
+    """
+    name = 'lxml'
+
+    def __init__(self):
+        self.parser = etree.HTMLParser(remove_comments=True, remove_pis=True, no_network=True)
+
+    def parse(self, html):
+        root = etree.fromstring(html, self.parser)
+        return [] if root is None else root.iter('a')
+
+    def links(self, html):
+        return [a.get('href') for a in self.parse(html) if a.get('href') is not None]
+
+    def anchors(self, html):
+        return [(a.get('href'), ''.join(a.itertext())) for a in self.parse(html)]
+
+
+class SelectolaxLinks:
+    """
+    Link extraction with selectolax (Modest engine), the fastest option when it is installed.
+    """
+    name = 'selectolax'
+
+    def links(self, html):
+        return [node.attributes['href'] for node in SelectolaxParser(html).css('a[href]') if node.attributes['href'] is not None]
+
+    def anchors(self, html):
+        return [(node.attributes.get('href'), node.text(deep=True)) for node in SelectolaxParser(html).css('a')]
+
+
+#Parsers in order of preference
+PARSERS = {}
+if SelectolaxParser is not None:
+    PARSERS['selectolax'] = SelectolaxLinks
+if etree is not None:
+    PARSERS['lxml'] = LxmlLinks
+PARSERS['bs4'] = BeautifulSoupLinks
+
+
+class LinkExtractor:
+    """
+    Pulls <a> links out of HTML with the fastest parser available, falling back to BeautifulSoup for any page the fast parser can't read
+    (e.g. lxml rejects text that starts with an XML encoding declaration).
+    """
+
+    def __init__(self, parser='auto'):
+        """
+        Args:
+            parser - 'auto' for the fastest installed parser, or one of PARSERS ('selectolax', 'lxml', 'bs4')
+        """
+        if parser == 'auto':
+            parser = next(iter(PARSERS))
+        if parser not in PARSERS:
+            raise ValueError(f"Link parser '{parser}' is not installed; available parsers: {', '.join(PARSERS)}")
+        self.parser = PARSERS[parser]()
+        self.fallback = PARSERS['bs4']() if parser != 'bs4' else None
+
+    @property
+    def name(self):
+        return self.parser.name
+
+    def links(self, html):
+        """
+        Get the href of every <a> tag, in page order.
+
+        Args:
+            html - HTML of the page
+
+        Returns:
+            list of href strings
+        """
+        try:
+            return self.parser.links(html)
+        except Exception:
+            if self.fallback is None:
+                raise
+            return self.fallback.links(html)
+
+    def anchors(self, html):
+        """
+        Get the href and text of every <a> tag, in page order.
+
+        Args:
+            html - HTML of the page
+
+        Returns:
+            list of (href, text) tuples; href is None for <a> tags without one
+        """
+        try:
+            return self.parser.anchors(html)
+        except Exception:
+            if self.fallback is None:
+                raise
+            return self.fallback.anchors(html)
+
+
+#Extractor shared by everything in a process
+default_extractor = LinkExtractor()
+
+
+def configure_parser(parser='auto'):
+    """
+    Change the parser used by the shared extractor.
+
+    Args:
+        parser - 'auto' for the fastest installed parser, or one of PARSERS ('selectolax', 'lxml', 'bs4')
+    """
+    global default_extractor
+    default_extractor = LinkExtractor(parser)
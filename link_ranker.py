@@ -0,0 +1,94 @@
+import posixpath
+import urllib.parse
+from url_normalization import canonicalize_url, normalize_url, is_same_site
+
+
+#Points for words in a link's path; the most likely pages to list email addresses score highest
+PATH_KEYWORDS = {'contact': 10, 'contact-us': 12, 'contactus': 12, 'about': 5, 'about-us': 6, 'aboutus': 6,
+                 'staff': 3, 'team': 3, 'people': 3, 'directory': 3, 'leadership': 2, 'email': 2, 'support': 1}
+
+#Links to files that are never HTML are not worth a request
+SKIPPED_EXTENSIONS = {'.pdf', '.jpg', '.jpeg', '.png', '.gif', '.svg', '.webp', '.zip', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx', '.mp3', '.mp4', '.avi', '.mov'}
+
+#Maximum number of contact and about pages fetched per site
+ranking_settings = {'limit': 5}
+
+
+def configure_ranking(limit=None):
+    """
+    Change the number of contact and about pages fetched per site.
+
+    Args:
+        limit - maximum number of pages per site
+    """
+    if limit is not None:
+        ranking_settings['limit'] = limit
+
+
+def score_link(url):
+    """
+    Score a link by how likely it is to be a page listing email addresses, from the words in its path.
+    Shallow paths score higher than deep ones, and links with a query string lose a point.
+
+    Args:
+        url - canonical URL of the link
+
+    Returns:
+        score; higher is better
+    """
+    parts = urllib.parse.urlsplit(url)
+    segments = [segment for segment in parts.path.lower().split('/') if segment]
+    score = 0
+    for segment in segments:
+        stem = posixpath.splitext(segment)[0]
+        best = 0
+        for keyword, points in PATH_KEYWORDS.items():
+            if stem == keyword:
+                best = max(best, points + 1)
+            elif keyword in stem:
+                best = max(best, points)
+        score += best
+    score -= max(0, len(segments) - 1)
+    if parts.query:
+        score -= 1
+    return score
+
+
+def rank_links(links, site_url, crawled=(), limit=None):
+    """
+    Choose which of a page's contact and about links to fetch.
+
+    Links are canonicalized (see url_normalization.canonicalize_url), and links to other sites, to non-http(s) URLs (mailto:, javascript:, ...)
+    and to files that are never HTML are dropped. Links that are the same page as one already crawled, or as another link, are dropped.
+    The rest are ordered by score_link and the top limit are kept.
+
+    Args:
+        links - list of absolute URLs found on the page
+        site_url - URL of the site's homepage
+        crawled - URLs already crawled for the site
+        limit - maximum number of links to return; defaults to ranking_settings['limit']
+
+    Returns:
+        list of canonical URLs to fetch, best first
+    """
+    if limit is None:
+        limit = ranking_settings['limit']
+    seen = {normalize_url(url) for url in crawled}
+    seen.update(normalize_url(canonicalize_url(url)) for url in crawled)
+    candidates = []
+    for position, link in enumerate(links):
+        url = canonicalize_url(link)
+        if url == '' or urllib.parse.urlsplit(url).scheme not in ('http', 'https'):
+            continue
+        if not is_same_site(url, site_url):
+            continue
+        if posixpath.splitext(urllib.parse.urlsplit(url).path.lower())[1] in SKIPPED_EXTENSIONS:
+            continue
+        key = normalize_url(url)
+        if key in seen:
+            continue
+        seen.add(key)
+        #Ties keep page order
+        candidates.append((-score_link(url), position, url))
+    candidates.sort()
+    return [url for score, position, url in candidates[:limit]]
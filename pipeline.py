@@ -0,0 +1,398 @@
+import sys
+import time
+import queue
+import shutil
+import threading
+import argparse
+import pandas as pd
+import crawl_engine
+import crawl_metrics
+import crawl_journal
+import crawl_results
+import crawl_state
+import dns_cache
+import email_crawler
+import get_scrapability
+import rate_limiter
+import request_policy
+import response_cache
+import robots_cache
+import table_io
+
+
+JOURNAL_PATH = 'pipeline_journal.jsonl'
+
+#Marks the end of a queue's input
+DONE = None
+
+
+def check_robots(url):
+    """
+    Check robots.txt to see if a website can be scraped, with the shared robots_cache.
+
+    Parameters:
+    - url (str): The URL of the website.
+
+    Returns:
+    - The same values as get_scrapability.can_fetch: True, False, 'invalid URL', 'SSL Error', 'malformed URL', 'content too long' or 'site skipped'.
+    """
+    if url in get_scrapability.SKIPPED_URLS:
+        return 'site skipped'
+    try:
+        robots_cache.robots_url(url)
+    except ValueError:
+        return 'malformed URL'
+    try:
+        result = robots_cache.can_fetch(url)
+    except:
+        return 'site skipped'
+    if result == 'SSL Error' and "https://" in url:
+        return check_robots(url.replace("https://", "http://"))
+    if result == 'timed out':
+        #reppy reports download timeouts as connection errors
+        return 'invalid URL'
+    return result
+
+
+class Pipeline:
+    """
+    Checks robots.txt, crawls and collects results for a stream of websites, with each stage running in its own threads and handing websites to the next stage through a bounded queue.
+
+    A website is crawled as soon as its robots.txt allows it, rather than after every website has been checked, and the queues keep memory flat:
+    when the crawl falls behind, the robots checkers wait for room in its queue, and reading the input waits for them.
+    """
+
+    def __init__(self, robots_workers=50, crawl_workers=50, per_host_concurrency=2, queue_size=1000):
+        """
+        Args:
+            robots_workers - number of threads checking robots.txt
+            crawl_workers - number of threads crawling websites
+            per_host_concurrency - maximum number of websites on the same host crawled at once
+            queue_size - maximum number of websites waiting between two stages
+        """
+        self.robots_workers = robots_workers
+        self.crawl_workers = crawl_workers
+        self.per_host_concurrency = per_host_concurrency
+        self.robots_queue = queue.Queue(maxsize=queue_size)
+        self.crawl_queue = queue.Queue(maxsize=queue_size)
+        self.result_queue = queue.Queue(maxsize=queue_size)
+        #Semaphores and crawls in flight per host; a host's entries are dropped once none of its crawls are in flight, so they don't grow with the input
+        self.host_limits = {}
+        self.host_tasks = {}
+        self.host_lock = threading.Lock()
+
+    def host_limit(self, host):
+        #Count a crawl of the host as in flight (until release_host) and get the host's semaphore
+        with self.host_lock:
+            if host not in self.host_limits:
+                self.host_limits[host] = threading.Semaphore(self.per_host_concurrency)
+                self.host_tasks[host] = 0
+            self.host_tasks[host] += 1
+            return self.host_limits[host]
+
+    def release_host(self, host):
+        with self.host_lock:
+            self.host_tasks[host] -= 1
+            if self.host_tasks[host] == 0:
+                del self.host_tasks[host]
+                del self.host_limits[host]
+
+    def robots_stage(self):
+        while True:
+            item = self.robots_queue.get()
+            if item is DONE:
+                return
+            i, url = item
+            verdict = check_robots(url)
+            self.result_queue.put(('robots', i, verdict))
+            if verdict is True:
+                self.crawl_queue.put((i, url))
+
+    def crawl_stage(self):
+        while True:
+            item = self.crawl_queue.get()
+            if item is DONE:
+                return
+            i, url = item
+            host = crawl_engine.get_host(url)
+            limit = self.host_limit(host)
+            try:
+                with limit:
+                    result = email_crawler.crawl_site(url)
+            except:
+                result = ([(url, [], 'failed')], False, 'failed')
+            finally:
+                self.release_host(host)
+            self.result_queue.put(('crawled', i, (url, result)))
+
+    def run(self, sites, on_result):
+        """
+        Run every stage until all the websites are done.
+
+        Parameters:
+        - sites (iterable): (stage, row index, value) tuples. ('check', i, url) has robots.txt checked and, if allowed, is crawled; ('crawl', i, url) is crawled straight away.
+          Any other stage is a result that is already known, and is passed straight on to on_result.
+        - on_result (function): Called with ('robots', row index, verdict) as each robots.txt check finishes, and ('crawled', row index, (url, result)) as each crawl finishes,
+          where result is the tuple returned by email_crawler.crawl_site. It is only ever called from the thread that called run, so it does not need to be thread-safe.
+        """
+        robots_threads = [threading.Thread(target=self.robots_stage, daemon=True) for _ in range(self.robots_workers)]
+        crawl_threads = [threading.Thread(target=self.crawl_stage, daemon=True) for _ in range(self.crawl_workers)]
+        for thread in robots_threads + crawl_threads:
+            thread.start()
+        failure = []
+
+        def feed():
+            try:
+                for stage, i, value in sites:
+                    if stage == 'check':
+                        self.robots_queue.put((i, value))
+                    elif stage == 'crawl':
+                        self.crawl_queue.put((i, value))
+                    else:
+                        self.result_queue.put((stage, i, value))
+            except BaseException as e:
+                failure.append(e)
+            #Each stage finishes once the stage before it has
+            for _ in robots_threads:
+                self.robots_queue.put(DONE)
+            for thread in robots_threads:
+                thread.join()
+            for _ in crawl_threads:
+                self.crawl_queue.put(DONE)
+            for thread in crawl_threads:
+                thread.join()
+            self.result_queue.put(DONE)
+
+        #Results are collected on this thread while another feeds the stages, so the input is read while earlier websites are being crawled
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+        while True:
+            item = self.result_queue.get()
+            if item is DONE:
+                break
+            on_result(*item)
+        feeder.join()
+        if failure:
+            raise failure[0]
+
+
+def read_sites(file_path, chunk_size=table_io.CHUNK_SIZE, overwrite=False, done=frozenset(), allowed=frozenset(), incremental=False, max_age=None, dns_workers=100):
+    """
+    Read the input file in chunks and work out what each website still needs, for Pipeline.run. Each chunk's hosts are looked up in DNS before its websites are handed on.
+
+    Parameters:
+    - file_path (str): Input file.
+    - chunk_size (int): Rows read at a time.
+    - overwrite (bool): Whether to recheck robots.txt for rows that already have a scrapability result.
+    - done (set): Rows already finished (e.g. from the journal), which are skipped.
+    - allowed (set): Rows whose robots.txt is already known to allow crawling (e.g. from the journal), which are crawled without checking it again.
+    - incremental (bool): Whether to reuse finished crawls from crawl_state.sqlite for rows already marked scrapable.
+    - max_age (float): With incremental, crawls older than this many seconds are redone. None reuses crawls of any age.
+    - dns_workers (int): Number of DNS lookups to run at once.
+
+    Yields:
+    - Tuple: (stage, row index, value); see Pipeline.run. Rows whose result is already in the input are 'known' results like 'robots' ones, and reused crawls are 'reused' results like 'crawled' ones.
+    """
+    #This runs on the pipeline's feeder thread, so it opens its own connection to crawl_state.sqlite
+    state = crawl_state.CrawlState() if incremental else None
+    try:
+        for chunk in get_scrapability.read_file(file_path, chunk_size):
+            chunk = get_scrapability.fix_df(chunk)
+            #The total grows as the input is read, so the ETA only covers the rows read so far
+            crawl_metrics.get_metrics().add_total(len(chunk) - len(done.intersection(chunk.index)))
+            todo = []
+            for i, url, scrapability in zip(chunk.index, chunk['website'], chunk['scrapability']):
+                if i in done:
+                    continue
+                if pd.isna(url):
+                    yield 'known', i, 'site skipped'
+                elif i in allowed or (scrapability is True and not overwrite):
+                    entry = state.is_current(i, url, max_age) if incremental else None
+                    if entry is not None:
+                        yield 'reused', i, (url, (entry['pages'], entry['invalid'], entry['status']))
+                    else:
+                        todo.append(('crawl', i, url))
+                elif overwrite or pd.isna(scrapability) or scrapability == 'Malformed URL':
+                    todo.append(('check', i, url))
+                else:
+                    yield 'known', i, scrapability
+            #Hosts that don't exist are never requested
+            unresolved = dns_cache.pre_resolve_urls([url for stage, i, url in todo], workers=dns_workers, offline=response_cache.is_offline())
+            if unresolved:
+                dropped = [(stage, i, url) for stage, i, url in todo if dns_cache.get_hostname(url) in unresolved]
+                print(f"Hosts not found in DNS: {len(unresolved)}         Rows marked 'invalid URL': {len(dropped)}")
+                for stage, i, url in dropped:
+                    yield 'crawled', i, (url, ([(url, [], 'invalid URL')], True, 'invalid URL'))
+                todo = [(stage, i, url) for stage, i, url in todo if dns_cache.get_hostname(url) not in unresolved]
+            #Take sites from each host in turn, so no host's rate limit holds up the rest of the chunk
+            stages = {i: stage for stage, i, url in todo}
+            for i, url in crawl_engine.interleave_by_host([(i, url) for stage, i, url in todo]):
+                yield stages[i], i, url
+    finally:
+        if state is not None:
+            state.close()
+
+
+def run_pipeline(file_path, output_fp, robots_workers=50, crawl_workers=50, per_host_concurrency=2, queue_size=1000, chunk_size=table_io.CHUNK_SIZE,
+                 overwrite=False, resume=False, incremental=False, max_age=None, dns_workers=100):
+    """
+    Check robots.txt and crawl every website in the input file in one pass, then write the input with 'scrapability' and 'emails' columns to output_fp.
+
+    Every robots.txt verdict and crawled website is appended to pipeline_journal.jsonl (by its row in the input file), and crawls are saved to crawl_state.sqlite as they finish,
+    so an interrupted run can be resumed without checking or crawling those websites again, and email_crawler.py --incremental can reuse the crawls.
+
+    Parameters:
+    - file_path (str): Input file with a 'website' column, and optionally a 'scrapability' column; rows already marked True are crawled without rechecking robots.txt.
+    - output_fp (str): Output file (.xlsx, .csv or .parquet).
+    - robots_workers (int): Number of threads checking robots.txt.
+    - crawl_workers (int): Number of threads crawling websites.
+    - per_host_concurrency (int): Maximum number of websites on the same host crawled at once.
+    - queue_size (int): Maximum number of websites waiting between two stages.
+    - chunk_size (int): Rows of the input read at a time.
+    - overwrite (bool): Whether to recheck robots.txt for rows that already have a scrapability result.
+    - resume (bool): Whether to continue from the existing journal, skipping the websites it already contains and the robots.txt checks it recorded.
+    - incremental (bool): Whether to skip websites with a finished crawl in crawl_state.sqlite. Failed or timed-out crawls are retried.
+    - max_age (float): With incremental, crawls older than this many seconds are redone. None reuses crawls of any age.
+    - dns_workers (int): Number of DNS lookups to run at once.
+    """
+    verdicts = {}
+    emails = {}
+    done = set()
+    allowed = set()
+    if resume:
+        pages_by_row, invalid_rows = crawl_journal.read_journal(JOURNAL_PATH)
+        for i in invalid_rows:
+            verdicts[i] = 'invalid URL' if invalid_rows[i] else True
+            emails[i] = collect_emails(pages_by_row[i])
+        done.update(invalid_rows)
+        #Websites that robots.txt didn't allow are finished too; allowed ones still need crawling if they aren't
+        for i, verdict in crawl_journal.read_verdicts(JOURNAL_PATH).items():
+            if i in done:
+                continue
+            if verdict is True:
+                allowed.add(i)
+            else:
+                verdicts[i] = verdict
+                done.add(i)
+        print(f"Resuming: {len(invalid_rows)} websites already scraped, {len(done) - len(invalid_rows)} not scrapable and {len(allowed)} waiting to be crawled")
+    journal = crawl_journal.CrawlJournal(JOURNAL_PATH, resume=resume)
+    state = crawl_state.CrawlState()
+    counts = {'robots': 0, 'allowed': 0, 'crawled': 0, 'reused': 0}
+    start_time = time.time()
+    metrics = crawl_metrics.get_metrics()
+
+    def on_result(stage, i, value):
+        if stage in ('robots', 'known'):
+            verdicts[i] = value
+            if stage == 'robots':
+                journal.record_robots(i, value)
+                counts['robots'] += 1
+                counts['allowed'] += value is True
+                metrics.count('robots_result', value)
+            #Websites that can be scraped are done once they are crawled
+            if value is not True:
+                metrics.site_done()
+            return
+        url, (pages, invalid, status) = value
+        verdicts[i] = 'invalid URL' if invalid else True
+        emails[i] = collect_emails(pages)
+        for page_url, page_emails, page_status in pages:
+            journal.append_page(i, page_url, page_emails, page_status)
+        journal.finish_site(i, invalid)
+        counts[stage] += 1
+        metrics.site_done(status)
+        if stage == 'crawled':
+            state.save(i, url, status, pages, invalid)
+            for page_url, page_emails, page_status in pages:
+                metrics.count('page_status', page_status)
+            if counts['crawled'] <= 25 or counts['crawled'] % 10 == 0:
+                eta = metrics.eta()
+                print(f"Robots checked: {counts['robots']} ({counts['allowed']} scrapable)         Crawled: {counts['crawled']}         Elapsed time: {round(time.time() - start_time, 1)} secs | {round(metrics.throughput(), 2)} rows/sec, ETA {crawl_metrics.format_duration(eta) if eta is not None else 'unknown'}")
+            if counts['crawled'] % 100 == 0:
+                print(rate_limiter.format_metrics(rate_limiter.get_limiter().metrics()))
+                print(metrics.format_summary())
+                metrics.log_summary()
+
+    sites = read_sites(file_path, chunk_size, overwrite=overwrite, done=done, allowed=allowed, incremental=incremental, max_age=max_age, dns_workers=dns_workers)
+    try:
+        pipeline = Pipeline(robots_workers=robots_workers, crawl_workers=crawl_workers, per_host_concurrency=per_host_concurrency, queue_size=queue_size)
+        pipeline.run(sites, on_result)
+    finally:
+        journal.close()
+        state.close()
+    crawl_journal.compact_journal(JOURNAL_PATH)
+
+    if counts['reused']:
+        print(f"Incremental: reused {counts['reused']} websites from {crawl_state.STATE_PATH}")
+    print(rate_limiter.format_metrics(rate_limiter.get_limiter().metrics()))
+    print(metrics.format_summary())
+    metrics.log_summary()
+    skipped_hosts = request_policy.get_policy().breaker.open_hosts()
+    if skipped_hosts:
+        print(f"Hosts skipped after repeated failures: {len(skipped_hosts)}")
+    print(f"Robots checked: {counts['robots']} ({counts['allowed']} scrapable)         Crawled: {counts['crawled']}")
+    print(f"Complete.         Elapsed time: {round(time.time() - start_time, 1)} secs\n\n")
+
+    write_output(file_path, output_fp, verdicts, emails, chunk_size)
+
+
+def collect_emails(pages):
+    #One list of unique emails per website, from every page crawled for it
+    found = set()
+    for page_url, page_emails, page_status in pages:
+        found.update(page_emails)
+    return crawl_results.remove_fake_emails(list(found))
+
+
+def write_output(file_path, output_fp, verdicts, emails, chunk_size):
+    """
+    Write the input file with the results filled in, one chunk at a time.
+
+    Parameters:
+    - file_path (str): Input file.
+    - output_fp (str): Output file (.xlsx, .csv or .parquet).
+    - verdicts (dict): Row indexes to scrapability results.
+    - emails (dict): Row indexes to lists of emails, for the websites that were crawled.
+    - chunk_size (int): Rows read at a time.
+    """
+    checkpoint_fp = table_io.checkpoint_path(output_fp)
+    writer = table_io.ChunkWriter(checkpoint_fp)
+    for number, chunk in enumerate(get_scrapability.read_file(file_path, chunk_size)):
+        chunk = get_scrapability.fix_df(chunk)
+        chunk['scrapability'] = [verdicts.get(i, scrapability) for i, scrapability in zip(chunk.index, chunk['scrapability'])]
+        chunk['emails'] = [emails.get(i) for i in chunk.index]
+        writer.write_part(number, chunk)
+    writer.export(output_fp)
+    shutil.rmtree(checkpoint_fp)
+    print(f"Output file '{output_fp}' created.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check robots.txt and scrape each website for emails in one pass: websites are crawled as soon as robots.txt allows it, one layer deep to any 'contact' or 'about' pages.")
+    parser.add_argument('file_path', help="Input file (.csv, .xlsx or .parquet) with a 'website' column. An optional 'scrapability' column skips the robots.txt check for rows already marked True.")
+    parser.add_argument('output_fp', help="Output file (.xlsx, .csv or .parquet)")
+    parser.add_argument('--robots-workers', type=int, default=50, help="Number of robots.txt checks to run at once (default 50)")
+    parser.add_argument('--crawl-workers', type=int, default=50, help="Number of websites crawled at once (default 50)")
+    parser.add_argument('--per-host', type=int, default=2, help="Maximum number of websites on the same host crawled at once (default 2)")
+    parser.add_argument('--queue-size', type=int, default=1000, help="Maximum number of websites waiting between two stages (default 1000)")
+    parser.add_argument('--chunk-size', type=int, default=table_io.CHUNK_SIZE, help=f"Rows of the input read at a time (default {table_io.CHUNK_SIZE})")
+    parser.add_argument('--overwrite', action='store_true', help="Recheck robots.txt for rows that already have a scrapability result")
+    parser.add_argument('--resume', action='store_true', help=f"Continue an interrupted run, skipping websites already saved in {JOURNAL_PATH}")
+    parser.add_argument('--incremental', action='store_true', help="Skip websites already crawled on an earlier run (saved in crawl_state.sqlite); failed or timed-out websites are retried")
+    parser.add_argument('--max-age', type=float, default=7, help="With --incremental, recrawl websites last crawled more than this many days ago (default 7)")
+    email_crawler.add_crawl_options(parser)
+    args = parser.parse_args()
+    try:
+        table_io.table_format(args.output_fp)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    email_crawler.configure_crawl(args)
+
+    run_pipeline(args.file_path, args.output_fp, robots_workers=args.robots_workers, crawl_workers=args.crawl_workers, per_host_concurrency=args.per_host,
+                 queue_size=args.queue_size, chunk_size=args.chunk_size, overwrite=args.overwrite, resume=args.resume, incremental=args.incremental,
+                 max_age=args.max_age*24*60*60, dns_workers=args.dns_workers)
+
+
+if __name__ == '__main__':
+    main()
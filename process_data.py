@@ -1,21 +1,29 @@
 import json
+import os
 import sys
 import pandas as pd
 import numpy as np
+import crawl_journal
+import crawl_results
+import table_io
 
 #Read in the file
 if len(sys.argv) < 2:
     print("Please provide a filename or path. The file must contain a 'website' column and a 'scrapability' column for which sites can be scraped (T/F).")
     sys.exit(1)
 file_path = sys.argv[1]
+#Optional output file; .csv and .parquet are much faster to write than .xlsx for long website lists
+output_path = sys.argv[2] if len(sys.argv) > 2 else 'crawled_emails_from_json.xlsx'
 
 try:
-    if file_path.lower().endswith('.csv'):
-        df = pd.read_csv(file_path)
-    elif file_path.lower().endswith('.xlsx'):
-        df = pd.read_excel(file_path)
-    else:
-        raise ValueError("Unsupported file format, please provide a .csv or .xlsx file: {}".format(file_path))
+    table_io.table_format(output_path)
+    df = table_io.read_table(file_path)
+except ValueError as e:
+    print(e)
+    sys.exit(1)
+except ImportError as e:
+    print(e)
+    sys.exit(1)
 except FileNotFoundError:
     print("File not found: {}".format(file_path))
     sys.exit(1)
@@ -29,18 +37,26 @@ except:
     sys.exit(1)
 
 #Read in the generated data files
-try:
-    with open('results_dict.json') as json_file:
-        results_dict = json.load(json_file)
-except:
-    print("Error loading results_dict.json")
-    sys.exit(1)
-try:
-    with open('website_mapping.json') as json_file:
-        website_mapping = json.load(json_file)
-except:
-    print("Error loading website_mapping.json")
-    sys.exit(1)
+#A crawl in progress only writes crawl_journal.jsonl, and a finished crawl (or a --merge run) writes the JSON files after it, so use whichever is newer
+journal_time = os.path.getmtime(crawl_journal.JOURNAL_PATH) if os.path.exists(crawl_journal.JOURNAL_PATH) else None
+json_time = os.path.getmtime('website_mapping.json') if os.path.exists('website_mapping.json') else None
+if journal_time is not None and (json_time is None or journal_time > json_time):
+    print(f"Reading results from {crawl_journal.JOURNAL_PATH}")
+    results_dict, website_mapping = crawl_journal.load_journal()
+else:
+    print("Reading results from results_dict.json and website_mapping.json")
+    try:
+        with open('results_dict.json') as json_file:
+            results_dict = json.load(json_file)
+    except:
+        print("Error loading results_dict.json")
+        sys.exit(1)
+    try:
+        with open('website_mapping.json') as json_file:
+            website_mapping = json.load(json_file)
+    except:
+        print("Error loading website_mapping.json")
+        sys.exit(1)
 
 #Verify column names
 #Check column names
@@ -76,25 +92,15 @@ else:
     sys.exit(1)
 
 #Clean up the results and put them into the dataframe
-email_list = []
-counts = []
-for idx, sites in website_mapping.items():
-    email_list.append([value for key, value in results_dict.items() if key in sites])
-    counts.append(len([key for key in results_dict.keys() if key in sites])) #counts of all the urls scraped for a given base url for combining later
-email_list = [emails for subset in email_list for emails in subset] #all emails are in a list of list, where the inner lists correspond to each url scraped
-
-collapsed_list = []
-for i, count in enumerate(counts):
-    starting_point = sum(counts[0:i])
-    group = email_list[starting_point:(starting_point+counts[i])]
-    collapsed_list.append(list(set([emails for website in group for emails in website])))
+collapsed_list = crawl_results.collapse_emails(results_dict, website_mapping)
 
-df = df.iloc[:len(collapsed_list)]
+#Keep the rows that have been crawled so far, matching on the row indexes in website_mapping
+df = df.reset_index(drop=True)
+df = df.loc[[int(idx) for idx in website_mapping.keys()]]
 df['emails'] = collapsed_list
 
 #Remove fake emails
-to_remove = ["example","test","domain","email","@sentry","wixpress","automattic",".png",".jpg"]
-df['emails'] = df['emails'].apply(lambda lst: [elem for elem in lst if not any(substr in elem for substr in to_remove)])
+df['emails'] = df['emails'].apply(crawl_results.remove_fake_emails)
 
 if renamed[0]:
     df = df.rename(columns = {'website' : 'Website'})
@@ -106,4 +112,4 @@ if renamed[2]:
 
 full_dataset = full_dataset.merge(df, how='outer')
 
-full_dataset.to_excel('crawled_emails_from_json.xlsx', index=False)
+table_io.write_table(full_dataset, output_path)
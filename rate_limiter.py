@@ -0,0 +1,245 @@
+import email.utils
+import threading
+import time
+import robots_cache
+from crawl_engine import get_host
+
+
+def parse_retry_after(value):
+    """
+    Parse a Retry-After header.
+
+    Args:
+        value - header value, either a number of seconds or an HTTP date
+
+    Returns:
+        seconds to wait, or None if the header is missing or can't be read
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when is None:
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+class HostBucket:
+    """
+    Token bucket for one host. Tokens refill at rate per second up to burst; each request takes one.
+    The token count goes negative when requests are booked ahead, which is how waiting requests are spaced out.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.waiting = 0
+        self.peak_waiting = 0
+        self.requests = 0
+        self.wait_time = 0.0
+        #Whether the host's robots.txt has been seen (see RateLimiter.bucket_for)
+        self.robots_seen = False
+
+    def set_crawl_delay(self, delay):
+        #One request per delay seconds from now on
+        self.rate = 1 / delay
+        self.burst = 1
+        self.tokens = min(self.tokens, 1)
+
+    def reserve(self, now):
+        #Book the next free slot and return how long to wait for it
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(wait, self.blocked_until - now)
+
+
+class RateLimiter:
+    """
+    Per-host rate limiter, so concurrent crawls keep their overall speed without sending any one host more than its share of requests.
+    A disabled limiter never waits; serial crawls use one, since they only ever send one request at a time anyway.
+
+    Each host gets a token bucket allowing rate requests per second, with bursts of up to burst requests.
+    A host whose robots.txt sets a Crawl-delay gets one request per Crawl-delay seconds instead (capped at max_delay). The delay is read from robots_cache
+    once the host's robots.txt is cached there (by get_scrapability.py, or by the crawl checking a contact page); robots.txt is never downloaded just for it.
+    A host that answers with Retry-After is not requested again until that time has passed (also capped at max_delay).
+    It is safe to use from several threads; callers block in wait until their request may go out.
+    """
+
+    def __init__(self, rate=1.0, burst=2, max_delay=60, use_crawl_delay=True, enabled=True):
+        """
+        Args:
+            rate - requests per second allowed per host
+            burst - requests a host may receive back to back before being limited to rate
+            max_delay - longest Crawl-delay or Retry-After, in seconds, that is honored
+            use_crawl_delay - whether to read Crawl-delay from the host's robots.txt
+            enabled - whether to limit requests at all
+        """
+        self.enabled = enabled
+        self.rate = rate
+        self.burst = burst
+        self.max_delay = max_delay
+        self.use_crawl_delay = use_crawl_delay
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def crawl_delay(self, url):
+        #(seen, delay): whether the host's robots.txt is cached, and its Crawl-delay if it sets one
+        if not self.use_crawl_delay:
+            return True, None
+        try:
+            return robots_cache.get_cache().cached_crawl_delay(url)
+        except:
+            return True, None
+
+    def bucket_for(self, host, url):
+        #Until the host's robots.txt turns up in the cache, it is looked for again on each request (outside the lock, since it may read SQLite)
+        with self.lock:
+            bucket = self.buckets.get(host)
+            if bucket is not None and bucket.robots_seen:
+                return bucket
+        seen, delay = self.crawl_delay(url)
+        with self.lock:
+            if host not in self.buckets:
+                self.buckets[host] = HostBucket(self.rate, self.burst)
+            bucket = self.buckets[host]
+            if seen and not bucket.robots_seen:
+                bucket.robots_seen = True
+                if delay:
+                    bucket.set_crawl_delay(min(float(delay), self.max_delay))
+            return bucket
+
+    def wait(self, url):
+        """
+        Block until a request to the URL's host is allowed.
+
+        Args:
+            url - URL about to be requested
+
+        Returns:
+            seconds spent waiting
+        """
+        if not self.enabled:
+            return 0.0
+        host = get_host(url)
+        bucket = self.bucket_for(host, url)
+        with self.lock:
+            delay = bucket.reserve(time.monotonic())
+            bucket.requests += 1
+            bucket.wait_time += delay
+            bucket.waiting += 1
+            bucket.peak_waiting = max(bucket.peak_waiting, bucket.waiting)
+        try:
+            if delay > 0:
+                time.sleep(delay)
+        finally:
+            with self.lock:
+                bucket.waiting -= 1
+        return delay
+
+    def back_off(self, url, seconds):
+        """
+        Hold off all requests to the URL's host, e.g. after a Retry-After header.
+
+        Args:
+            url - URL that was requested
+            seconds - seconds to wait before the host's next request
+        """
+        if not self.enabled:
+            return
+        bucket = self.bucket_for(get_host(url), url)
+        with self.lock:
+            bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + min(seconds, self.max_delay))
+
+    def metrics(self):
+        """
+        Summarize the limiter's queues and waits.
+
+        Returns:
+            dictionary with the number of 'hosts', 'requests' made, requests currently 'waiting', the 'peak_waiting' for any one host,
+            the 'total_wait' and 'max_host_wait' in seconds, and the 'busiest_hosts' (up to 5 (host, requests, seconds waited) tuples, most waited first)
+        """
+        with self.lock:
+            buckets = list(self.buckets.items())
+            busiest = sorted(buckets, key=lambda item: item[1].wait_time, reverse=True)[:5]
+            return {
+                'hosts': len(buckets),
+                'requests': sum(bucket.requests for host, bucket in buckets),
+                'waiting': sum(bucket.waiting for host, bucket in buckets),
+                'peak_waiting': max([bucket.peak_waiting for host, bucket in buckets], default=0),
+                'total_wait': sum(bucket.wait_time for host, bucket in buckets),
+                'max_host_wait': max([bucket.wait_time for host, bucket in buckets], default=0.0),
+                'busiest_hosts': [(host, bucket.requests, round(bucket.wait_time, 1)) for host, bucket in busiest if bucket.wait_time > 0],
+            }
+
+
+#Limiter shared by everything in a process
+#It is off until configured on, since only concurrent crawls need it
+limiter_settings = {'rate': 1.0, 'burst': 2, 'max_delay': 60, 'use_crawl_delay': True, 'enabled': False}
+_default_limiter = None
+_default_lock = threading.Lock()
+
+
+def configure_limiter(rate=None, burst=None, max_delay=None, use_crawl_delay=None, enabled=None):
+    """
+    Change the settings of the shared limiter. Takes effect the next time get_limiter is called.
+
+    Args:
+        rate - requests per second allowed per host
+        burst - requests a host may receive back to back
+        max_delay - longest Crawl-delay or Retry-After, in seconds, that is honored
+        use_crawl_delay - whether to read Crawl-delay from robots.txt
+        enabled - whether to limit requests at all
+    """
+    global _default_limiter
+    if rate is not None:
+        limiter_settings['rate'] = rate
+    if burst is not None:
+        limiter_settings['burst'] = burst
+    if max_delay is not None:
+        limiter_settings['max_delay'] = max_delay
+    if use_crawl_delay is not None:
+        limiter_settings['use_crawl_delay'] = use_crawl_delay
+    if enabled is not None:
+        limiter_settings['enabled'] = enabled
+    with _default_lock:
+        _default_limiter = None
+
+
+def get_limiter():
+    """
+    Get the limiter shared by everything in this process.
+
+    Returns:
+        RateLimiter using limiter_settings
+    """
+    global _default_limiter
+    with _default_lock:
+        if _default_limiter is None:
+            _default_limiter = RateLimiter(**limiter_settings)
+        return _default_limiter
+
+
+def format_metrics(metrics):
+    """
+    Format limiter metrics for the progress output.
+
+    Args:
+        metrics - dictionary from RateLimiter.metrics
+
+    Returns:
+        one-line summary string
+    """
+    line = f"Rate limiter: {metrics['requests']} requests to {metrics['hosts']} hosts | {metrics['waiting']} waiting now (peak {metrics['peak_waiting']} on one host) | {round(metrics['total_wait'], 1)} secs waited in total"
+    if metrics['busiest_hosts']:
+        line += " | most delayed: " + ", ".join(f"{host} ({requests} requests, {wait} secs)" for host, requests, wait in metrics['busiest_hosts'])
+    return line
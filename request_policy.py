@@ -0,0 +1,212 @@
+import random
+import threading
+import time
+import urllib.parse
+from requests.exceptions import ConnectionError, Timeout, SSLError
+
+
+class HostUnavailable(ConnectionError):
+    """
+    Raised instead of sending a request to a host whose circuit breaker is open.
+    """
+
+
+class DeadlineExceeded(Timeout):
+    """
+    Raised when a streamed download runs past its total deadline. Unlike other timeouts it is not retried, since the server did answer, just too slowly.
+    """
+
+
+class CircuitBreaker:
+    """
+    Per-host circuit breaker. After failure_threshold failed requests in a row, a host's circuit opens and its requests fail straight away
+    without being sent. After reset_after seconds one trial request is let through; if it succeeds the circuit closes, otherwise it opens again.
+    It is safe to use from several threads.
+    """
+
+    def __init__(self, failure_threshold=3, reset_after=5*60):
+        """
+        Args:
+            failure_threshold - failed requests in a row that open a host's circuit
+            reset_after - seconds to wait before letting a trial request through
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.failures = {}
+        self.opened_at = {}
+        self.lock = threading.Lock()
+
+    def allow(self, host):
+        """
+        Check whether a request to a host may be sent.
+
+        Args:
+            host - host and port (see get_server)
+
+        Returns:
+            True if the circuit is closed, or if it has been open long enough for a trial request
+        """
+        with self.lock:
+            opened_at = self.opened_at.get(host)
+            if opened_at is None:
+                return True
+            if time.monotonic() - opened_at >= self.reset_after:
+                #Let one trial request through; the circuit stays open for everyone else until it finishes
+                self.opened_at[host] = time.monotonic()
+                return True
+            return False
+
+    def record_success(self, host):
+        with self.lock:
+            self.failures.pop(host, None)
+            self.opened_at.pop(host, None)
+
+    def record_failure(self, host):
+        with self.lock:
+            self.failures[host] = self.failures.get(host, 0) + 1
+            if self.failures[host] >= self.failure_threshold:
+                self.opened_at[host] = time.monotonic()
+
+    def open_hosts(self):
+        """
+        Returns:
+            list of the hosts whose circuit is currently open
+        """
+        with self.lock:
+            return sorted(self.opened_at)
+
+
+def get_server(url):
+    #Host and port, so a dead https port doesn't block the http fallback
+    try:
+        server = urllib.parse.urlsplit(url).netloc.lower()
+    except ValueError:
+        server = None
+    return server or url
+
+
+class RequestPolicy:
+    """
+    Timeouts and retries for every request the crawler makes, replacing the process-wide socket timeout and the fixed-delay retry decorator.
+
+    Each request gets separate connect and read timeouts, and streamed downloads also stop at a total deadline, so a server that trickles
+    a page out a few bytes at a time can't hold a worker indefinitely. Connection errors and timeouts are retried up to tries times,
+    waiting an exponentially growing, randomly jittered delay between attempts. Failures are counted per host by a CircuitBreaker,
+    so a host that keeps failing costs a few seconds instead of the full timeout on its homepage and on every contact page.
+    """
+
+    def __init__(self, connect_timeout=5, read_timeout=5, total_timeout=30, tries=3, backoff=1, max_backoff=10, failure_threshold=3, reset_after=5*60):
+        """
+        Args:
+            connect_timeout - seconds to wait for a connection
+            read_timeout - seconds to wait for each read from the server
+            total_timeout - seconds a streamed download may take in total
+            tries - attempts per request, including the first
+            backoff - base delay in seconds before the first retry; doubles with each retry
+            max_backoff - longest delay in seconds between retries
+            failure_threshold - failed requests in a row that make a host be skipped (see CircuitBreaker)
+            reset_after - seconds before a skipped host is tried again
+        """
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.total_timeout = total_timeout
+        self.tries = tries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = CircuitBreaker(failure_threshold, reset_after)
+
+    @property
+    def timeout(self):
+        #(connect, read) timeout in the form requests expects
+        return (self.connect_timeout, self.read_timeout)
+
+    def deadline(self):
+        """
+        Returns:
+            time.monotonic() value by which a download starting now must finish
+        """
+        return time.monotonic() + self.total_timeout
+
+    def backoff_delay(self, attempt):
+        """
+        Get the delay before a retry: exponential backoff with full jitter.
+
+        Args:
+            attempt - number of attempts already made, starting at 1
+
+        Returns:
+            seconds to wait, chosen at random up to backoff * 2**(attempt - 1), capped at max_backoff
+        """
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+
+    def call(self, url, func, *args, **kwargs):
+        """
+        Call a function that makes a request to a URL, retrying connection errors and timeouts.
+
+        SSL errors are not retried (the caller may want to fall back to http) and, like other errors raised by func, do not count against the host.
+        A download that runs past its deadline (DeadlineExceeded) counts against the host but is not retried.
+
+        Args:
+            url - URL being requested, used to find its host and port
+            func - function making the request
+            *args, **kwargs - arguments for func
+
+        Returns:
+            func's return value
+
+        Raises:
+            HostUnavailable if the host's circuit is open, otherwise the last error from func
+        """
+        host = get_server(url)
+        for attempt in range(1, self.tries + 1):
+            if not self.breaker.allow(host):
+                raise HostUnavailable(f"Skipping {host} after {self.breaker.failure_threshold} failed requests in a row")
+            try:
+                result = func(*args, **kwargs)
+            except SSLError:
+                raise
+            except DeadlineExceeded:
+                self.breaker.record_failure(host)
+                raise
+            except (ConnectionError, Timeout):
+                self.breaker.record_failure(host)
+                if attempt == self.tries:
+                    raise
+                time.sleep(self.backoff_delay(attempt))
+                continue
+            self.breaker.record_success(host)
+            return result
+
+
+#Policy shared by everything in a process
+policy_settings = {'connect_timeout': 5, 'read_timeout': 5, 'total_timeout': 30, 'tries': 3, 'backoff': 1, 'max_backoff': 10, 'failure_threshold': 3, 'reset_after': 5*60}
+_default_policy = None
+_default_lock = threading.Lock()
+
+
+def configure_policy(**settings):
+    """
+    Change the settings of the shared policy (any of the RequestPolicy arguments). Takes effect the next time get_policy is called.
+    """
+    global _default_policy
+    for name, value in settings.items():
+        if name not in policy_settings:
+            raise TypeError(f"Unknown policy setting: {name}")
+        if value is not None:
+            policy_settings[name] = value
+    with _default_lock:
+        _default_policy = None
+
+
+def get_policy():
+    """
+    Get the policy shared by everything in this process.
+
+    Returns:
+        RequestPolicy using policy_settings
+    """
+    global _default_policy
+    with _default_lock:
+        if _default_policy is None:
+            _default_policy = RequestPolicy(**policy_settings)
+        return _default_policy
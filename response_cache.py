@@ -0,0 +1,207 @@
+import gzip
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from requests.exceptions import RequestException
+from url_normalization import normalize_url
+
+
+CACHE_PATH = 'response_cache'
+
+
+class NotCached(RequestException):
+    """
+    Raised in offline mode for a page that is not in the cache.
+    """
+
+
+class ResponseCache:
+    """
+    On-disk cache of downloaded pages, so a rerun can revalidate pages with conditional requests, or skip the network entirely and just rerun email extraction.
+
+    Page bodies are stored gzipped under bodies/, named by the SHA-256 of their text, so identical pages (e.g. the same error page on many URLs) are stored once.
+    index.sqlite maps each URL to its status code, content type, ETag, Last-Modified, body hash, and the reason the download was cut short if it was.
+    It is safe to use from several threads, and from several processes (e.g. the shards of a sharded crawl).
+    """
+
+    def __init__(self, path=CACHE_PATH, offline=False):
+        """
+        Args:
+            path - directory to keep the cache in
+            offline - if True, pages are only ever read from the cache, never downloaded
+        """
+        self.path = path
+        self.offline = offline
+        self.lock = threading.Lock()
+        self.conn = None
+        self.pid = None
+        os.makedirs(os.path.join(path, 'bodies'), exist_ok=True)
+
+    def connect(self):
+        #Each process opens its own connection, since SQLite connections can't be shared across a fork
+        if self.conn is None or self.pid != os.getpid():
+            self.conn = sqlite3.connect(os.path.join(self.path, 'index.sqlite'), timeout=30, check_same_thread=False)
+            self.pid = os.getpid()
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    url_key TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    status_code INTEGER NOT NULL,
+                    content_type TEXT,
+                    etag TEXT,
+                    last_modified TEXT,
+                    body_hash TEXT,
+                    reason TEXT,
+                    fetched_at REAL NOT NULL
+                )""")
+            self.conn.commit()
+        return self.conn
+
+    def body_path(self, body_hash):
+        return os.path.join(self.path, 'bodies', body_hash[:2], body_hash + '.gz')
+
+    def lookup(self, url):
+        """
+        Look up a cached response.
+
+        Args:
+            url - URL of the page
+
+        Returns:
+            dictionary with 'url', 'status_code', 'content_type', 'etag', 'last_modified', 'body_hash', 'reason' and 'fetched_at', or None if the page is not cached
+        """
+        with self.lock:
+            row = self.connect().execute('SELECT url, status_code, content_type, etag, last_modified, body_hash, reason, fetched_at FROM responses WHERE url_key = ?',
+                                         (normalize_url(url),)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('url', 'status_code', 'content_type', 'etag', 'last_modified', 'body_hash', 'reason', 'fetched_at'), row))
+
+    def read_body(self, entry):
+        """
+        Read the text of a cached response.
+
+        Args:
+            entry - cache entry from lookup
+
+        Returns:
+            the page's text, or '' if no body was stored (e.g. for error responses)
+        """
+        if entry['body_hash'] is None:
+            return ''
+        try:
+            with gzip.open(self.body_path(entry['body_hash']), 'rb') as body:
+                return body.read().decode('utf-8')
+        except (OSError, EOFError):
+            return ''
+
+    def conditional_headers(self, entry):
+        """
+        Get the headers for revalidating a cached response with a conditional GET.
+
+        Args:
+            entry - cache entry from lookup, or None
+
+        Returns:
+            dictionary of If-None-Match and If-Modified-Since headers (empty if the response had neither an ETag nor a Last-Modified date)
+        """
+        headers = {}
+        if entry is None or entry['status_code'] != 200:
+            return headers
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def store(self, url, response, text=None, reason=None):
+        """
+        Save a response.
+
+        Args:
+            url - URL that was requested
+            response - requests.Response
+            text - the page's text, if it was read
+            reason - the reason the download was cut short ('too large', 'not html' or 'stopped'), if it was
+        """
+        body_hash = None
+        if text is not None:
+            data = text.encode('utf-8')
+            body_hash = hashlib.sha256(data).hexdigest()
+            path = self.body_path(body_hash)
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with gzip.open(temp_path, 'wb') as body:
+                    body.write(data)
+                os.replace(temp_path, path)
+        headers = response.headers
+        with self.lock:
+            conn = self.connect()
+            conn.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                         (normalize_url(url), url, response.status_code, headers.get('Content-Type'), headers.get('ETag'), headers.get('Last-Modified'),
+                          body_hash, reason, time.time()))
+            conn.commit()
+
+    def touch(self, url):
+        #Record that a cached response was revalidated
+        with self.lock:
+            conn = self.connect()
+            conn.execute('UPDATE responses SET fetched_at = ? WHERE url_key = ?', (time.time(), normalize_url(url)))
+            conn.commit()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+#Cache shared by everything in a process; off unless configure_cache turns it on
+cache_settings = {'path': CACHE_PATH, 'enabled': False, 'offline': False}
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def configure_cache(enabled=None, offline=None, path=None):
+    """
+    Change the settings of the shared cache. Takes effect the next time get_cache is called.
+
+    Args:
+        enabled - whether to cache responses
+        offline - whether to only read pages from the cache (turns the cache on)
+        path - directory to keep the cache in
+    """
+    global _default_cache
+    if enabled is not None:
+        cache_settings['enabled'] = enabled
+    if offline is not None:
+        cache_settings['offline'] = offline
+        if offline:
+            cache_settings['enabled'] = True
+    if path is not None:
+        cache_settings['path'] = path
+    with _default_lock:
+        _default_cache = None
+
+
+def get_cache():
+    """
+    Get the cache shared by everything in this process.
+
+    Returns:
+        ResponseCache using cache_settings, or None if caching is off
+    """
+    global _default_cache
+    if not cache_settings['enabled']:
+        return None
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = ResponseCache(cache_settings['path'], offline=cache_settings['offline'])
+        return _default_cache
+
+
+def is_offline():
+    return cache_settings['enabled'] and cache_settings['offline']
@@ -0,0 +1,318 @@
+import concurrent.futures
+import sqlite3
+import threading
+import time
+import urllib.parse
+import urllib.robotparser
+from requests.exceptions import SSLError, ConnectionError, Timeout, TooManyRedirects, InvalidURL, MissingSchema, InvalidSchema, RequestException
+import crawl_metrics
+import http_session
+import request_policy
+
+
+CACHE_PATH = 'robots_cache.sqlite'
+
+#robots.txt files larger than this are not read
+MAX_ROBOTS_BYTES = 512 * 1024
+
+
+def robots_url(url):
+    """
+    Get the robots.txt URL for the host of a URL.
+
+    Args:
+        url - URL of any page on the website
+
+    Returns:
+        URL of the website's robots.txt file
+    """
+    parts = urllib.parse.urlsplit(url)
+    return urllib.parse.urlunsplit((parts.scheme.lower(), parts.netloc.lower(), '/robots.txt', '', ''))
+
+
+def download_robots(robot_url):
+    """
+    Download a robots.txt file. The time taken and the outcome are recorded in crawl_metrics ('robots' phase, 'robots_download' counter).
+
+    Args:
+        robot_url - URL of the robots.txt file
+
+    Returns:
+        dictionary with 'status_code' and 'content' of the response, and 'error', which is None or one of 'SSL Error', 'timed out', 'invalid URL', 'malformed URL', 'excessive redirects' or 'content too long'
+    """
+    entry = {'status_code': None, 'content': '', 'error': None}
+    policy = request_policy.get_policy()
+    start = time.perf_counter()
+    try:
+        #Connection errors and timeouts are retried, and hosts that keep failing are skipped, as set by the shared request policy
+        response = policy.call(robot_url, http_session.fetch, robot_url, stream=True)
+        entry['status_code'] = response.status_code
+        if response.status_code == 200:
+            content, reason = http_session.read_text(response, max_bytes=MAX_ROBOTS_BYTES, deadline=policy.deadline())
+            if reason == 'too large':
+                entry['error'] = 'content too long'
+            entry['content'] = content
+        else:
+            response.close()
+    except SSLError:
+        entry['error'] = 'SSL Error'
+    except Timeout:
+        entry['error'] = 'timed out'
+    except TooManyRedirects:
+        entry['error'] = 'excessive redirects'
+    except (MissingSchema, InvalidSchema, InvalidURL, ValueError):
+        entry['error'] = 'malformed URL'
+    except (ConnectionError, RequestException):
+        entry['error'] = 'invalid URL'
+    seconds = time.perf_counter() - start
+    metrics = crawl_metrics.get_metrics()
+    metrics.observe('robots', seconds)
+    metrics.count('robots_download', entry['error'] or entry['status_code'])
+    metrics.log('robots', url=robot_url, seconds=round(seconds, 4), status_code=entry['status_code'], error=entry['error'])
+    return entry
+
+
+class RobotsCache:
+    """
+    Cache of robots.txt files, one per host, so each host's file is downloaded once per TTL no matter how many of its pages are checked.
+
+    Files are kept in memory and saved to a SQLite database, so the cache is shared between runs and between scripts (get_scrapability.py and email_crawler.py).
+    Failed downloads are cached too, for a shorter time (error_ttl). It is safe to use from several threads, and threads that miss on the same file at once share one download.
+    """
+
+    def __init__(self, path=CACHE_PATH, ttl=24*60*60, error_ttl=60*60):
+        """
+        Args:
+            path - file path of the SQLite database, or None to only cache in memory
+            ttl - seconds to keep a downloaded robots.txt file
+            error_ttl - seconds to keep a failed download before trying again
+        """
+        self.path = path
+        self.ttl = ttl
+        self.error_ttl = error_ttl
+        self.memory = {}
+        #Futures for the files being downloaded right now, by robots.txt URL
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.conn = None
+        if path is not None:
+            self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS robots (
+                    robots_url TEXT PRIMARY KEY,
+                    status_code INTEGER,
+                    content TEXT NOT NULL,
+                    error TEXT,
+                    fetched_at REAL NOT NULL
+                )""")
+            self.conn.commit()
+
+    def is_fresh(self, entry):
+        ttl = self.error_ttl if entry['error'] is not None else self.ttl
+        return time.time() - entry['fetched_at'] <= ttl
+
+    def lookup(self, robot_url):
+        """
+        Look up a cached robots.txt file without downloading it.
+
+        Args:
+            robot_url - URL of the robots.txt file
+
+        Returns:
+            the cached entry (see download_robots, plus 'fetched_at'), or None if it is not cached or has expired
+        """
+        with self.lock:
+            entry = self.memory.get(robot_url)
+            if entry is None and self.conn is not None:
+                row = self.conn.execute('SELECT status_code, content, error, fetched_at FROM robots WHERE robots_url = ?', (robot_url,)).fetchone()
+                if row is not None:
+                    entry = {'status_code': row[0], 'content': row[1], 'error': row[2], 'fetched_at': row[3]}
+                    self.memory[robot_url] = entry
+        if entry is None or not self.is_fresh(entry):
+            return None
+        return entry
+
+    def store(self, robot_url, entry):
+        entry = dict(entry, fetched_at=time.time())
+        with self.lock:
+            self.memory[robot_url] = entry
+            if self.conn is not None:
+                self.conn.execute('INSERT OR REPLACE INTO robots VALUES (?, ?, ?, ?, ?)',
+                                  (robot_url, entry['status_code'], entry['content'], entry['error'], entry['fetched_at']))
+                self.conn.commit()
+        return entry
+
+    def get(self, robot_url):
+        """
+        Get a robots.txt file, downloading it only if it is not cached or has expired.
+
+        Args:
+            robot_url - URL of the robots.txt file
+
+        Returns:
+            dictionary with 'status_code', 'content', 'error' and 'fetched_at' (see download_robots)
+        """
+        entry = self.lookup(robot_url)
+        if entry is not None:
+            return entry
+        #Only one thread downloads a given file; others that miss at the same time wait for its result
+        with self.lock:
+            entry = self.memory.get(robot_url)
+            if entry is not None and self.is_fresh(entry):
+                return entry
+            future = self.in_flight.get(robot_url)
+            downloading = future is None
+            if downloading:
+                future = concurrent.futures.Future()
+                self.in_flight[robot_url] = future
+        if not downloading:
+            return future.result()
+        try:
+            entry = self.store(robot_url, download_robots(robot_url))
+            future.set_result(entry)
+            return entry
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight[robot_url]
+
+    def get_parser(self, robot_url, entry):
+        #Parsed files are kept alongside the entry, so each file is parsed once
+        parser = entry.get('parser')
+        if parser is None:
+            parser = urllib.robotparser.RobotFileParser(robot_url)
+            parser.parse(entry['content'].splitlines())
+            entry['parser'] = parser
+        return parser
+
+    def evaluate(self, robot_url, entry, url, user_agent='*'):
+        """
+        Check a page against a robots.txt entry, using the stdlib robots.txt parser.
+
+        Status codes are treated the same way as reppy: 401 and 403 disallow everything, and other error codes allow everything.
+
+        Args:
+            robot_url - URL of the robots.txt file
+            entry - cache entry for the file (see get)
+            url - URL of the page
+            user_agent - user agent to check the rules for
+
+        Returns:
+            True or False, or the error string from download_robots if robots.txt could not be read ('excessive redirects' counts as allowed)
+        """
+        if entry['error'] == 'excessive redirects':
+            return True
+        if entry['error'] is not None:
+            return entry['error']
+        if entry['status_code'] in (401, 403):
+            return False
+        if entry['status_code'] != 200:
+            return True
+        return self.get_parser(robot_url, entry).can_fetch(user_agent, url)
+
+    def can_fetch(self, url, user_agent='*'):
+        """
+        Check robots.txt to see if a page can be scraped, downloading robots.txt only if it is not cached. See evaluate.
+
+        Args:
+            url - URL of the page
+            user_agent - user agent to check the rules for
+
+        Returns:
+            True or False, or the error string from download_robots if robots.txt could not be read
+        """
+        robot_url = robots_url(url)
+        return self.evaluate(robot_url, self.get(robot_url), url, user_agent)
+
+    def crawl_delay(self, url, user_agent='*'):
+        """
+        Get the Crawl-delay a website's robots.txt asks for, downloading robots.txt only if it is not cached.
+
+        Args:
+            url - URL of any page on the website
+            user_agent - user agent to read the delay for
+
+        Returns:
+            seconds between requests, or None if robots.txt sets no delay or could not be read
+        """
+        robot_url = robots_url(url)
+        entry = self.get(robot_url)
+        if entry['error'] is not None or entry['status_code'] != 200:
+            return None
+        return self.get_parser(robot_url, entry).crawl_delay(user_agent)
+
+    def cached_crawl_delay(self, url, user_agent='*'):
+        """
+        Get the Crawl-delay a website's robots.txt asks for, only if the file is already cached (nothing is downloaded).
+
+        Args:
+            url - URL of any page on the website
+            user_agent - user agent to read the delay for
+
+        Returns:
+            (cached, delay): whether the file is cached, and seconds between requests, or None if it sets no delay, could not be read or is not cached
+        """
+        robot_url = robots_url(url)
+        entry = self.lookup(robot_url)
+        if entry is None:
+            return False, None
+        if entry['error'] is not None or entry['status_code'] != 200:
+            return True, None
+        return True, self.get_parser(robot_url, entry).crawl_delay(user_agent)
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+#Cache shared by everything in a process, created the first time it is used
+cache_settings = {'path': CACHE_PATH, 'ttl': 24*60*60, 'error_ttl': 60*60}
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def configure_cache(path=None, ttl=None, error_ttl=None):
+    """
+    Change the settings of the shared cache. Takes effect the next time get_cache is called.
+
+    Args:
+        path - file path of the SQLite database
+        ttl - seconds to keep a downloaded robots.txt file
+        error_ttl - seconds to keep a failed download before trying again
+    """
+    global _default_cache
+    if path is not None:
+        cache_settings['path'] = path
+    if ttl is not None:
+        cache_settings['ttl'] = ttl
+    if error_ttl is not None:
+        cache_settings['error_ttl'] = error_ttl
+    with _default_lock:
+        if _default_cache is not None:
+            _default_cache.close()
+        _default_cache = None
+
+
+def get_cache():
+    """
+    Get the cache shared by everything in this process.
+
+    Returns:
+        RobotsCache using cache_settings
+    """
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = RobotsCache(cache_settings['path'], ttl=cache_settings['ttl'], error_ttl=cache_settings['error_ttl'])
+        return _default_cache
+
+
+def can_fetch(url, user_agent='*'):
+    """
+    Check robots.txt to see if a page can be scraped, using the shared cache. See RobotsCache.can_fetch.
+    """
+    return get_cache().can_fetch(url, user_agent)
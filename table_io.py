@@ -0,0 +1,278 @@
+import glob
+import os
+import pandas as pd
+#Parquet needs pyarrow; without it, checkpoints are written as CSV
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+
+#Rows per chunk when reading large CSV and Parquet files
+CHUNK_SIZE = 50000
+
+#Excel can't hold more rows than this in one sheet
+EXCEL_MAX_ROWS = 1048575
+
+
+def table_format(path):
+    """
+    Work out the format of a table from its file name.
+
+    Args:
+        path - file path; a folder is read as a checkpoint (see ChunkWriter)
+
+    Returns:
+        'csv', 'xlsx', 'parquet' or 'checkpoint'
+    """
+    if os.path.isdir(path):
+        return 'checkpoint'
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension == '.xlsx':
+        return 'xlsx'
+    if extension in ('.parquet', '.pq'):
+        return 'parquet'
+    raise ValueError("Unsupported file format, please provide a .csv, .xlsx or .parquet file: {}".format(path))
+
+
+def restore_types(df):
+    #Checkpoints store mixed columns (e.g. True, False and 'invalid URL') as text; turn 'True' and 'False' back into booleans
+    for column in df.columns:
+        if str(column).lower().startswith('scrapability') and pd.api.types.is_string_dtype(df[column].dtype):
+            df[column] = df[column].astype(object).map(lambda value: True if value == 'True' else False if value == 'False' else value)
+    return df
+
+
+def iter_table(path, chunk_size=CHUNK_SIZE, columns=None):
+    """
+    Read a table in chunks, so files of any size can be processed with flat memory use.
+
+    CSV and Parquet files are read chunk_size rows at a time, and checkpoint folders one part at a time. Excel files can't be read in chunks and are read whole.
+
+    Args:
+        path - file path of a .csv, .xlsx or .parquet file, or a checkpoint folder
+        chunk_size - rows per chunk, or None to read the whole file at once
+        columns - optional list of the columns to read
+
+    Yields:
+        DataFrames, each with an index continuing on from the previous chunk's
+    """
+    file_format = table_format(path)
+    start = 0
+    if file_format == 'csv':
+        if chunk_size is None:
+            chunks = [pd.read_csv(path, usecols=columns)]
+        else:
+            chunks = pd.read_csv(path, usecols=columns, chunksize=chunk_size)
+    elif file_format == 'xlsx':
+        chunks = [pd.read_excel(path, usecols=columns)]
+    elif file_format == 'parquet':
+        if pq is None:
+            raise ImportError("Reading .parquet files needs pyarrow: pip install pyarrow")
+        if chunk_size is None:
+            chunks = [pd.read_parquet(path, columns=columns)]
+        else:
+            chunks = (batch.to_pandas() for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size, columns=columns))
+    else:
+        chunks = (read_part(part, columns) for part in ChunkWriter.parts(path))
+    for chunk in chunks:
+        chunk.index = range(start, start + len(chunk))
+        start += len(chunk)
+        yield restore_types(chunk)
+
+
+def read_table(path, columns=None):
+    """
+    Read a whole table.
+
+    Args:
+        path - file path of a .csv, .xlsx or .parquet file, or a checkpoint folder
+        columns - optional list of the columns to read
+
+    Returns:
+        DataFrame
+    """
+    chunks = list(iter_table(path, chunk_size=None, columns=columns))
+    if len(chunks) == 1:
+        return chunks[0]
+    if not chunks:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def read_part(path, columns=None):
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path, columns=columns)
+    return pd.read_csv(path, usecols=columns)
+
+
+def to_storable(df):
+    #Parquet columns must have one type, so mixed text columns (e.g. True, False and 'site skipped') are stored as text
+    df = df.copy()
+    for column in df.columns:
+        if df[column].dtype == object:
+            values = df[column].dropna()
+            if not values.map(lambda value: isinstance(value, str)).all():
+                df[column] = df[column].map(lambda value: value if is_missing(value) else str(value))
+    return df
+
+
+def write_table(df, path):
+    """
+    Write a whole table, in the format given by the file name.
+
+    Args:
+        df - DataFrame to write
+        path - file path ending in .csv, .xlsx or .parquet
+    """
+    file_format = table_format(path)
+    temp_path = path + '.tmp'
+    if file_format == 'csv':
+        df.to_csv(temp_path, index=False)
+    elif file_format == 'parquet':
+        if pq is None:
+            raise ImportError("Writing .parquet files needs pyarrow: pip install pyarrow")
+        to_storable(df).to_parquet(temp_path, index=False)
+    else:
+        if len(df) > EXCEL_MAX_ROWS:
+            raise ValueError(f"{len(df)} rows is more than an Excel sheet can hold; write a .csv or .parquet file instead")
+        #Written through a file handle, since pandas picks the Excel writer from the extension
+        with open(temp_path, 'wb') as temp_file:
+            df.to_excel(temp_file, index=False, engine='openpyxl')
+    #Write then rename, so an interrupted write never leaves a half-written file behind
+    os.replace(temp_path, path)
+
+
+def checkpoint_path(output_path):
+    """
+    Get the checkpoint folder used while writing an output file.
+
+    Args:
+        output_path - file path of the final output
+
+    Returns:
+        folder path next to the output, e.g. 'scrapability.checkpoint' for 'scrapability.xlsx'
+    """
+    return os.path.splitext(output_path)[0] + '.checkpoint'
+
+
+class ChunkWriter:
+    """
+    Checkpoint of a table that is written one chunk at a time: a folder with one Parquet (or, without pyarrow, CSV) file per chunk.
+
+    Rewriting a chunk only rewrites its own file, so saving progress costs the same however large the whole table is,
+    and a checkpoint folder can be read back with iter_table or read_table like any other table (e.g. to pick up an interrupted run).
+    """
+
+    def __init__(self, path, file_format=None):
+        """
+        Args:
+            path - folder to write the chunks to
+            file_format - 'parquet' or 'csv'; defaults to Parquet when pyarrow is installed
+        """
+        if file_format is None:
+            file_format = 'parquet' if pq is not None else 'csv'
+        if file_format == 'parquet' and pq is None:
+            raise ImportError("Parquet checkpoints need pyarrow: pip install pyarrow")
+        self.path = path
+        self.file_format = file_format
+        os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def parts(path):
+        #Chunk files in order; each chunk has one file, whichever format it was written in
+        return sorted(glob.glob(os.path.join(path, 'part-*.parquet')) + glob.glob(os.path.join(path, 'part-*.csv')))
+
+    def read_part(self, number):
+        """
+        Read back a chunk written by an earlier run.
+
+        Args:
+            number - chunk number, from 0
+
+        Returns:
+            DataFrame, or None if the chunk hasn't been written
+        """
+        for path in glob.glob(os.path.join(self.path, f"part-{number:06d}.*")):
+            if not path.endswith('.tmp'):
+                return restore_types(read_part(path))
+        return None
+
+    def write_part(self, number, df):
+        """
+        Write (or rewrite) one chunk.
+
+        Args:
+            number - chunk number, from 0
+            df - the chunk
+        """
+        base = os.path.join(self.path, f"part-{number:06d}")
+        path = f"{base}.{self.file_format}"
+        write_table(df, path)
+        #Drop a copy of the chunk left in the other format by an earlier run
+        for old in glob.glob(base + '.*'):
+            if old != path and not old.endswith('.tmp'):
+                os.remove(old)
+
+    def export(self, output_path):
+        """
+        Combine the chunks into the final output file. CSV and Excel output is written one chunk at a time; Parquet output is combined in memory.
+
+        Args:
+            output_path - file path ending in .csv, .xlsx or .parquet
+        """
+        file_format = table_format(output_path)
+        temp_path = output_path + '.tmp'
+        if file_format == 'parquet':
+            write_table(read_table(self.path), output_path)
+            return
+        if file_format == 'csv':
+            header = True
+            for chunk in iter_table(self.path):
+                chunk.to_csv(temp_path, index=False, header=header, mode='w' if header else 'a')
+                header = False
+        else:
+            export_excel(iter_table(self.path), temp_path)
+        os.replace(temp_path, output_path)
+
+
+def export_excel(chunks, path):
+    """
+    Write chunks of a table to an Excel file one row at a time, with openpyxl's write-only mode, so the whole table never has to be held in memory.
+
+    Args:
+        chunks - iterable of DataFrames with the same columns
+        path - file path of the Excel file
+    """
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    rows = 0
+    header = False
+    for chunk in chunks:
+        if not header:
+            sheet.append([str(column) for column in chunk.columns])
+            header = True
+        rows += len(chunk)
+        if rows > EXCEL_MAX_ROWS:
+            raise ValueError(f"More than {EXCEL_MAX_ROWS} rows; write a .csv or .parquet file instead")
+        for row in chunk.itertuples(index=False):
+            sheet.append([excel_value(value) for value in row])
+    workbook.save(path)
+
+
+def excel_value(value):
+    #Same conversions as DataFrame.to_excel: lists are written as text and missing values as empty cells
+    if isinstance(value, (list, tuple, set, dict)):
+        return str(value)
+    if is_missing(value):
+        return None
+    return value
+
+
+def is_missing(value):
+    #pd.isna checks each item of a list (e.g. a row's emails), so only ask it about single values
+    return pd.api.types.is_scalar(value) and pd.isna(value)
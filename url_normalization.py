@@ -0,0 +1,221 @@
+import re
+import urllib.parse
+import pandas as pd
+#With pyarrow, normalize_urls runs its regexes in C++ over whole columns; without it pandas runs them in a Python loop per row
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+#An http(s) URL inside a longer piece of text, e.g. 'Visit us at http://example.com'
+URL_IN_TEXT = r"https?://[^\s]+"
+
+#Parts of an absolute URL; the fragment is matched so it can be dropped. The netloc is split like urlsplit does: user info up to the last '@', then the host and port.
+#The '@', ':' and '?' separators are kept in the optional parts, so a missing part and an empty one come out the same with or without pyarrow.
+#Anything between a bracketed IPv6 host and the port or path (e.g. 'http://[::1]page') stays in the host, as it does in urlsplit's netloc, so such URLs are flagged malformed
+URL_PARTS = r"^(?P<scheme>[^:/?#]*)://(?P<userinfo>[^/?#]*@)?(?P<host>\[[^\]/?#]*\][^:/?#]*|[^:/?#]*)(?P<port>:[^/?#]*)?(?P<path>[^?#]*)(?P<query>\?[^#]*)?(?:#.*)?$"
+
+#Hostnames that can be looked up: dot-separated labels of letters, digits, '-' and '_' (after IDNA encoding), IPv6 addresses in brackets, or localhost
+VALID_HOST = r"^(?:\[[0-9a-f:.]+\]|(?:[a-z0-9_](?:[a-z0-9_-]*[a-z0-9_])?\.)+[a-z0-9_-]*[a-z0-9_]|localhost)$"
+
+
+def find_url(text):
+    """
+    Find the http(s) URL in a piece of text that has more than a URL in it, e.g. a link with extra text attached to the beginning.
+
+    Args:
+        text - string
+
+    Returns:
+        the first URL in the text, or None if there isn't one
+    """
+    match = re.search(URL_IN_TEXT, text)
+    return match.group() if match is not None else None
+
+
+def idna_host(host):
+    #Non-ASCII hostnames (e.g. bücher.de) in the ASCII form DNS and HTTP use (xn--bcher-kva.de); hosts that can't be encoded are returned as they are
+    if host.isascii():
+        return host
+    try:
+        return host.encode('idna').decode('ascii')
+    except UnicodeError:
+        return host
+
+
+#Normalize a URL so the same website written two ways gets the same key
+def normalize_url(url):
+    """
+    Normalize a URL for use as a lookup key: trims whitespace, adds a missing scheme, lowercases the scheme and host (IDNA-encoding non-ASCII hosts), drops default ports, fragments and trailing slashes.
+    normalize_urls computes the same key for a whole column at once.
+
+    Args:
+        url - URL string
+
+    Returns:
+        normalized URL string, or '' if the URL is missing
+    """
+    if not isinstance(url, str):
+        return ''
+    url = url.strip()
+    if url == '':
+        return ''
+    if '://' not in url:
+        url = 'https://' + url
+    parts = urllib.parse.urlsplit(url)
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if not netloc.isascii() or '.:' in netloc or netloc.endswith('.'):
+        #Encode the host and drop a trailing dot from it (example.com. is example.com), leaving any user info and port alone
+        userinfo, at, hostport = netloc.rpartition('@')
+        host, colon, port = hostport.partition(':') if not hostport.startswith('[') else (hostport, '', '')
+        netloc = userinfo + at + idna_host(host.rstrip('.')) + colon + port
+    if (scheme == 'http' and netloc.endswith(':80')) or (scheme == 'https' and netloc.endswith(':443')):
+        netloc = netloc.rsplit(':', 1)[0]
+    path = parts.path.rstrip('/')
+    return urllib.parse.urlunsplit((scheme, netloc, path, parts.query, ''))
+
+
+#Clean and validate a whole column of URLs at once
+def normalize_urls(series):
+    """
+    Clean a column of website URLs with vectorized string operations, so million-row inputs take seconds instead of a Python loop per row.
+
+    Each URL is trimmed and cut at the first space (or, when the text has a space, the http(s) URL in it is taken), gets https:// if it has no scheme,
+    its scheme and host are lowercased, a non-ASCII host is IDNA-encoded, a trailing dot is dropped from the host, and the fragment is dropped.
+
+    Args:
+        series - pandas Series of URLs; missing values and blank strings are allowed
+
+    Returns:
+        DataFrame with the same index and the columns:
+            url - the cleaned URL, for requesting; missing for missing or blank rows
+            key - the same key as normalize_url(url), for dedup and for joining results across scripts and runs
+            origin - scheme://host[:port] of the cleaned URL (robots.txt is origin + '/robots.txt'); missing if the text isn't shaped like a URL
+            malformed - True for URLs that can't be requested: a scheme other than http(s), no valid host, or a bad port
+            duplicate - True for well-formed URLs whose key appeared on an earlier row
+    """
+    text = series
+    if pd.api.types.infer_dtype(series, skipna=True) not in ('string', 'empty'):
+        text = series.where(series.map(lambda value: isinstance(value, str)))
+    text = text.astype(pd.ArrowDtype(pyarrow.string()) if pyarrow is not None else 'string').str.strip()
+    text = text.mask(text == '')
+    spaced = text.str.contains(r"\s", regex=True).fillna(False)
+    if spaced.any():
+        embedded = text[spaced].str.extract('(?P<url>' + URL_IN_TEXT + ')')['url']
+        text = text.mask(spaced, embedded.fillna(text[spaced].str.replace(r"\s.*", '', regex=True)))
+    text = text.mask(~text.str.contains('://', regex=False).fillna(True), 'https://' + text)
+
+    parts = text.str.extract(URL_PARTS)
+    matched = parts['scheme'].notna()
+    parts = parts.fillna('')
+    scheme = parts['scheme'].str.lower()
+    host = parts['host'].str.lower().str.rstrip('.')
+    encoded = host.str.contains(r"[^\x00-\x7f]", regex=True).fillna(False)
+    if encoded.any():
+        #Each distinct host is encoded once; the IDNA codec is slow
+        encodings = {value: idna_host(value) for value in host[encoded].unique()}
+        host = host.mask(encoded, host[encoded].map(encodings).astype(host.dtype))
+    userinfo = parts['userinfo'].str.lower()
+    port = parts['port'].str.lower()
+    path = parts['path']
+    #urlunsplit leaves out an empty query's '?'
+    query = parts['query'].mask(parts['query'] == '?', '')
+
+    origin = scheme + '://' + userinfo + host + port
+    url = origin + path + query
+    default_port = ((scheme == 'http') & (port == ':80')) | ((scheme == 'https') & (port == ':443'))
+    key = scheme + '://' + userinfo + host + port.mask(default_port, '') + path.str.rstrip('/') + query
+
+    valid_port = (port == '') | port.str.fullmatch(r":\d{0,5}")
+    if (port.str.len() == 6).any():
+        valid_port &= ~(pd.to_numeric(port.str.slice(1), errors='coerce') > 65535)
+    malformed = text.notna() & ~(matched & scheme.isin(['http', 'https']) & host.str.fullmatch(VALID_HOST) & valid_port).fillna(False)
+
+    #Text that isn't shaped like a URL at all is kept as it is (and flagged malformed)
+    url = url.where(matched, text)
+    key = key.where(matched, text)
+    duplicate = (~malformed & key.notna() & key.duplicated()).fillna(False)
+    return pd.DataFrame({'url': url.astype(object).where(text.notna(), None),
+                         'key': key.astype(object).where(text.notna(), None),
+                         'origin': origin.astype(object).where(matched, None),
+                         'malformed': malformed.astype(bool),
+                         'duplicate': duplicate.astype(bool)}, index=series.index)
+
+
+#Click IDs added by ad networks, analytics and email tools; they never change which page is served.
+#Generic names like ref, source or sid are kept, since many sites use them to pick the content.
+TRACKING_PARAMS = {'fbclid', 'gclid', 'gbraid', 'wbraid', 'dclid', 'msclkid', 'yclid', 'igshid', 'twclid', 'ttclid', 'li_fat_id', 'mc_cid', 'mc_eid',
+                   '_ga', '_gl', '_hsenc', '_hsmkt', 'hsctatracking', 'mkt_tok'}
+TRACKING_PREFIXES = ('utm_',)
+
+
+def canonicalize_url(url):
+    """
+    Canonicalize a link for fetching: lowercases the scheme and host, drops default ports, the fragment and tracking query parameters (utm_*, fbclid, gclid, ...), and gives an empty path a '/'.
+    Unlike normalize_url, the path is kept as it is (trailing slash included), and the query parameters that remain are kept exactly as written, so the result can be requested.
+
+    Args:
+        url - absolute URL string
+
+    Returns:
+        canonical URL string, or '' if the URL is missing or malformed
+    """
+    if not isinstance(url, str) or url.strip() == '':
+        return ''
+    try:
+        parts = urllib.parse.urlsplit(url.strip())
+        port = parts.port
+    except ValueError:
+        return ''
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or '').lower()
+    if ':' in netloc:
+        netloc = '[' + netloc + ']'
+    if port is not None and not ((scheme == 'http' and port == 80) or (scheme == 'https' and port == 443)):
+        netloc += ':' + str(port)
+    #Parameters are kept as written (not decoded and re-encoded), since servers don't all decode '+', '%20' and reserved characters the same way
+    query = [piece for piece in parts.query.split('&') if piece and not is_tracking_param(piece.split('=', 1)[0])]
+    return urllib.parse.urlunsplit((scheme, netloc, parts.path or '/', '&'.join(query), ''))
+
+
+def is_tracking_param(name):
+    #name is a query parameter name as written in the URL, possibly percent-encoded
+    name = urllib.parse.unquote_plus(name).lower()
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PREFIXES)
+
+
+def site_host(url):
+    """
+    Get the host of a URL without a leading 'www.', for telling whether two URLs are on the same site.
+
+    Args:
+        url - URL string
+
+    Returns:
+        lowercased host, or '' if the URL has none
+    """
+    try:
+        host = urllib.parse.urlsplit(url).hostname or ''
+    except ValueError:
+        return ''
+    return host[4:] if host.startswith('www.') else host
+
+
+def is_same_site(url, site_url):
+    """
+    Check whether a URL is on the same site as another: the same host (ignoring 'www.'), or a subdomain of it or of which it is a subdomain.
+
+    Args:
+        url - URL to check
+        site_url - URL of the site, e.g. its homepage
+
+    Returns:
+        True if url is on the same site
+    """
+    host = site_host(url)
+    site = site_host(site_url)
+    if host == '' or site == '':
+        return False
+    return host == site or host.endswith('.' + site) or site.endswith('.' + host)